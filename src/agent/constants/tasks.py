@@ -1,22 +1,25 @@
 import json
-from typing import Dict, Any, List, Union, Callable
+from typing import Dict, Any, List, Optional, Union, Callable
 from dataclasses import dataclass
-from functions.filiter import FieldSearchCriteria, search_fields
-import shutil
-from datetime import datetime
-import os
+from functions.filiter import FieldSearchCriteria, filter_parcels
+from functions.filter_expr import parse_filter
+from functions.fix_reorganization import parse_edits, apply_edits
+from functions.parcel_store import get_parcel_store, ROW_LAYER, MAP_LAYER, REORG_LAYER
+from functions.workspace import Workspace
 import geopandas as gpd
 import math
-from functions.reorganize import Scenario, reorganize
+from functions.reorganize import Scenario, refresh_edited_parcels, reorganize_split
+from functions.reorganize_cache import cached_reorganize
 import random as rand
 from functions.cropsimulation import run_simulation
 
-def reorganize_farmland(params_json: str) -> dict:
+def reorganize_farmland(params_json: str, workspace: Optional[Workspace] = None) -> dict:
     """
     農地再編成関数
 
     Args:
         params_json (str): JSON形式の再編成条件
+        workspace (Workspace, optional): セッションの作業領域（省略時は共有の地図を使う）
 
     Returns:
         dict: 再編成結果
@@ -26,36 +29,42 @@ def reorganize_farmland(params_json: str) -> dict:
         params = json.loads(params_json)
         print(params)
 
-        # GeoJSONデータの読み込み
-        with open('src/app/ref/map.geojson', 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
-        print("GeoJSONデータを読み込みました")
-
-        # バックアップ作成
-        src_path = 'src/app/ref/map-reorg.geojson'
-        if os.path.exists(src_path):
-            time = datetime.now().strftime('%Y%m%d%H%M%S')
-            dest_path = f'src/app/ref/backup/map-reorg-{time}.geojson'
-        print(f"バックアップを作成します: {src_path} -> {dest_path}")
-
-        shutil.copy(src_path, dest_path)
-        print(f"ファイルをコピーしました: {src_path} -> {dest_path}")
+        # 農地データの読み込み
+        store = workspace or get_parcel_store()
+        parcels = store.load(MAP_LAYER)
+        if len(parcels) == 0:
+            return {
+                "status": "error",
+                "error": "再編成する農地がありません。先に農地を検索してください",
+                "scenario_applied": None,
+                "results": []
+            }
+        print("農地データを読み込みました")
 
         # Scenarioデータクラスへの変換
         scenario = Scenario(
             ta_farmer_N=params.get("ta_farmer_N", 0),
             hata_farmer_N=params.get("hata_farmer_N", 0),
             ta_exfarmer_ids_and_rates=params.get("ta_exfarmer_ids_and_rates", {}),
-            hata_exfarmer_ids_and_rates=params.get("hata_exfarmer_ids_and_rates", {})
+            hata_exfarmer_ids_and_rates=params.get("hata_exfarmer_ids_and_rates", {}),
+            method=params.get("method", "capacity"),
+            optimize_seconds=float(params.get("optimize_seconds", 0))
         )
 
         # 農地再編成の実行
-        reorganized_geojson, analysis_result = reorganize(geojson_data, scenario)
+        split_by = params.get("split_by")
+        if split_by:
+            # 集落（"settlement"）またはタイル（"tile"）ごとに分けて再編成する
+            reorganized_parcels, analysis_result = reorganize_split(parcels, scenario, by=split_by)
+        else:
+            # 同じ地図・同じシナリオの結果が保存されていればそれを使う
+            source = get_parcel_store().stamp(ROW_LAYER)
+            reorganized_parcels, analysis_result = cached_reorganize(parcels, scenario, source=source)
         print("再編成完了")
 
-        # 再編成結果をファイルに保存
-        with open('src/app/ref/map-reorg.geojson', 'w', encoding='utf-8') as f:
-            json.dump(reorganized_geojson, f, ensure_ascii=False, indent=2)
+        # 再編成結果を保存（変更された農地のみ履歴に記録）
+        version = store.save(REORG_LAYER, reorganized_parcels, message="再編成")
+        print(f"再編成結果を保存しました: 版{version}")
 
         return {
             "status": "success",
@@ -63,9 +72,13 @@ def reorganize_farmland(params_json: str) -> dict:
                 "ta_farmer_N": scenario.ta_farmer_N,
                 "hata_farmer_N": scenario.hata_farmer_N,
                 "ta_exfarmer_ids_and_rates": scenario.ta_exfarmer_ids_and_rates,
-                "hata_exfarmer_ids_and_rates": scenario.hata_exfarmer_ids_and_rates
+                "hata_exfarmer_ids_and_rates": scenario.hata_exfarmer_ids_and_rates,
+                "method": scenario.method,
+                "optimize_seconds": scenario.optimize_seconds,
+                "split_by": split_by
             },
-            "result_geojson": reorganized_geojson,
+            "version": version,
+            "result_parcels": reorganized_parcels,
             "analysis_result": analysis_result
         }
 
@@ -91,12 +104,13 @@ def reorganize_farmland(params_json: str) -> dict:
             "results": []
         }
 
-def filter_farmland(params_json: str) -> dict:
+def filter_farmland(params_json: str, workspace: Optional[Workspace] = None) -> dict:
     """
     農地フィルタリング関数
 
     Args:
         params_json (str): JSON形式の検索条件
+        workspace (Workspace, optional): セッションの作業領域（省略時は共有の地図を使う）
 
     Returns:
         dict: フィルタリング結果
@@ -117,39 +131,32 @@ def filter_farmland(params_json: str) -> dict:
             city_code=params.get("city_code"),
             usage_situation=params.get("usage_situation"),
             classification=params.get("classification"),
-            settlement=params.get("settlement")
+            settlement=params.get("settlement"),
+            where=parse_filter(params["where"]) if params.get("where") else None,
+            bbox=params.get("bbox"),
+            center=params.get("center"),
+            radius_m=float(params["radius_m"]) if params.get("radius_m") else None,
+            polygon=params.get("polygon")
         )
 
-        # GeoJSONデータの読み込み
-        with open('src/app/ref/map-row.geojson', 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
-
-        src_path = 'src/app/ref/map.geojson'
-        time = datetime.now().strftime('%Y%m%d%H%M%S')
-        dest_path = f'src/app/ref/backup/map-{time}.geojson'
-
-        shutil.copy(src_path, dest_path)
-        print(f"ファイルをコピーしました: {src_path} -> {dest_path}")
+        # 農地データの読み込み（検索条件に関係する分割のみ）
+        store = workspace or get_parcel_store()
+        partitions = store.select_partitions(
+            ROW_LAYER,
+            prefecture_code=search_criteria.prefecture_code,
+            city_code=search_criteria.city_code,
+            settlement=search_criteria.settlement,
+            bounds=search_criteria.bounds()
+        )
+        parcels = store.load(ROW_LAYER, partitions)
 
         #  検索結果を取得
-        filtered_features = search_fields(geojson_data, search_criteria)
-
-        # 新しいGeoJSONを構築
-        filtered_geojson = {
-            "type": "FeatureCollection",
-            "name": "filtered_merged_polygon_with_farm_pin",
-            "crs": {
-                "type": "name",
-                "properties": {
-                    "name": "urn:ogc:def:crs:OGC:1.3:CRS84"
-                }
-            },
-            "features": filtered_features
-        }
+        spatial_index = store.load_spatial_index(ROW_LAYER, partitions) if search_criteria.has_spatial_filter() else None
+        filtered_parcels = filter_parcels(parcels, search_criteria, store.load_index(ROW_LAYER, partitions), spatial_index)
 
-        # フィルタリング結果をファイルに保存
-        with open('src/app/ref/map.geojson', 'w', encoding='utf-8') as f:
-            json.dump(filtered_geojson, f, ensure_ascii=False, indent=2)
+        # フィルタリング結果を保存（変更された農地のみ履歴に記録）
+        version = store.save(MAP_LAYER, filtered_parcels, message="フィルタリング")
+        print(f"フィルタリング結果を保存しました: 版{version}")
 
         return {
             "status": "success",
@@ -162,9 +169,16 @@ def filter_farmland(params_json: str) -> dict:
                 "prefecture_code": search_criteria.prefecture_code,
                 "city_code": search_criteria.city_code,
                 "usage_situation": search_criteria.usage_situation,
-                "classification": search_criteria.classification
+                "classification": search_criteria.classification,
+                "where": params.get("where"),
+                "bbox": search_criteria.bbox,
+                "center": search_criteria.center,
+                "radius_m": search_criteria.radius_m,
+                "polygon": search_criteria.polygon
             },
-            "results": filtered_geojson
+            "version": version,
+            "result_count": len(filtered_parcels),
+            "results": filtered_parcels
         }
 
     except json.JSONDecodeError as e:
@@ -189,15 +203,18 @@ def filter_farmland(params_json: str) -> dict:
             "results": []
         }
 
-def color_farmland(data):
+def color_farmland(data, workspace: Optional[Workspace] = None):
     pass
 
-def fix_reorg(params_json: str) -> dict:
+def fix_reorg(params_json: str, workspace: Optional[Workspace] = None) -> dict:
     """
     農地再編成後の修正関数
 
+    複数の修正をまとめて受け付け、変更した農地のみを一つの版として記録する。
+
     Args:
         params_json (str): JSON形式の修正条件
+        workspace (Workspace, optional): セッションの作業領域（省略時は共有の地図を使う）
 
     Returns:
         dict: 修正結果
@@ -206,69 +223,48 @@ def fix_reorg(params_json: str) -> dict:
         # JSONパース
         params = json.loads(params_json)
         print(params)
+        edits = parse_edits(params)
+
+        # 農地データの読み込み
+        store = workspace or get_parcel_store()
+        index = store.load_index(REORG_LAYER)
+        parcels = store.load(REORG_LAYER).copy()
+
+        # 修正をまとめて適用
+        result = apply_edits(parcels, edits, index)
 
-        # GeoJSONデータの読み込み
-        with open('src/app/ref/map-reorg.geojson', 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
-
-        # バックアップ作成
-        src_path = 'src/app/ref/map-reorg.geojson'
-        time = datetime.now().strftime('%Y%m%d%H%M%S')
-        dest_path = f'src/app/ref/backup/map-reorg-{time}.geojson'
-
-        shutil.copy(src_path, dest_path)
-        print(f"ファイルをコピーしました: {src_path} -> {dest_path}")
-
-        # 特定の農地の情報を更新
-        target_address = params.get("target_address")
-        new_farmer_id = params.get("new_farmer_id")
-        new_land_type = params.get("new_farm_type")
-
-        updated_count = 0
-        updates = []
-
-        for feature in geojson_data['features']:
-            properties = feature['properties']
-            if properties['Address'] == target_address:
-                # 農家IDを更新
-                old_farmer_id = properties['FarmerIndicationNumberHash']
-                properties['FarmerIndicationNumberHash'] = new_farmer_id
-
-                # 農地種類の更新（指定がある場合のみ）
-                if new_land_type is not None:
-                    old_type = properties.get('ClassificationOfLand', '')
-                    properties['ClassificationOfLand'] = new_land_type
-                    properties['ClassificationOfLandCodeName'] = '田' if new_land_type == '1' else '畑'
-                    updates.append({
-                        'address': properties['Address'],
-                        'old_farmer_id': old_farmer_id,
-                        'old_type': '田' if old_type == '1' else '畑',
-                        'new_type': '田' if new_land_type == '1' else '畑'
-                    })
-
-                updated_count += 1
-
-        if updated_count == 0:
+        if result.updated_count == 0:
             return {
-                "status":
-                "error",
-                "error": f"指定された住所 '{target_address}' に一致する農地が見つかりませんでした。",
+                "status": "error",
+                "error": "指定された条件に一致する農地が見つかりませんでした: "
+                         + "、".join(edit.describe() for edit in result.unmatched),
                 "results": []
             }
-        else:
-            with open('src/app/ref/map-reorg.geojson', 'w', encoding='utf-8') as f:
-                json.dump(geojson_data, f, ensure_ascii=False, indent=2)
-            message = f"{updated_count}件の農地情報を更新しました。"
-            if updates:
-                message += "\n農地種類の変更内容:"
-                for update in updates:
-                    message += f"\n- {update['address']}: {update['old_type']} → {update['new_type']}"
-                return {
-                    "status": "success",
-                    "message": message,
-                    "updated_count": updated_count,
-                    "land_type_updates": updates
-                }
+
+        # 農家を変更した農地の区画・コスト分析結果を変更後の農家に合わせる（変更した農地のみ）
+        parcels = refresh_edited_parcels(parcels, result.changed)
+
+        # 変更した農地のみ履歴に記録
+        version = store.update(
+            REORG_LAYER, parcels, result.changed,
+            message=f"{len(edits)}件の修正（{result.updated_count}区画）"
+        )
+        message = f"{result.updated_count}件の農地情報を更新しました。"
+        if result.land_type_updates:
+            message += "\n農地種類の変更内容:"
+            for update in result.land_type_updates:
+                message += f"\n- {update['address']}: {update['old_type']} → {update['new_type']}"
+        if result.unmatched:
+            message += "\n一致する農地が見つからなかった修正:"
+            for edit in result.unmatched:
+                message += f"\n- {edit.describe()}"
+        return {
+            "status": "success",
+            "message": message,
+            "version": version,
+            "updated_count": result.updated_count,
+            "land_type_updates": result.land_type_updates
+        }
     except json.JSONDecodeError as e:
         return {
             "status": "error",
@@ -289,8 +285,54 @@ def fix_reorg(params_json: str) -> dict:
         }
 
 
+def restore_map(params_json: str, workspace: Optional[Workspace] = None) -> dict:
+    """
+    地図の操作を取り消す、または過去の版に戻す関数
 
-def crop_simulation(params_json: str):
+    Args:
+        params_json (str): JSON形式の復元条件
+        workspace (Workspace, optional): セッションの作業領域（省略時は共有の地図を使う）
+
+    Returns:
+        dict: 復元結果
+    """
+    try:
+        params = json.loads(params_json)
+        print(params)
+
+        layer = REORG_LAYER if params.get("target") == "reorg" else MAP_LAYER
+        version = params.get("version")
+
+        store = workspace or get_parcel_store()
+        new_version = store.restore(layer, int(version) if version is not None else None)
+        message = f"版{version}に戻しました。" if version is not None else "直前の操作を取り消しました。"
+        return {
+            "status": "success",
+            "message": message,
+            "version": new_version,
+            "versions": store.versions(layer)
+        }
+    except json.JSONDecodeError as e:
+        return {
+            "status": "error",
+            "error": f"JSONパースエラー: {str(e)}",
+            "results": []
+        }
+    except ValueError as e:
+        return {
+            "status": "error",
+            "error": f"復元エラー: {str(e)}",
+            "results": []
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "error": f"復元処理エラー: {str(e)}",
+            "results": []
+        }
+
+
+def crop_simulation(params_json: str, workspace: Optional[Workspace] = None):
     try:
         params = json.loads(params_json)
         print(params)
@@ -338,15 +380,47 @@ TASKS: dict[int, dict[int, dict[str, Union[str, Callable]]]] = {
                 "city_code": "市区町村コード（任意）",
                 "usage_situation": "利用状況（任意）",
                 "classification": "農地区分（例：田、畑）（任意）"
-                "settlement": "農業集落名（任意）"
+                "settlement": "農業集落名（任意）",
+                "where": "AND/OR/NOTを含む条件式（任意）",
+                "bbox": "[西端経度, 南端緯度, 東端経度, 北端緯度]の範囲（任意）",
+                "center": "[経度, 緯度]の中心地点。radius_mと組み合わせて使う（任意）",
+                "radius_m": "centerからの半径（メートル）（任意）",
+                "polygon": "範囲を表すGeoJSONのgeometry（経緯度）（任意）"
             }
             ```
 
+            「または」「以外」などを含む条件は where に条件式で指定してください。
+            条件式の形式：
+            - {"and": [条件, ...]}、{"or": [条件, ...]}、{"not": 条件}
+            - {"field": "項目名", "eq": 値}
+            - {"field": "項目名", "in": [値, ...]}
+            - {"field": "項目名", "min": 下限, "max": 上限}（どちらか一方でもよい）
+            項目名は farmer_id, settlement, classification, usage_situation, prefecture_code, city_code, land_type, issue_year, area（面積）, address のいずれかです。
+
             以下は検索例です：
             1. 茨城県（08）の1000平方メートル以上の農地を検索
             2. 特定の農家（farmer_id指定）が所有する遊休農地を検索
             3. 市街化調整区域内の田を検索
             4: 大足(農業集落)の農地を検索
+            5. 筑地または内原の、1000平方メートル以上の田を検索
+            ```json
+            {
+                "where": {
+                    "and": [
+                        {"field": "settlement", "in": ["筑地", "内原"]},
+                        {"field": "classification", "eq": "田"},
+                        {"field": "area", "min": 1000}
+                    ]
+                }
+            }
+            ```
+            6. 緯度36.377、経度140.375の地点から2km以内の農地を検索
+            ```json
+            {
+                "center": [140.375, 36.377],
+                "radius_m": 2000
+            }
+            ```
 
             必要な条件のみを指定してください。指定しない条件は省略可能です。
             """,
@@ -376,8 +450,14 @@ TASKS: dict[int, dict[int, dict[str, Union[str, Callable]]]] = {
                     "hata_farmer_N" : 畑の農家総数,
                     "ta_exfarmer_ids_and_rates": 田の既存農家IDと割り当て比(整数),
                     "hata_exfarmer_ids_and_rates": 畑の既存農家IDと割り当て比(整数),
+                    "method": "割り当て方法（任意。capacity: 農家ごとの面積割合を上限に農地を直接割り当てる、clusters: 農地のまとまりごとに割り当てる。省略時は capacity）",
+                    "optimize_seconds": 割り当て後に農地の配置を改善する時間（秒、0以上の数値。任意。省略時は 0 で改善しない）,
+                    "split_by": "分けて再編成する単位（任意。settlement: 集落ごと、tile: 一定の大きさの範囲ごと。省略時は分けずに全体を再編成する）",
             }
             ```
+            method は、ユーザーが農地のまとまり（区画）単位での割り当てを求めた場合のみ "clusters" を指定してください。
+            optimize_seconds は、ユーザーが配置の改善（集約の最適化）を求めた場合のみ指定してください（例：10）。
+            split_by は、ユーザーが市区町村全体など広い範囲の再編成や、集落ごとの再編成を求めた場合のみ指定してください。
 
             以下は指定例です：
             田の農家数は5
@@ -414,21 +494,48 @@ TASKS: dict[int, dict[int, dict[str, Union[str, Callable]]]] = {
             "description": """
             農地の再編成を行うエージェントです。
             特に再編成した農地に関して、特定の区画の所有者と農地の種類を変更したい場合に修正を実行するエージェントです。
-            農地の修正をすrための条件を以下のJsonフォーマットで指定してください：
+            農地の修正をするための条件を以下のJsonフォーマットで指定してください：
             ```json
             {
-                "target_address": "変更したい農地の住所",
+                "target_address": "変更したい農地の住所（複数の場合はリスト、任意）",
+                "parcel_id": "変更したい農地のID（複数の場合はリスト、任意）",
+                "farmer_id": "変更したい農地の現在の所有者のID（任意）",
                 "new_farmer_id": "変更後の農地の所有者のID",
-                "new_farm_type": "変更後の農地の種類",
+                "new_farm_type": "変更後の農地の種類（'1': 田, '2': 畑）",
             }
             ```
+            対象の農地は target_address, parcel_id, farmer_id の少なくとも一つで指定してください。
+            複数の修正をまとめて行う場合は {"edits": [修正, ...]} の形式で指定してください。
 
             以下は指定例です：
-            1. 住所が1234の農地の所有者を5678に変更
-            2. 住所が1234の農地の種類を田から畑に変更
+            1. 住所が1234の農地の所有者を5678に変更 → {"target_address": "1234", "new_farmer_id": "5678"}
+            2. 住所が1234の農地の種類を田から畑に変更 → {"target_address": "1234", "new_farm_type": "2"}
             3. 住所が1234の農地の所有者を5678に変更し、種類を田から畑に変更
+            4. 所有者1111の農地をすべて所有者2222に変更 → {"farmer_id": "1111", "new_farmer_id": "2222"}
+            5. 住所が1234と1235の農地を5678に、住所が2000の農地を9999に変更
+               → {"edits": [{"target_address": ["1234", "1235"], "new_farmer_id": "5678"},
+                            {"target_address": "2000", "new_farmer_id": "9999"}]}
             """,
             "function": fix_reorg
+        },
+        5: {
+            "name": "地図の操作の取り消し・復元",
+            "description": """
+            フィルタリング・再編成・修正の操作を取り消して、地図を以前の状態に戻すエージェントです。
+            復元の条件を以下のJSONフォーマットで指定してください：
+            ```json
+            {
+                "target": "対象の地図（フィルタリング後の地図は map、再編成後の地図は reorg）",
+                "version": "戻したい版番号（任意。省略すると直前の操作を取り消す）"
+            }
+            ```
+
+            以下は指定例です：
+            1. 直前の修正を取り消して → {"target": "reorg"}
+            2. フィルタリングを元に戻して → {"target": "map"}
+            3. 再編成後の地図を版3に戻して → {"target": "reorg", "version": 3}
+            """,
+            "function": restore_map
         }
     },
     2:{
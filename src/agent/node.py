@@ -1,3 +1,4 @@
+from contextlib import nullcontext
 from dataclasses import dataclass
 from typing import Callable, Dict, Literal
 
@@ -10,6 +11,7 @@ from agent.state import State
 from agent.constants.tasks import TASKS
 from agent.constants.role import ROLES
 from agent.constants.inputs import INPUTS
+from functions.workspace import get_workspace_manager
 import json
 
 @dataclass
@@ -131,8 +133,10 @@ class Node:
             # JSONパース
             filter_params = json.loads(json_str)
 
-            # タスク実行
-            result = TASKS[state["current_role"]][state["current_task"]]["function"](json.dumps(filter_params))
+            # タスク実行（セッションの作業領域がある場合はその地図を対象にする）
+            using = get_workspace_manager().use(state["workspace_id"]) if state.get("workspace_id") else nullcontext()
+            with using as workspace:
+                result = TASKS[state["current_role"]][state["current_task"]]["function"](json.dumps(filter_params), workspace=workspace)
 
             # 色付けの場合
             if state["current_role"] == 1 and state["current_task"] == 2:
@@ -19,6 +19,10 @@ class State(TypedDict):
         description="トレースの識別子",
     )
 
+    workspace_id: str = Field(
+        description="セッションの作業領域の識別子",
+    )
+
     is_finished: bool = Field(
         description="会話が終了したかどうか",
     )
@@ -15,6 +15,7 @@ from agent.llm.llm import get_llm_model
 from agent.agent import Agent
 
 import getpass
+import uuid
 
 load_dotenv()
 
@@ -25,11 +26,12 @@ def generate_answer(prompt):
         "prompt": prompt,
         "model": get_llm_model(),
         "messages": [],
-        "execute_tasks": False
+        "execute_tasks": False,
+        "workspace_id": st.session_state["workspace_id"]
     }
     thread_config = {
         "configurable": {
-            "thread_id": "1",  # 一意のスレッドID
+            "thread_id": st.session_state["workspace_id"],  # セッションごとのスレッドID
             "checkpoint_ns": "chat",  # チェックポイントの名前空間
             "checkpoint_id": "1"  # チェックポイントID
         }
@@ -55,6 +57,9 @@ def _add_message_with_scroll(role: str, content: str):
 class MainLayout:
     def __init__(self):
         st.set_page_config(layout="wide")
+        # セッションごとの作業領域（地図の状態と修正履歴）の識別子
+        if "workspace_id" not in st.session_state:
+            st.session_state["workspace_id"] = uuid.uuid4().hex
         if "show_color_map" not in st.session_state:
             st.session_state["show_color_map"] = False
         if "show_reorg_map" not in st.session_state:
@@ -1,8 +1,8 @@
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
-import json
-import os
+from functions.parcel_store import to_geojson, MAP_LAYER
+from functions.workspace import get_workspace_manager
 import random
 from collections import defaultdict
 from typing import Dict, Any, Callable
@@ -98,9 +98,14 @@ class ColorMapComponent:
             key="color_param"
         )
 
-        geojson_file = 'src/app/ref/map.geojson'
-        with open(geojson_file, 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
+        # セッションの作業領域から農地データを読み込み、地図表示用にGeoJSONへ変換
+        # まだ検索・再編成していない場合は、農地の無い地図を表示する
+        with get_workspace_manager().use(st.session_state["workspace_id"]) as workspace:
+            geojson_data = to_geojson(workspace.load(MAP_LAYER)) if workspace.head(MAP_LAYER) else None
+        if geojson_data is None:
+            st.info("農地を検索すると地図に表示されます")
+            st_folium(self.map, width=700, height=500, key="map_colored")
+            return
 
         # 所有者による色分けの場合はカウントを更新
         if selected_param == 'owner':
@@ -1,21 +1,24 @@
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
-import json
-import os
+from functions.parcel_store import to_geojson, REORG_LAYER
+from functions.workspace import get_workspace_manager
 
 class MapReorgComponent:
     def __init__(self):
         self.map = folium.Map(location=[36.377328516, 140.375387545], zoom_start=14)
 
     def render_map(self):
-        # GeoJSONファイルの読み込み
-        geojson_file = 'src/app/ref/map-reorg.geojson'
-        with open(geojson_file, 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
+        # セッションの作業領域から農地データを読み込み、地図表示用にGeoJSONへ変換
+        # まだ検索・再編成していない場合は、農地の無い地図を表示する
+        with get_workspace_manager().use(st.session_state["workspace_id"]) as workspace:
+            geojson_data = to_geojson(workspace.load(REORG_LAYER)) if workspace.head(REORG_LAYER) else None
 
         # GeoJSONデータを地図に追加
-        folium.GeoJson(geojson_data).add_to(self.map)
+        if geojson_data is not None:
+            folium.GeoJson(geojson_data).add_to(self.map)
+        else:
+            st.info("農地を再編成すると地図に表示されます")
 
         # 地図をStreamlitに表示
         st_folium(self.map, width=700, height=500, key="map_reorg")
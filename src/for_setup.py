@@ -1,16 +1,12 @@
-import os
-import shutil
-# backupフォルダがない時、作成する
-if not os.path.exists('src/app/ref/backup'):
-    os.makedirs('src/app/ref/backup')
-    print("backupフォルダを作成しました")
+from functions.parcel_store import ParcelStore, read_geojson, ROW_LAYER, MAP_LAYER, REORG_LAYER
 
 
-# map-row.geojsonをコピーしてmap.geojsonとmap-reorg.geojsonを作る
+# map-row.geojsonを集落ごとに分割して保存し、map と map-reorg の最初の版を履歴に記録する
 src_path = 'src/app/ref/map-row.geojson'
-map_path = 'src/app/ref/map.geojson'
-reorg_path = 'src/app/ref/map-reorg.geojson'
-shutil.copy(src_path, map_path)
-print(f"ファイルをコピーしました: {src_path} -> {map_path}")
-shutil.copy(src_path, reorg_path)
-print(f"ファイルをコピーしました: {src_path} -> {reorg_path}")
+store = ParcelStore()
+parcels = read_geojson(src_path)
+store.save(ROW_LAYER, parcels)
+print(f"ファイルを作成しました: {src_path} -> {store.partition_dir(ROW_LAYER)}")
+for layer in [MAP_LAYER, REORG_LAYER]:
+    version = store.save(layer, parcels, message="初期データ")
+    print(f"レイヤー '{layer}' を記録しました: 版{version}")
@@ -32,11 +32,7 @@ def run_analysis(gdf: gpd.GeoDataFrame, existing_farmer_ids: list[str]) -> Analy
     farmers_worktime_reduced = {}
     farmers_fuel_cost_reduced = {}
     for farmer_id in existing_farmer_ids:
-        stats, travel_distance = analyzer.run_analysis(farmer_id)
-        worktime_reduced = travel_distance / 20 # 時速20kmで走行
-        fuel_cost_reduced = travel_distance * 12.3 # 1kmあたり12.3円の燃料費
-        farmers_worktime_reduced[farmer_id] = worktime_reduced
-        farmers_fuel_cost_reduced[farmer_id] = fuel_cost_reduced
+        farmers_worktime_reduced[farmer_id], farmers_fuel_cost_reduced[farmer_id] = _farmer_costs(analyzer, farmer_id)
 
     return AnalysisResult(
         total_distance_reduced=total_distance,
@@ -45,6 +41,46 @@ def run_analysis(gdf: gpd.GeoDataFrame, existing_farmer_ids: list[str]) -> Analy
         farmers_fuel_cost_reduced=farmers_fuel_cost_reduced
     )
 
+def extend_analysis(result: AnalysisResult, gdf: gpd.GeoDataFrame, existing_farmer_ids: list[str]) -> AnalysisResult:
+    """前回のコスト分析結果を使って、指定した農家のコスト分析結果を求める
+
+    再編成前の農地が前回と同じ場合に使う。地域全体の削減量と前回の結果に含まれる農家の値はそのまま使い、
+    前回の結果に無い農家の経路だけを求める。
+
+    Args:
+        result (AnalysisResult): 前回のコスト分析結果
+        gdf (gpd.GeoDataFrame): 再編成前の農地データ（前回と同じもの）
+        existing_farmer_ids (list[str]): 既存農家のIDリスト
+
+    Returns:
+        AnalysisResult: 指定した農家のコスト分析結果
+    """
+    farmers_worktime_reduced = {}
+    farmers_fuel_cost_reduced = {}
+    analyzer = None
+    for farmer_id in existing_farmer_ids:
+        if farmer_id in result.farmers_worktime_reduced:
+            farmers_worktime_reduced[farmer_id] = result.farmers_worktime_reduced[farmer_id]
+            farmers_fuel_cost_reduced[farmer_id] = result.farmers_fuel_cost_reduced[farmer_id]
+            continue
+        if analyzer is None:
+            analyzer = ResourceAnalyzer(gdf)
+        farmers_worktime_reduced[farmer_id], farmers_fuel_cost_reduced[farmer_id] = _farmer_costs(analyzer, farmer_id)
+
+    return AnalysisResult(
+        total_distance_reduced=result.total_distance_reduced,
+        total_co2_reduced=result.total_co2_reduced,
+        farmers_worktime_reduced=farmers_worktime_reduced,
+        farmers_fuel_cost_reduced=farmers_fuel_cost_reduced
+    )
+
+def _farmer_costs(analyzer: "ResourceAnalyzer", farmer_id: str) -> tuple[float, float]:
+    """農家の1ヶ月分の労働時間（h）と燃料費（円）の削減量を求める"""
+    stats, travel_distance = analyzer.run_analysis(farmer_id)
+    worktime_reduced = travel_distance / 20 # 時速20kmで走行
+    fuel_cost_reduced = travel_distance * 12.3 # 1kmあたり12.3円の燃料費
+    return worktime_reduced, fuel_cost_reduced
+
 
 
 class ResourceAnalyzer:
@@ -0,0 +1,48 @@
+import os
+from typing import Dict, List, Sequence, Tuple
+
+
+def evict_lru(root: str, max_bytes: int, keep: Sequence[str] = ()) -> None:
+    """キャッシュのディレクトリの合計サイズが上限を超えた分を、使われていない順に削除する
+
+    ファイル名の最初の "." より前が同じファイルを一つのエントリとしてまとめて削除する（<key>.json と <key>.parquet など）。
+    最後に使われた時刻はエントリ内のファイルの最も新しい更新時刻とするため、読み込んだ時は os.utime で更新しておくこと。
+    書き込み中の一時ファイル（.tmp）は数えず、削除もしない。
+
+    Args:
+        root (str): キャッシュのディレクトリ
+        max_bytes (int): 合計サイズの上限（バイト）
+        keep (Sequence[str], optional): 削除しないファイル名
+    """
+    if not os.path.isdir(root):
+        return
+    entries: Dict[str, List[Tuple[str, os.stat_result]]] = {}
+    for name in os.listdir(root):
+        if name in keep or name.endswith(".tmp"):
+            continue
+        path = os.path.join(root, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.setdefault(name.split(".", 1)[0], []).append((path, stat))
+
+    total = sum(stat.st_size for files in entries.values() for _, stat in files)
+    for files in sorted(entries.values(), key=lambda files: max(stat.st_mtime for _, stat in files)):
+        if total <= max_bytes:
+            break
+        for path, stat in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= stat.st_size
+
+
+def touch(paths: Sequence[str]) -> None:
+    """ファイルの更新時刻を現在時刻にする（evict_lru で使われた時刻として扱う。無いファイルは無視する）"""
+    for path in paths:
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            pass
@@ -1,5 +1,11 @@
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import shape
+from functions.parcel_index import ParcelIndex
+from functions.filter_expr import FilterExpr
+from functions.spatial_index import SpatialIndex
 
 @dataclass
 class FieldSearchCriteria:
@@ -14,6 +20,48 @@ class FieldSearchCriteria:
     usage_situation: Optional[str] = None
     classification: Optional[str] = None  # 田、畑などの区分
     settlement: Optional[str] = None
+    where: Optional[FilterExpr] = None  # AND/OR/NOTを含む条件式（filter_parcelsでのみ評価）
+    bbox: Optional[List[float]] = None  # [西端経度, 南端緯度, 東端経度, 北端緯度]
+    center: Optional[List[float]] = None  # [経度, 緯度]。radius_mと組み合わせて使う
+    radius_m: Optional[float] = None  # centerからの半径（m）
+    polygon: Optional[Dict[str, Any]] = None  # GeoJSONのgeometry（経緯度）
+
+    def has_spatial_filter(self) -> bool:
+        """空間条件が指定されているか"""
+        return bool(self.bbox or (self.center and self.radius_m) or self.polygon)
+
+    def bounds(self) -> Optional[List[float]]:
+        """空間条件を囲む範囲 [西端経度, 南端緯度, 東端経度, 北端緯度]（空間条件が無い場合はNone）
+
+        読み込む分割の絞り込みに使うため、範囲は実際の条件より広くてもよい。
+        """
+        boxes = []
+        if self.bbox:
+            boxes.append(list(self.bbox))
+        if self.center and self.radius_m:
+            lon, lat = self.center
+            # 1度あたりの距離（m）の近似値から、半径を少し広げた範囲を求める
+            dlat = self.radius_m * 1.01 / 110574
+            dlon = self.radius_m * 1.01 / (111320 * max(np.cos(np.radians(lat)), 1e-6))
+            boxes.append([lon - dlon, lat - dlat, lon + dlon, lat + dlat])
+        if self.polygon:
+            boxes.append(list(shape(self.polygon).bounds))
+        if not boxes:
+            return None
+        # 空間条件はすべて満たす必要があるため、範囲の共通部分をとる
+        return [max(b[0] for b in boxes), max(b[1] for b in boxes), min(b[2] for b in boxes), min(b[3] for b in boxes)]
+
+# 検索条件の項目と農地データの列の対応
+_CRITERIA_COLUMNS = {
+    "farmer_id": "FarmerIndicationNumberHash",
+    "settlement": "Settlement_name",
+    "land_type": "land_type",
+    "issue_year": "issue_year",
+    "prefecture_code": "TodofukenCode",
+    "city_code": "ShikuchosonCode",
+    "usage_situation": "UsageSituationInvestigationResultCodeName",
+    "classification": "ClassificationOfLandCodeName",
+}
 
 def search_fields(
     geojson_data: Dict[str, Any],
@@ -30,8 +78,14 @@ def search_fields(
         List[Dict]: 条件に合致する農地データのリスト
     """
     results = []
-    
-    for feature in geojson_data.get('features', []):
+    features = geojson_data.get('features', [])
+
+    # 空間条件はSTRtreeで候補を絞り込んでから属性を照合する
+    if criteria.has_spatial_filter():
+        gdf = gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+        features = [features[i] for i in _search_spatial(SpatialIndex(gdf), criteria)]
+
+    for feature in features:
         properties = feature.get('properties', {})
         
         if _matches_criteria(properties, criteria):
@@ -39,6 +93,99 @@ def search_fields(
     
     return results
 
+def filter_parcels(
+    gdf: gpd.GeoDataFrame,
+    criteria: FieldSearchCriteria,
+    index: Optional[ParcelIndex] = None,
+    spatial_index: Optional[SpatialIndex] = None
+) -> gpd.GeoDataFrame:
+    """
+    GeoDataFrameから指定された条件に合致する農地データを抽出する
+
+    属性インデックスの転置リストを積集合して検索するため、結果は search_fields と同じになる。
+    空間条件はSTRtreeで検索した行位置を同様に積集合する。
+    criteria.where が指定されている場合は、さらに条件式で絞り込む。
+
+    Args:
+        gdf (gpd.GeoDataFrame): 検索対象の農地データ
+        criteria (FieldSearchCriteria): 検索条件
+        index (ParcelIndex, optional): gdfから作成済みの属性インデックス
+        spatial_index (SpatialIndex, optional): gdfから作成済みの空間インデックス
+
+    Returns:
+        gpd.GeoDataFrame: 条件に合致する農地データ
+    """
+    if index is None:
+        index = ParcelIndex(gdf)
+    if spatial_index is None and criteria.has_spatial_filter():
+        spatial_index = SpatialIndex(gdf)
+    result = gdf.iloc[_search_index(index, criteria, spatial_index)]
+    # 条件式はインデックスで絞り込んだ後の行に対して列単位で評価する
+    if criteria.where is not None:
+        result = result[criteria.where.mask(result)]
+    return result
+
+def _search_index(
+    index: ParcelIndex,
+    criteria: FieldSearchCriteria,
+    spatial_index: Optional[SpatialIndex] = None
+) -> np.ndarray:
+    """
+    属性インデックスと空間インデックスから検索条件に一致する行位置を取得する
+
+    Args:
+        index (ParcelIndex): 属性インデックス
+        criteria (FieldSearchCriteria): 検索条件
+        spatial_index (SpatialIndex, optional): 空間インデックス（空間条件がある場合は必須）
+
+    Returns:
+        np.ndarray: 一致する行位置（昇順）
+    """
+    postings = [
+        index.lookup(column, getattr(criteria, field))
+        for field, column in _CRITERIA_COLUMNS.items()
+        if getattr(criteria, field)
+    ]
+    # 面積を数値に変換できない農地は常に除外される
+    postings.append(index.area_range(criteria.area_min or None, criteria.area_max or None))
+    if criteria.has_spatial_filter():
+        postings.append(_search_spatial(spatial_index, criteria))
+
+    # 件数の少ない転置リストから積集合を取る
+    postings.sort(key=len)
+    positions = postings[0]
+    for posting in postings[1:]:
+        if len(positions) == 0:
+            break
+        positions = np.intersect1d(positions, posting, assume_unique=True)
+    return positions
+
+def _search_spatial(spatial_index: SpatialIndex, criteria: FieldSearchCriteria) -> np.ndarray:
+    """
+    すべての空間条件に一致する行位置を取得する
+
+    Args:
+        spatial_index (SpatialIndex): 空間インデックス
+        criteria (FieldSearchCriteria): 検索条件
+
+    Returns:
+        np.ndarray: 一致する行位置（昇順）
+    """
+    postings = []
+    if criteria.bbox:
+        if len(criteria.bbox) != 4:
+            raise ValueError(f"bboxは[西端経度, 南端緯度, 東端経度, 北端緯度]で指定してください: {criteria.bbox}")
+        postings.append(spatial_index.bbox(*criteria.bbox))
+    if criteria.center and criteria.radius_m:
+        lon, lat = criteria.center
+        postings.append(spatial_index.radius(lon, lat, criteria.radius_m))
+    if criteria.polygon:
+        postings.append(spatial_index.polygon(criteria.polygon))
+    positions = postings[0]
+    for posting in postings[1:]:
+        positions = np.intersect1d(positions, posting, assume_unique=True)
+    return positions
+
 def _matches_criteria(properties: Dict[str, Any], criteria: FieldSearchCriteria) -> bool:
     """
     プロパティが検索条件に一致するかチェックする
@@ -0,0 +1,166 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+# 条件式で使える項目名と農地データの列の対応（列名を直接指定することもできる）
+FIELD_ALIASES = {
+    "farmer_id": "FarmerIndicationNumberHash",
+    "settlement": "Settlement_name",
+    "land_type": "land_type",
+    "issue_year": "issue_year",
+    "prefecture_code": "TodofukenCode",
+    "city_code": "ShikuchosonCode",
+    "usage_situation": "UsageSituationInvestigationResultCodeName",
+    "classification": "ClassificationOfLandCodeName",
+    "area": "AreaOnRegistry",
+    "address": "Address",
+}
+
+
+class FilterExpr:
+    """農地の絞り込み条件式の基底クラス
+
+    mask で GeoDataFrame の各行が条件に一致するかを表す真偽値配列を列単位で計算する。
+    """
+
+    def mask(self, gdf: gpd.GeoDataFrame) -> np.ndarray:
+        raise NotImplementedError
+
+
+@dataclass
+class Eq(FilterExpr):
+    """列の値が value に一致する"""
+    field: str
+    value: Any
+
+    def mask(self, gdf: gpd.GeoDataFrame) -> np.ndarray:
+        column = _column(gdf, self.field)
+        return (column == _coerce(column, self.value)).to_numpy(dtype=bool, na_value=False)
+
+
+@dataclass
+class In(FilterExpr):
+    """列の値が values のいずれかに一致する"""
+    field: str
+    values: List[Any]
+
+    def mask(self, gdf: gpd.GeoDataFrame) -> np.ndarray:
+        column = _column(gdf, self.field)
+        return column.isin([_coerce(column, v) for v in self.values]).to_numpy(dtype=bool)
+
+
+@dataclass
+class Range(FilterExpr):
+    """列の数値が min 以上 max 以下である（数値に変換できない行は一致しない）"""
+    field: str
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+    def mask(self, gdf: gpd.GeoDataFrame) -> np.ndarray:
+        values = pd.to_numeric(_column(gdf, self.field), errors="coerce").to_numpy(dtype=float)
+        result = ~np.isnan(values)
+        if self.min is not None:
+            result &= values >= self.min
+        if self.max is not None:
+            result &= values <= self.max
+        return result
+
+
+@dataclass
+class And(FilterExpr):
+    """すべての条件に一致する"""
+    children: List[FilterExpr] = field(default_factory=list)
+
+    def mask(self, gdf: gpd.GeoDataFrame) -> np.ndarray:
+        result = np.ones(len(gdf), dtype=bool)
+        for child in self.children:
+            result &= child.mask(gdf)
+        return result
+
+
+@dataclass
+class Or(FilterExpr):
+    """いずれかの条件に一致する"""
+    children: List[FilterExpr] = field(default_factory=list)
+
+    def mask(self, gdf: gpd.GeoDataFrame) -> np.ndarray:
+        result = np.zeros(len(gdf), dtype=bool)
+        for child in self.children:
+            result |= child.mask(gdf)
+        return result
+
+
+@dataclass
+class Not(FilterExpr):
+    """条件に一致しない"""
+    child: FilterExpr
+
+    def mask(self, gdf: gpd.GeoDataFrame) -> np.ndarray:
+        return ~self.child.mask(gdf)
+
+
+def parse_filter(data: Dict[str, Any]) -> FilterExpr:
+    """JSON形式の条件式を FilterExpr に変換する
+
+    形式:
+        {"and": [条件, ...]} / {"or": [条件, ...]} / {"not": 条件}
+        {"field": "項目名", "eq": 値}
+        {"field": "項目名", "in": [値, ...]}
+        {"field": "項目名", "min": 下限, "max": 上限}（どちらか一方でもよい）
+
+    Args:
+        data (Dict[str, Any]): JSON形式の条件式
+
+    Returns:
+        FilterExpr: 条件式
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"条件式の形式が不正です: {data}")
+    if "and" in data:
+        return And([parse_filter(child) for child in _as_list(data["and"])])
+    if "or" in data:
+        return Or([parse_filter(child) for child in _as_list(data["or"])])
+    if "not" in data:
+        return Not(parse_filter(data["not"]))
+
+    if "field" not in data:
+        raise ValueError(f"条件式に項目名(field)がありません: {data}")
+    name = data["field"]
+    if "eq" in data:
+        return Eq(name, data["eq"])
+    if "in" in data:
+        return In(name, _as_list(data["in"]))
+    if "min" in data or "max" in data:
+        return Range(name, _as_float(data.get("min")), _as_float(data.get("max")))
+    raise ValueError(f"条件式の演算子が不正です: {data}")
+
+
+def _column(gdf: gpd.GeoDataFrame, name: str) -> pd.Series:
+    column = FIELD_ALIASES.get(name, name)
+    if column not in gdf.columns:
+        raise ValueError(f"未知の項目です: {name}")
+    return gdf[column]
+
+
+def _coerce(column: pd.Series, value: Any) -> Any:
+    """数値列に文字列の値が指定された場合は数値に変換する"""
+    if isinstance(value, str) and pd.api.types.is_numeric_dtype(column):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _as_list(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else [value]
+
+
+def _as_float(value: Any) -> Optional[float]:
+    return None if value is None else float(value)
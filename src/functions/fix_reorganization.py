@@ -1,92 +1,189 @@
-import json
-from datetime import datetime
-from typing import Dict, Any
-
-def update_farmer_info(
-    geojson_path: str,
-    target_address: str,
-    new_farmer_id: str,
-    new_land_type: str = None  # 新しい農地の種類（オプション）
-) -> Dict[str, Any]:
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import geopandas as gpd
+
+from functions.parcel_index import ParcelIndex
+
+# 農地の種類のコードと名称
+LAND_TYPE_NAMES = {"1": "田", "2": "畑"}
+
+# 修正対象の指定に使う列
+ADDRESS_COLUMN = "Address"
+PARCEL_ID_COLUMN = "polygon_uuid"
+FARMER_COLUMN = "FarmerIndicationNumberHash"
+
+
+@dataclass
+class ParcelEdit:
+    """農地の修正内容
+
+    対象は住所・農地ID・現在の農家IDで指定する。
+    住所と農地IDは複数指定でき、いずれかに一致する農地を対象とする。
+    複数の種類の条件を指定した場合は、すべてに一致する農地を対象とする。
     """
-    GeoJSONファイル内の農地所有者情報と農地種類を更新する
+    addresses: List[str] = field(default_factory=list)
+    parcel_ids: List[str] = field(default_factory=list)
+    farmer_id: Optional[str] = None
+    new_farmer_id: Optional[str] = None
+    new_land_type: Optional[str] = None  # '1': 田, '2': 畑
+
+    def describe(self) -> str:
+        """修正対象の説明（メッセージ用）"""
+        targets = []
+        if self.addresses:
+            targets.append("住所 " + "、".join(self.addresses))
+        if self.parcel_ids:
+            targets.append("農地ID " + "、".join(self.parcel_ids))
+        if self.farmer_id is not None:
+            targets.append(f"農家 {self.farmer_id}")
+        return " かつ ".join(targets)
+
+
+@dataclass
+class EditResult:
+    """一括修正の結果"""
+    changed: np.ndarray  # 変更された行を表す真偽値配列
+    updated_count: int
+    land_type_updates: List[Dict[str, Any]] = field(default_factory=list)
+    unmatched: List[ParcelEdit] = field(default_factory=list)  # 一致する農地がなかった修正
+
+
+def parse_edits(params: Dict[str, Any]) -> List[ParcelEdit]:
+    """JSON形式の修正条件を ParcelEdit のリストに変換する
+
+    形式:
+        {"edits": [修正, ...]} または 修正 を1件だけ直接指定する
+        修正: {"target_address": 住所またはそのリスト, "parcel_id": 農地IDまたはそのリスト,
+               "farmer_id": 現在の農家ID, "new_farmer_id": 変更後の農家ID, "new_farm_type": 変更後の種類}
 
     Args:
-        geojson_path (str): 更新対象のGeoJSONファイルパス
-        target_address (str): 対象の住所
-        new_farmer_id (str): 新しい農家の識別子
-        new_land_type (str, optional): 新しい農地の種類 ('1': 田, '2': 畑)
+        params (Dict[str, Any]): JSON形式の修正条件
 
     Returns:
-        Dict[str, Any]: 更新結果を含む辞書
-            - status: 処理結果のステータス ("success" or "error")
-            - message: 処理結果のメッセージ
-            - updated_count: 更新された農地の数
-            - land_type_updates: 農地種類の更新内容（変更があった場合のみ）
+        List[ParcelEdit]: 修正内容のリスト
+
+    Raises:
+        ValueError: 形式が不正な場合
     """
-    try:
-        # GeoJSONファイルの読み込み
-        with open(geojson_path, 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
-
-        # バックアップの作成
-        backup_path = f'src/app/ref/backup/map-reorg-{datetime.now().strftime("%Y%m%d%H%M%S")}.geojson'
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            json.dump(geojson_data, f, ensure_ascii=False, indent=2)
-
-        updated_count = 0
-        updates = []
-
-        # 特定の農地の情報を更新
-        for feature in geojson_data['features']:
-            properties = feature['properties']
-            if properties['Address'] == target_address:
-                # 農家IDを更新
-                old_farmer_id = properties['FarmerIndicationNumberHash']
-                properties['FarmerIndicationNumberHash'] = new_farmer_id
-                
-                # 農地種類の更新（指定がある場合のみ）
-                if new_land_type is not None:
-                    old_type = properties.get('ClassificationOfLand', '')
-                    properties['ClassificationOfLand'] = new_land_type
-                    properties['ClassificationOfLandCodeName'] = '田' if new_land_type == '1' else '畑'
-                    updates.append({
-                        'address': properties['Address'],
-                        'old_farmer_id': old_farmer_id,
-                        'old_type': '田' if old_type == '1' else '畑',
-                        'new_type': '田' if new_land_type == '1' else '畑'
-                    })
-                
-                updated_count += 1
-
-        if updated_count == 0:
-            return {
-                "status": "error",
-                "message": f"指定された住所 '{target_address}' に一致する農地が見つかりませんでした。",
-                "updated_count": 0
-            }
-
-        # 更新したGeoJSONを保存
-        with open(geojson_path, 'w', encoding='utf-8') as f:
-            json.dump(geojson_data, f, ensure_ascii=False, indent=2)
-
-        # メッセージの生成
-        message = f"{updated_count}件の農地情報を更新しました。"
-        if updates:
-            message += "\n農地種類の変更内容:"
-            for update in updates:
-                message += f"\n- {update['address']}: {update['old_type']} → {update['new_type']}"
-
-        return {
-            "status": "success",
-            "message": message,
-            "updated_count": updated_count,
-            "land_type_updates": updates
-        }
-
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": f"エラーが発生しました: {str(e)}",
-            "updated_count": 0
-        }
\ No newline at end of file
+    items = params["edits"] if "edits" in params else [params]
+    if not isinstance(items, list) or not items:
+        raise ValueError("修正内容(edits)が指定されていません")
+
+    edits = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError(f"修正内容の形式が不正です: {item}")
+        edit = ParcelEdit(
+            addresses=_as_list(item.get("target_address", item.get("address"))),
+            parcel_ids=_as_list(item.get("parcel_id", item.get("parcel_ids"))),
+            farmer_id=item.get("farmer_id"),
+            new_farmer_id=item.get("new_farmer_id"),
+            new_land_type=_land_type_code(item.get("new_farm_type"))
+        )
+        if not edit.addresses and not edit.parcel_ids and edit.farmer_id is None:
+            raise ValueError(f"修正対象の農地（住所・農地ID・農家ID）が指定されていません: {item}")
+        if edit.new_farmer_id is None and edit.new_land_type is None:
+            raise ValueError(f"変更後の農家IDまたは農地の種類が指定されていません: {item}")
+        edits.append(edit)
+    return edits
+
+
+def apply_edits(parcels: gpd.GeoDataFrame, edits: List[ParcelEdit], index: Optional[ParcelIndex] = None) -> EditResult:
+    """農地データに修正をまとめて適用する
+
+    対象の農地は属性インデックスで求め、変更はメモリ上の parcels に直接書き込む。
+    対象は一括修正を適用する前の状態で決まるため、修正の順序によって対象が変わることはない。
+    同じ農地に複数の修正が一致した場合は、後の修正が優先される。
+
+    Args:
+        parcels (gpd.GeoDataFrame): 農地データ（変更されるため、共有データは copy() して渡すこと）
+        edits (List[ParcelEdit]): 修正内容のリスト
+        index (ParcelIndex, optional): parcels の属性インデックス（省略時は作成する）
+
+    Returns:
+        EditResult: 一括修正の結果
+    """
+    if index is None:
+        index = ParcelIndex(parcels, columns=(ADDRESS_COLUMN, FARMER_COLUMN))
+
+    changed = np.zeros(len(parcels), dtype=bool)
+    land_type_updates = []
+    unmatched = []
+    # 対象を先にすべて求めてから書き込む
+    targets = [_resolve(index, edit) for edit in edits]
+
+    for edit, positions in zip(edits, targets):
+        if len(positions) == 0:
+            unmatched.append(edit)
+            continue
+        changed[positions] = True
+
+        if edit.new_land_type is not None:
+            rows = parcels.iloc[positions]
+            old_types = rows.get("ClassificationOfLand", [""] * len(rows))
+            for address, farmer_id, old_type in zip(rows[ADDRESS_COLUMN], rows[FARMER_COLUMN], old_types):
+                land_type_updates.append({
+                    'address': address,
+                    'old_farmer_id': farmer_id,
+                    'old_type': '田' if old_type == '1' else '畑',
+                    'new_type': LAND_TYPE_NAMES[edit.new_land_type]
+                })
+            _assign(parcels, positions, "ClassificationOfLand", edit.new_land_type)
+            _assign(parcels, positions, "ClassificationOfLandCodeName", LAND_TYPE_NAMES[edit.new_land_type])
+
+        if edit.new_farmer_id is not None:
+            _assign(parcels, positions, FARMER_COLUMN, edit.new_farmer_id)
+
+    return EditResult(
+        changed=changed,
+        updated_count=int(changed.sum()),
+        land_type_updates=land_type_updates,
+        unmatched=unmatched
+    )
+
+
+def _resolve(index: ParcelIndex, edit: ParcelEdit) -> np.ndarray:
+    """修正対象の農地の行位置（昇順）を求める"""
+    selections = []
+    if edit.addresses:
+        selections.append(_lookup_any(index, ADDRESS_COLUMN, edit.addresses))
+    if edit.parcel_ids:
+        selections.append(_lookup_any(index, PARCEL_ID_COLUMN, edit.parcel_ids))
+    if edit.farmer_id is not None:
+        selections.append(index.lookup(FARMER_COLUMN, edit.farmer_id))
+
+    positions = selections[0]
+    for selection in selections[1:]:
+        positions = np.intersect1d(positions, selection, assume_unique=True)
+    return positions
+
+
+def _lookup_any(index: ParcelIndex, column: str, values: List[Any]) -> np.ndarray:
+    if len(values) == 1:
+        return index.lookup(column, values[0])
+    return np.unique(np.concatenate([index.lookup(column, value) for value in values]))
+
+
+def _assign(parcels: gpd.GeoDataFrame, positions: np.ndarray, column: str, value: Any) -> None:
+    if column not in parcels.columns:
+        parcels[column] = None
+    parcels.iloc[positions, parcels.columns.get_loc(column)] = value
+
+
+def _land_type_code(value: Any) -> Optional[str]:
+    """農地の種類をコード（'1' または '2'）に変換する"""
+    if value is None:
+        return None
+    value = str(value)
+    for code, name in LAND_TYPE_NAMES.items():
+        if value in (code, name):
+            return code
+    raise ValueError(f"農地の種類が不正です（'1': 田, '2': 畑）: {value}")
+
+
+def _as_list(value: Any) -> List[Any]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
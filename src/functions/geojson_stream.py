@@ -0,0 +1,259 @@
+import os
+import re
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional
+
+import numpy as np
+import orjson
+
+# 一度に読み込むバイト数
+READ_SIZE = 1 << 20
+
+_WHITESPACE = frozenset(b" \t\n\r")
+
+# JSONの文字列
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+# 数値・true・false・null
+_SCALAR = re.compile(rb'[^,:\]}\s]+')
+
+
+# 括弧と引用符の種類（それ以外の文字は0）
+_TOKENS = np.zeros(256, dtype=np.int8)
+_TOKENS[list(b"{[")] = 1
+_TOKENS[list(b"}]")] = -1
+_TOKENS[ord('"')] = 2
+
+
+def _value_ends(data: np.ndarray) -> np.ndarray:
+    """data の先頭から並ぶJSONの値（オブジェクト・配列）について、最後まで含まれているものの終わりの位置を返す
+
+    括弧と引用符の位置だけを取り出し、括弧の深さを文字列の外だけで累積して、
+    深さが0に戻る閉じ括弧の次の位置を値の終わりとする。
+    """
+    tokens = _TOKENS[data]
+    positions = np.flatnonzero(tokens)
+    tokens = tokens[positions]
+    quote = tokens == 2
+    # 直前に奇数個の \ が続く " はエスケープされている
+    for position in np.flatnonzero(quote & (data[np.maximum(positions - 1, 0)] == ord('\\'))):
+        run = 0
+        while positions[position] - run > 0 and data[positions[position] - run - 1] == ord('\\'):
+            run += 1
+        quote[position] = run % 2 == 0
+    in_string = np.cumsum(quote) & 1
+    delta = np.where(quote | (in_string == 1), 0, tokens)
+    depth = np.cumsum(delta)
+    return positions[(depth == 0) & (delta == -1)] + 1
+
+
+class GeoJSONReader:
+    """GeoJSON（FeatureCollection）を地物ごとに読み込むリーダー
+
+    ファイル全体を読み込まず、READ_SIZE バイトずつ読み込みながら、バッファ内の地物の終わりを NumPy でまとめて求め、
+    地物一つずつを orjson.loads で変換するため、メモリ使用量は地物一つ分とバッファの大きさに収まる。
+    features より前にあるメンバー（name, crs など）は header で参照できる。
+
+    使用例:
+        with GeoJSONReader(path) as reader:
+            for feature in reader:
+                ...
+    """
+
+    def __init__(self, path: str, read_size: int = READ_SIZE):
+        self.path = path
+        self.read_size = read_size
+        self.header: Dict[str, Any] = {}
+        self._file: Optional[IO[bytes]] = None
+        self._buffer = b""
+        self._pos = 0
+        self._eof = False
+
+    def __enter__(self) -> "GeoJSONReader":
+        self.open()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def open(self) -> None:
+        self._file = open(self.path, 'rb')
+        self._buffer, self._pos, self._eof = b"", 0, False
+        self._expect(b"{")
+        # features までのメンバーを読む
+        while True:
+            if self._peek() == b"}":
+                raise ValueError(f"GeoJSONに features がありません: {self.path}")
+            key = self._value()
+            self._expect(b":")
+            if key == "features":
+                self._expect(b"[")
+                return
+            self.header[key] = self._value()
+            self._skip(b",")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def crs(self) -> Optional[str]:
+        """header の crs の名前（無い場合はNone）"""
+        crs = self.header.get("crs")
+        if isinstance(crs, dict):
+            return crs.get("properties", {}).get("name")
+        return None
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self._file is None:
+            self.open()
+        while self._peek() not in (b"]", b"}"):
+            ends = _value_ends(np.frombuffer(self._buffer, dtype=np.uint8, offset=self._pos)) + self._pos
+            if not len(ends):
+                # 地物がバッファの末尾で切れているため、続きを読み込んで探し直す
+                if not self._fill():
+                    raise ValueError(f"GeoJSONが途中で終わっています: {self.path}")
+                continue
+            for end in ends.tolist():
+                if self._peek() != b"{":
+                    raise ValueError(f"GeoJSONの形式が不正です（地物がオブジェクトではありません）: {self.path}")
+                feature = orjson.loads(self._buffer[self._pos:end])
+                self._pos = end
+                self._skip(b",")
+                yield feature
+
+    def chunks(self, size: int) -> Iterator[List[Dict[str, Any]]]:
+        """地物を size 件ずつまとめて返す"""
+        chunk = []
+        for feature in self:
+            chunk.append(feature)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    # ================
+    # 内部処理
+    # ================
+    def _fill(self) -> bool:
+        """バッファに続きを読み込む（読み終えていた場合はFalse）"""
+        if self._eof:
+            return False
+        data = self._file.read(self.read_size)
+        if not data:
+            self._eof = True
+            return False
+        # 読み終えた部分は捨てる
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self) -> bytes:
+        """空白を読み飛ばして次の文字を返す（読み進めない）"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos:self._pos + 1]
+            if not self._fill():
+                raise ValueError(f"GeoJSONが途中で終わっています: {self.path}")
+
+    def _expect(self, char: bytes) -> None:
+        if self._peek() != char:
+            raise ValueError(f"GeoJSONの形式が不正です（'{char.decode()}' がありません）: {self.path}")
+        self._pos += 1
+
+    def _skip(self, char: bytes) -> None:
+        if self._peek() == char:
+            self._pos += 1
+
+    def _value(self) -> Any:
+        """次のJSONの値を一つ取り出す"""
+        self._peek()
+        while True:
+            end = self._end()
+            if end is not None:
+                break
+            # 値がバッファの末尾で切れているため、続きを読み込んで探し直す
+            if not self._fill():
+                raise ValueError(f"GeoJSONが途中で終わっています: {self.path}")
+        value = orjson.loads(self._buffer[self._pos:end])
+        self._pos = end
+        return value
+
+    def _end(self) -> Optional[int]:
+        """_pos から始まるJSONの値の終わりの位置を返す（バッファ内で終わっていない場合はNone）"""
+        opener = self._buffer[self._pos:self._pos + 1]
+        if opener == b'"':
+            match = _STRING.match(self._buffer, self._pos)
+            return match.end() if match else None
+        if opener in (b"{", b"["):
+            ends = _value_ends(np.frombuffer(self._buffer, dtype=np.uint8, offset=self._pos))
+            return self._pos + int(ends[0]) if len(ends) else None
+        # 数値などはバッファの末尾で切れている可能性がある
+        end = _SCALAR.match(self._buffer, self._pos).end()
+        return end if end < len(self._buffer) or self._eof else None
+
+
+class GeoJSONWriter:
+    """GeoJSON（FeatureCollection）を地物ごとに書き出すライター
+
+    地物は orjson で改行・インデント無しに1行ずつ書き出すため、
+    FeatureCollection 全体をメモリ上に作る必要がなく、出力も小さい。
+    別名のファイルに書き込み、close したときに置き換える。
+
+    使用例:
+        with GeoJSONWriter(path, name="map") as writer:
+            writer.write(features)
+    """
+
+    def __init__(self, path: str, name: Optional[str] = None, crs: Optional[str] = "urn:ogc:def:crs:OGC:1.3:CRS84"):
+        self.path = path
+        self.name = name
+        self.crs = crs
+        self.count = 0
+        self._file: Optional[IO[bytes]] = None
+        self._tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    def __enter__(self) -> "GeoJSONWriter":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # 失敗した場合は書きかけのファイルを残さない
+            self._file.close()
+            os.remove(self._tmp_path)
+
+    def open(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self._tmp_path, 'wb')
+        header = {"type": "FeatureCollection"}
+        if self.name is not None:
+            header["name"] = self.name
+        if self.crs is not None:
+            header["crs"] = {"type": "name", "properties": {"name": self.crs}}
+        # 末尾の } を除いて features の配列を始める
+        self._file.write(orjson.dumps(header)[:-1] + b',"features":[\n')
+
+    def write(self, features: Iterable[Dict[str, Any]]) -> None:
+        """地物を書き出す
+
+        Args:
+            features (Iterable[Dict[str, Any]]): GeoJSONの地物（NumPyの値もそのまま書き出せる）
+        """
+        for feature in features:
+            if self.count:
+                self._file.write(b",\n")
+            self._file.write(orjson.dumps(feature, option=orjson.OPT_SERIALIZE_NUMPY))
+            self.count += 1
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self._file.write(b"\n]}\n")
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp_path, self.path)
@@ -0,0 +1,450 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+import orjson
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+HISTORY_DIR = 'src/app/ref/history'
+
+# 何版ごとにスナップショット（全農地のハッシュ一覧）を作成するか
+SNAPSHOT_INTERVAL = 20
+
+# 農地を識別する列
+PARCEL_ID = "polygon_uuid"
+
+_HASH_COLUMN = "_hash"
+
+_LOCK_FILE = ".lock"
+
+
+class MapHistory:
+    """地図レイヤーの版管理
+
+    各版では変更された農地（農地ID → 内容のハッシュ）だけを追記型のログに記録する。
+    農地の内容はハッシュをキーにまとめて保存し、同じ内容は一度しか書き込まない。
+    一定間隔でスナップショットを作成し、任意の版をスナップショットとログの再生で復元する。
+
+    ディレクトリ構成:
+        objects/<pack>.parquet  追加された農地の内容（版ごとに1ファイル）
+        objects/catalog.jsonl   ハッシュとpackの対応
+        <layer>/log.jsonl       版ごとの変更内容
+        <layer>/snapshots/<version>.json  版の全農地のハッシュ一覧
+        .lock                   版の追加時にプロセス間で排他するためのロックファイル
+
+    版の追加（版番号の決定からログの追記まで）はロックファイルで排他するため、
+    複数のプロセスから同じ履歴に書き込んでも同じ版番号が二重に使われることは無い。
+    """
+
+    def __init__(self, root: str = HISTORY_DIR, snapshot_interval: int = SNAPSHOT_INTERVAL):
+        self.root = root
+        self.snapshot_interval = snapshot_interval
+        self._catalog: Optional[Dict[str, str]] = None
+        self._catalog_stamp: Optional[Tuple[int, int]] = None
+        self._logs: Dict[str, Tuple[Tuple[int, int], List[Dict[str, Any]]]] = {}
+        self._heads: Dict[str, Tuple[int, Dict[str, str]]] = {}
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+
+    # ================
+    # 参照
+    # ================
+    def head(self, layer: str) -> int:
+        """最新の版番号を返す（版が無い場合は0）"""
+        log = self._log(layer)
+        return log[-1]["version"] if log else 0
+
+    def versions(self, layer: str) -> List[Dict[str, Any]]:
+        """版の一覧を返す
+
+        Returns:
+            List[Dict[str, Any]]: 版番号、作成日時、メッセージ、変更数
+        """
+        return [
+            {
+                "version": entry["version"],
+                "time": entry["time"],
+                "message": entry["message"],
+                "changed": len(entry["upserts"]) + len(entry["deletes"]),
+            }
+            for entry in self._log(layer)
+        ]
+
+    def entries(self, layer: str) -> List[Dict[str, Any]]:
+        """版ごとの記録（version, parent, restored_from, undone と変更内容）を返す"""
+        return list(self._log(layer))
+
+    def manifest(self, layer: str, version: Optional[int] = None) -> Dict[str, str]:
+        """版に含まれる農地IDと内容のハッシュの対応を返す"""
+        head = self.head(layer)
+        version = head if version is None else version
+        if version < 0 or version > head:
+            raise ValueError(f"レイヤー '{layer}' に版 {version} はありません（最新: {head}）")
+        if version == head:
+            return dict(self._head_manifest(layer))
+        return self._replay(layer, version)
+
+    def checkout(self, layer: str, version: Optional[int] = None) -> gpd.GeoDataFrame:
+        """版の農地データを復元する
+
+        Args:
+            layer (str): レイヤー名
+            version (int, optional): 版番号（省略時は最新）
+
+        Returns:
+            gpd.GeoDataFrame: 農地データ
+        """
+        manifest = self.manifest(layer, version)
+        hashes = list(manifest.values())
+        if not hashes:
+            return gpd.GeoDataFrame(columns=["geometry"], geometry="geometry", crs="EPSG:4326")
+
+        catalog = self._load_catalog()
+        packs: Dict[str, List[str]] = {}
+        for h in set(hashes):
+            packs.setdefault(catalog[h], []).append(h)
+
+        frames = []
+        for pack, pack_hashes in packs.items():
+            rows = gpd.read_parquet(self._pack_path(pack))
+            frames.append(rows[rows[_HASH_COLUMN].isin(pack_hashes)])
+        rows = pd.concat(frames) if len(frames) > 1 else frames[0]
+        rows = rows.drop_duplicates(_HASH_COLUMN).set_index(_HASH_COLUMN)
+        gdf = rows.loc[hashes].reset_index(drop=True)
+        return gpd.GeoDataFrame(gdf, geometry="geometry", crs=rows.crs)
+
+    # ================
+    # 更新
+    # ================
+    def commit(self, layer: str, gdf: gpd.GeoDataFrame, message: str = "") -> int:
+        """レイヤー全体の新しい状態を記録する
+
+        最新版と比較して内容が変わった農地と削除された農地だけを記録する。
+
+        Args:
+            layer (str): レイヤー名
+            gdf (gpd.GeoDataFrame): 新しい状態の農地データ
+            message (str, optional): 版の説明
+
+        Returns:
+            int: 版番号（変更が無い場合は最新の版番号）
+        """
+        ids, hashes = row_hashes(gdf)
+        new_manifest = dict(zip(ids, hashes))
+        with self._locked():
+            head_manifest = self._head_manifest(layer)
+            changed = [i for i, (pid, h) in enumerate(zip(ids, hashes)) if head_manifest.get(pid) != h]
+            deletes = [pid for pid in head_manifest if pid not in new_manifest]
+            return self._append(layer, gdf.iloc[changed], [ids[i] for i in changed], [hashes[i] for i in changed], deletes, message)
+
+    def commit_changes(
+        self,
+        layer: str,
+        changed: gpd.GeoDataFrame,
+        deleted: Iterable[str] = (),
+        message: str = ""
+    ) -> int:
+        """変更された農地だけを記録する
+
+        入出力は変更された農地の数にのみ比例する。
+
+        Args:
+            layer (str): レイヤー名
+            changed (gpd.GeoDataFrame): 追加・変更された農地
+            deleted (Iterable[str], optional): 削除された農地ID
+            message (str, optional): 版の説明
+
+        Returns:
+            int: 版番号
+        """
+        ids, hashes = row_hashes(changed)
+        with self._locked():
+            return self._append(layer, changed, ids, hashes, list(deleted), message)
+
+    def restore(self, layer: str, version: int, message: Optional[str] = None, undone: Optional[int] = None) -> int:
+        """過去の版の状態を新しい版として記録する
+
+        Args:
+            layer (str): レイヤー名
+            version (int): 復元する版番号
+            message (str, optional): 版の説明
+            undone (int, optional): 取り消しの場合、取り消した操作の版番号
+
+        Returns:
+            int: 新しい版番号
+        """
+        with self._locked():
+            target = self.manifest(layer, version)
+            current = self._head_manifest(layer)
+            upserts = {pid: h for pid, h in target.items() if current.get(pid) != h}
+            deletes = [pid for pid in current if pid not in target]
+            entry = self._new_entry(layer, upserts, deletes, message or f"版{version}を復元")
+            entry["restored_from"] = version
+            if undone is not None:
+                entry["undone"] = undone
+            self._write_entry(layer, entry)
+            return entry["version"]
+
+    def undo(self, layer: str) -> int:
+        """直前の操作を取り消す
+
+        取り消しを続けた場合は、さらに一つ前の操作を取り消す。版の復元も一つの操作として取り消せる。
+
+        Returns:
+            int: 新しい版番号
+        """
+        with self._locked():
+            target, undone = undo_target(self._log(layer), layer)
+            return self.restore(layer, target, message="操作を取り消し", undone=undone)
+
+    def release(self, layers: Iterable[str]) -> None:
+        """レイヤーの読み込んだログと最新版の対応表をメモリから外す（次に使われた時に読み直す）"""
+        with self._lock:
+            for layer in layers:
+                self._logs.pop(layer, None)
+                self._heads.pop(layer, None)
+
+    # ================
+    # 内部処理
+    # ================
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """版の追加を排他する（同じスレッドからは入れ子で呼び出せる）
+
+        ロックを取った後にログを読み直すため、他のプロセスが追加した版を元に次の版番号を決める。
+        """
+        with self._lock:
+            if self._lock_depth or fcntl is None:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, _LOCK_FILE), 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _append(
+        self,
+        layer: str,
+        rows: gpd.GeoDataFrame,
+        ids: List[str],
+        hashes: List[str],
+        deletes: List[str],
+        message: str
+    ) -> int:
+        if not ids and not deletes:
+            return self.head(layer)
+        entry = self._new_entry(layer, dict(zip(ids, hashes)), deletes, message)
+        self._write_objects(f"{layer}-{entry['version']:06d}", rows, hashes)
+        self._write_entry(layer, entry)
+        return entry["version"]
+
+    def _new_entry(self, layer: str, upserts: Dict[str, str], deletes: List[str], message: str) -> Dict[str, Any]:
+        head = self.head(layer)
+        return {
+            "version": head + 1,
+            "parent": head,
+            "time": datetime.now().strftime('%Y%m%d%H%M%S'),
+            "message": message,
+            "upserts": upserts,
+            "deletes": deletes,
+        }
+
+    def _write_entry(self, layer: str, entry: Dict[str, Any]) -> None:
+        log = self._log(layer)
+        manifest = self._head_manifest(layer)
+        _apply(manifest, entry)
+        if entry["version"] == 1 or entry["version"] % self.snapshot_interval == 0:
+            entry["snapshot"] = True
+            path = self._snapshot_path(layer, entry["version"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+
+        path = self._log_path(layer)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._logs[layer] = (_stamp(path), log + [entry])
+        self._heads[layer] = (entry["version"], manifest)
+
+    def _head_manifest(self, layer: str) -> Dict[str, str]:
+        """最新版の対応表（内部で共有するためコピーしない）"""
+        head = self.head(layer)
+        cached = self._heads.get(layer)
+        if cached is None or cached[0] != head:
+            cached = (head, self._replay(layer, head))
+            self._heads[layer] = cached
+        return cached[1]
+
+    def _replay(self, layer: str, version: int) -> Dict[str, str]:
+        """直前のスナップショットからログを再生して版の対応表を作る"""
+        log = self._log(layer)
+        start = max((e["version"] for e in log if e.get("snapshot") and e["version"] <= version), default=0)
+        manifest = self._read_snapshot(layer, start) if start else {}
+        for entry in log:
+            if start < entry["version"] <= version:
+                _apply(manifest, entry)
+        return manifest
+
+    def _write_objects(self, pack: str, rows: gpd.GeoDataFrame, hashes: List[str]) -> None:
+        """未保存の内容だけをpackに書き込む"""
+        catalog = self._load_catalog()
+        new_positions, seen = [], set()
+        for i, h in enumerate(hashes):
+            if h not in catalog and h not in seen:
+                new_positions.append(i)
+                seen.add(h)
+        if not new_positions:
+            return
+
+        objects = rows.iloc[new_positions].copy()
+        objects[_HASH_COLUMN] = [hashes[i] for i in new_positions]
+        os.makedirs(os.path.dirname(self._pack_path(pack)), exist_ok=True)
+        objects.to_parquet(self._pack_path(pack))
+
+        path = self._catalog_path()
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"pack": pack, "hashes": list(seen)}) + "\n")
+        for h in seen:
+            catalog[h] = pack
+        self._catalog_stamp = _stamp(path)
+
+    def _load_catalog(self) -> Dict[str, str]:
+        """ハッシュとpackの対応を読み込む（他のプロセスが追記した場合は読み直す）"""
+        path = self._catalog_path()
+        stamp = _stamp(path) if os.path.exists(path) else None
+        if self._catalog is None or self._catalog_stamp != stamp:
+            self._catalog = {}
+            self._catalog_stamp = stamp
+            if stamp is not None:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        for h in record["hashes"]:
+                            self._catalog[h] = record["pack"]
+        return self._catalog
+
+    def _log(self, layer: str) -> List[Dict[str, Any]]:
+        """ログを読み込む（他のプロセスが追記した場合は読み直す）"""
+        path = self._log_path(layer)
+        if not os.path.exists(path):
+            return []
+        cached = self._logs.get(layer)
+        stamp = _stamp(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with open(path, 'r', encoding='utf-8') as f:
+            log = [json.loads(line) for line in f if line.strip()]
+        self._logs[layer] = (stamp, log)
+        self._heads.pop(layer, None)
+        self._catalog = None
+        return log
+
+    def _read_snapshot(self, layer: str, version: int) -> Dict[str, str]:
+        with open(self._snapshot_path(layer, version), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _catalog_path(self) -> str:
+        return os.path.join(self.root, "objects", "catalog.jsonl")
+
+    def _log_path(self, layer: str) -> str:
+        return os.path.join(self.root, layer, "log.jsonl")
+
+    def _snapshot_path(self, layer: str, version: int) -> str:
+        return os.path.join(self.root, layer, "snapshots", f"{version:06d}.json")
+
+    def _pack_path(self, pack: str) -> str:
+        return os.path.join(self.root, "objects", f"{pack}.parquet")
+
+
+def row_hashes(gdf: gpd.GeoDataFrame) -> Tuple[List[str], List[str]]:
+    """農地ごとのIDと内容のハッシュを計算する
+
+    ハッシュは列名・型と、農地ごとのジオメトリのWKBと各列の値（orjsonで変換したもの）から、
+    blake2b（128ビット）で計算する。
+    入れ子のプロパティはあらかじめJSON文字列に変換しておくこと。
+
+    Args:
+        gdf (gpd.GeoDataFrame): 農地データ
+
+    Returns:
+        Tuple[List[str], List[str]]: 農地IDのリスト、ハッシュのリスト
+    """
+    if PARCEL_ID in gdf.columns and gdf[PARCEL_ID].is_unique:
+        ids = gdf[PARCEL_ID].astype(str).tolist()
+    else:
+        ids = [str(i) for i in gdf.index]
+    if len(gdf) == 0:
+        return ids, []
+
+    values = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    schema = "\x1f".join(f"{col}:{dtype}" for col, dtype in values.dtypes.items())
+    base = hashlib.blake2b(schema.encode("utf-8"), digest_size=16)
+    hashes = []
+    for wkb, row in zip(shapely.to_wkb(gdf.geometry.to_numpy()), values.itertuples(index=False, name=None)):
+        digest = base.copy()
+        # WKBの長さを先に入れて、値との境目を一意にする
+        digest.update(len(wkb or b"").to_bytes(8, "little"))
+        digest.update(wkb or b"")
+        digest.update(orjson.dumps(row, option=orjson.OPT_SERIALIZE_NUMPY, default=str))
+        hashes.append(digest.hexdigest())
+    return ids, hashes
+
+
+def undo_target(log: List[Dict[str, Any]], layer: str) -> Tuple[int, int]:
+    """直前の操作を取り消すときに戻す版と、取り消す操作の版を求める
+
+    取り消しで作られた版は、戻した先の版の操作をさらに取り消す。
+
+    Args:
+        log (List[Dict[str, Any]]): 版の記録（version, parent, restored_from, undone）
+        layer (str): レイヤー名（エラーメッセージ用）
+
+    Returns:
+        Tuple[int, int]: 戻す版番号、取り消す操作の版番号
+
+    Raises:
+        ValueError: 取り消せる操作が無い場合
+    """
+    if not log:
+        raise ValueError(f"レイヤー '{layer}' には取り消せる操作がありません")
+    by_version = {e["version"]: e for e in log}
+    origin = log[-1]
+    while "undone" in origin:
+        origin = by_version[origin["restored_from"]]
+    if origin["parent"] == 0:
+        raise ValueError(f"レイヤー '{layer}' には取り消せる操作がありません")
+    return origin["parent"], origin["version"]
+
+
+def _stamp(path: str) -> Tuple[int, int]:
+    """ファイルが更新されたかを判定するための更新時刻とサイズ"""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _apply(manifest: Dict[str, str], entry: Dict[str, Any]) -> None:
+    for pid in entry["deletes"]:
+        manifest.pop(pid, None)
+    manifest.update(entry["upserts"])
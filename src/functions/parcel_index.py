@@ -0,0 +1,111 @@
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+# 読み込み時に転置インデックスを作成する列
+INDEXED_COLUMNS = (
+    "Settlement_name",
+    "FarmerIndicationNumberHash",
+    "ClassificationOfLandCodeName",
+    "UsageSituationInvestigationResultCodeName",
+    "TodofukenCode",
+    "ShikuchosonCode",
+    "land_type",
+    "issue_year",
+    "Address",
+)
+
+AREA_COLUMN = "AreaOnRegistry"
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+class ParcelIndex:
+    """農地データの属性インデックス
+
+    列の値ごとに該当する行位置（昇順）の転置リストを保持し、
+    登記面積は範囲検索のためにソート済み配列として保持する。
+    行位置は作成元のGeoDataFrameの iloc に対応する。
+    """
+
+    def __init__(self, gdf: gpd.GeoDataFrame, columns=INDEXED_COLUMNS, area_column: str = AREA_COLUMN):
+        self.gdf = gdf
+        self._postings: Dict[str, Dict[Any, np.ndarray]] = {}
+        for col in columns:
+            self._build_postings(col)
+        self._build_area_index(area_column)
+
+    def __len__(self) -> int:
+        return len(self.gdf)
+
+    def lookup(self, column: str, value: Any) -> np.ndarray:
+        """列の値が value に一致する行位置を返す
+
+        Args:
+            column (str): 列名
+            value (Any): 検索する値
+
+        Returns:
+            np.ndarray: 一致する行位置（昇順）
+        """
+        if column not in self._postings:
+            self._build_postings(column)
+        try:
+            return self._postings[column].get(value, _EMPTY)
+        except TypeError:
+            # ハッシュできない値はどの行にも一致しない
+            return _EMPTY
+
+    def area_range(self, area_min: Optional[float] = None, area_max: Optional[float] = None) -> np.ndarray:
+        """登記面積が範囲内にある行位置を返す
+
+        登記面積を数値に変換できない行は常に除外する。
+
+        Args:
+            area_min (float, optional): 最小面積（Noneの場合は下限なし）
+            area_max (float, optional): 最大面積（Noneの場合は上限なし）
+
+        Returns:
+            np.ndarray: 範囲内の行位置（昇順）
+        """
+        if area_min is None and area_max is None:
+            return self._area_valid
+        lo = 0 if area_min is None else np.searchsorted(self._area_sorted, area_min, side="left")
+        hi = len(self._area_sorted) if area_max is None else np.searchsorted(self._area_sorted, area_max, side="right")
+        # NaNは比較が常に偽になるため、範囲の指定に関わらず残す
+        return np.sort(np.concatenate([self._area_order[lo:hi], self._area_nan]))
+
+    def _build_postings(self, column: str) -> None:
+        if column not in self.gdf.columns:
+            self._postings[column] = {}
+            return
+        groups = self.gdf.groupby(column, sort=False, dropna=True).indices
+        self._postings[column] = {value: positions.astype(np.int64) for value, positions in groups.items()}
+
+    def _build_area_index(self, area_column: str) -> None:
+        n = len(self.gdf)
+        if area_column in self.gdf.columns:
+            series = self.gdf[area_column]
+            # 欠損値はGeoJSONのnullと同様に変換できない値として扱う
+            valid = series.notna().to_numpy()
+            if pd.api.types.is_numeric_dtype(series):
+                areas = series.to_numpy(dtype=float)
+            else:
+                # float() と同じく前後の空白は無視し、数値に変換できない値は除外する
+                text = series.astype(str).str.strip()
+                areas = pd.to_numeric(text, errors="coerce").to_numpy(dtype=float)
+                # 文字列の "nan" は float() で変換できるため、NaNとして残す
+                valid &= ~np.isnan(areas) | text.str.lower().isin(["nan", "+nan", "-nan"]).to_numpy()
+        else:
+            # 面積が無い場合は0として扱う
+            areas = np.zeros(n)
+            valid = np.ones(n, dtype=bool)
+
+        nan = np.isnan(areas)
+        comparable = np.flatnonzero(valid & ~nan)
+        self._area_valid = np.flatnonzero(valid)
+        self._area_nan = np.flatnonzero(valid & nan)
+        self._area_order = comparable[np.argsort(areas[comparable], kind="stable")]
+        self._area_sorted = areas[self._area_order]
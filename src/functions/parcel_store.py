@@ -0,0 +1,457 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from functions.geojson_stream import GeoJSONReader, GeoJSONWriter
+
+from functions.map_history import MapHistory
+from functions.parcel_index import ParcelIndex
+from functions.partitioned_dataset import PartitionedDataset, open_partitioned, write_partitions, MANIFEST_FILE
+from functions.spatial_index import SpatialIndex
+
+REF_DIR = 'src/app/ref'
+
+# レイヤー名（拡張子を除いたファイル名）
+ROW_LAYER = 'map-row'  # 元データ
+MAP_LAYER = 'map'  # フィルタリング後の表示用データ
+REORG_LAYER = 'map-reorg'  # 再編成後のデータ
+
+# 版管理するレイヤー。変更された農地だけを履歴に記録し、最新版を復元して読み込む
+VERSIONED_LAYERS = (MAP_LAYER, REORG_LAYER)
+
+# 都道府県・市区町村・集落ごとに分割して保存するレイヤー。
+# 分割はメモリマップするArrow IPCファイルで、セッションやワーカープロセスで共有する
+PARTITIONED_LAYERS = (ROW_LAYER,)
+
+# 分割の一部だけを読み込んだ結果を保持する数
+MAX_CACHED_SUBSETS = 8
+
+# Parquetの列として保持できない入れ子のプロパティ。JSON文字列として格納する
+_NESTED_COLUMNS = ("history",)
+
+# GeoJSONを読み書きするときに一度に扱う地物の数
+GEOJSON_CHUNK_SIZE = 10000
+
+
+class ParcelStore:
+    """農地データをGeoParquet（WKBジオメトリ）で保持するストア
+
+    レイヤーごとに一度だけ読み込み、以降はメモリ上のGeoDataFrameを返す。
+    元データはファイルの更新時刻が、版管理するレイヤーは最新の版番号が変わった場合のみ読み直す。
+    元データは分割したArrow IPCファイルをメモリマップして読み込み、他のプロセスと共有する。
+    検索条件に関係する分割だけを読み込むこともできる（select_partitions）。
+    GeoJSONへの変換は地図表示などの出力時に to_geojson で行う。
+    複数のスレッドから同時に使っても、読み込み・インデックスの作成・旧形式の変換は一度だけ行う。
+    """
+
+    def __init__(self, ref_dir: str = REF_DIR, history: Optional[MapHistory] = None):
+        self.ref_dir = ref_dir
+        self.history = history or MapHistory(os.path.join(ref_dir, 'history'))
+        self._cache: Dict[Hashable, Tuple[Any, gpd.GeoDataFrame]] = {}
+        self._indexes: Dict[Tuple[Hashable, type], Tuple[Any, Any]] = {}
+        # キャッシュの作成と旧形式の変換をスレッド間で排他する（_stamp から save を呼ぶため再入可能にする）
+        self._lock = threading.RLock()
+
+    def path(self, layer: str) -> str:
+        return os.path.join(self.ref_dir, f"{layer}.parquet")
+
+    def partition_dir(self, layer: str) -> str:
+        return os.path.join(self.ref_dir, layer)
+
+    def exists(self, layer: str) -> bool:
+        if layer in VERSIONED_LAYERS and self.history.head(layer) > 0:
+            return True
+        if layer in PARTITIONED_LAYERS and os.path.exists(self._manifest_path(layer)):
+            return True
+        return os.path.exists(self.path(layer)) or os.path.exists(self._geojson_path(layer))
+
+    def load(self, layer: str, partitions: Optional[Sequence[str]] = None) -> gpd.GeoDataFrame:
+        """レイヤーを読み込む
+
+        返り値はキャッシュと共有されるため、変更する場合は copy() してから行うこと。
+
+        Args:
+            layer (str): レイヤー名
+            partitions (Sequence[str], optional): 読み込む分割ID（select_partitions の返り値。省略時は全体）
+
+        Returns:
+            gpd.GeoDataFrame: 農地データ
+        """
+        with self._lock:
+            stamp = self._stamp(layer)
+            key = self._cache_key(layer, partitions)
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+
+            if layer in VERSIONED_LAYERS:
+                gdf = self.history.checkout(layer)
+            elif layer in PARTITIONED_LAYERS:
+                dataset = self.load_shared(layer)
+                if partitions is not None:
+                    dataset = dataset.select(ids=partitions)
+                gdf = dataset.to_geodataframe()
+            else:
+                gdf = gpd.read_parquet(self.path(layer))
+            self._cache[key] = (stamp, gdf)
+            self._evict_subsets()
+            return gdf
+
+    def load_shared(self, layer: str = ROW_LAYER) -> PartitionedDataset:
+        """分割したレイヤーをメモリマップして取得する
+
+        ワーカープロセスにはこの返り値を渡す（pickle では分割の一覧だけが送られる）。
+        必要な分割・行だけを select と to_geodataframe で取り出せば、全体を読み込み直す必要はない。
+
+        Args:
+            layer (str): 分割したレイヤー名
+
+        Returns:
+            PartitionedDataset: 読み取り専用の農地データ
+        """
+        if layer not in PARTITIONED_LAYERS:
+            raise ValueError(f"レイヤー '{layer}' は分割して保存されていません")
+        with self._lock:
+            self._stamp(layer)
+        return open_partitioned(self.partition_dir(layer))
+
+    def select_partitions(
+        self,
+        layer: str = ROW_LAYER,
+        prefecture_code: Optional[str] = None,
+        city_code: Optional[str] = None,
+        settlement: Optional[str] = None,
+        bounds: Optional[Sequence[float]] = None
+    ) -> Optional[Tuple[str, ...]]:
+        """条件に関係する分割IDを返す
+
+        条件が無い場合や、分割して保存されていないレイヤーの場合は None（全体）を返す。
+
+        Args:
+            layer (str): レイヤー名
+            prefecture_code (str, optional): 都道府県コード
+            city_code (str, optional): 市区町村コード
+            settlement (str, optional): 集落名
+            bounds (Sequence[float], optional): 範囲 [西端経度, 南端緯度, 東端経度, 北端緯度]
+
+        Returns:
+            Optional[Tuple[str, ...]]: 分割IDの一覧
+        """
+        if layer not in PARTITIONED_LAYERS:
+            return None
+        if prefecture_code is None and city_code is None and settlement is None and bounds is None:
+            return None
+        selected = self.load_shared(layer).select(prefecture_code, city_code, settlement, bounds)
+        return selected.ids
+
+    def load_index(self, layer: str, partitions: Optional[Sequence[str]] = None) -> ParcelIndex:
+        """レイヤーの属性インデックスを取得する
+
+        インデックスはレイヤーの読み込みごとに一度だけ作成し、load の返り値の行位置に対応する。
+
+        Args:
+            layer (str): レイヤー名
+            partitions (Sequence[str], optional): 読み込む分割ID
+
+        Returns:
+            ParcelIndex: 属性インデックス
+        """
+        return self._load_derived(layer, ParcelIndex, partitions)
+
+    def load_spatial_index(self, layer: str, partitions: Optional[Sequence[str]] = None) -> SpatialIndex:
+        """レイヤーの空間インデックス（STRtree）を取得する
+
+        属性インデックスと同様に、レイヤーの読み込みごとに一度だけ作成する。
+
+        Args:
+            layer (str): レイヤー名
+            partitions (Sequence[str], optional): 読み込む分割ID
+
+        Returns:
+            SpatialIndex: 空間インデックス
+        """
+        return self._load_derived(layer, SpatialIndex, partitions)
+
+    def save(self, layer: str, gdf: gpd.GeoDataFrame, message: str = "") -> Optional[int]:
+        """レイヤーを保存する
+
+        版管理するレイヤーは、最新版から変更された農地だけを履歴に記録する。
+
+        Args:
+            layer (str): レイヤー名
+            gdf (gpd.GeoDataFrame): 保存する農地データ
+            message (str, optional): 版の説明
+
+        Returns:
+            Optional[int]: 版番号（版管理しないレイヤーはNone）
+        """
+        gdf = encode_nested(gdf)
+        with self._lock:
+            if layer in VERSIONED_LAYERS:
+                version = self.history.commit(layer, gdf, message)
+                self._cache[layer] = (version, gdf)
+                return version
+
+            if layer in PARTITIONED_LAYERS:
+                write_partitions(gdf, self.partition_dir(layer))
+                # 次の読み込みでメモリマップしたファイルから取り出す
+                for key in [key for key in self._cache if self._cache_layer(key) == layer]:
+                    del self._cache[key]
+                return None
+
+            path = self.path(layer)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            gdf.to_parquet(path)
+            self._cache[layer] = (os.path.getmtime(path), gdf)
+            return None
+
+    def update(self, layer: str, gdf: gpd.GeoDataFrame, changed: np.ndarray, message: str = "") -> int:
+        """レイヤーの一部の農地を更新する
+
+        変更された農地だけを書き込むため、入出力は変更数に比例する。
+
+        Args:
+            layer (str): 版管理するレイヤー名
+            gdf (gpd.GeoDataFrame): 更新後のレイヤー全体（load の返り値を copy して変更したもの）
+            changed (np.ndarray): 変更された行を表す真偽値配列
+            message (str, optional): 版の説明
+
+        Returns:
+            int: 版番号
+        """
+        if layer not in VERSIONED_LAYERS:
+            raise ValueError(f"レイヤー '{layer}' は部分更新できません")
+        changed_rows = encode_nested(gdf[changed])
+        with self._lock:
+            version = self.history.commit_changes(layer, changed_rows, message=message)
+            self._cache[layer] = (version, gdf)
+            return version
+
+    def restore(self, layer: str, version: Optional[int] = None) -> int:
+        """レイヤーを過去の版に戻す
+
+        Args:
+            layer (str): 版管理するレイヤー名
+            version (int, optional): 戻す版番号（省略時は直前の操作を取り消す）
+
+        Returns:
+            int: 新しい版番号
+        """
+        if version is None:
+            return self.history.undo(layer)
+        return self.history.restore(layer, version)
+
+    def versions(self, layer: str) -> List[Dict[str, Any]]:
+        """版管理するレイヤーの版の一覧を返す"""
+        return self.history.versions(layer)
+
+    def stamp(self, layer: str) -> Any:
+        """レイヤーが変更されたかを判定する値（版番号または更新時刻）を返す"""
+        with self._lock:
+            return self._stamp(layer)
+
+    def _load_derived(self, layer: str, factory: type, partitions: Optional[Sequence[str]] = None) -> Any:
+        """レイヤーから作成するインデックスをキャッシュして返す"""
+        with self._lock:
+            gdf = self.load(layer, partitions)
+            key = self._cache_key(layer, partitions)
+            stamp = self._cache[key][0]
+            cached = self._indexes.get((key, factory))
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            derived = factory(gdf)
+            self._indexes[(key, factory)] = (stamp, derived)
+            return derived
+
+    @staticmethod
+    def _cache_key(layer: str, partitions: Optional[Sequence[str]]) -> Hashable:
+        if partitions is None or layer not in PARTITIONED_LAYERS:
+            return layer
+        return (layer, tuple(sorted(partitions)))
+
+    @staticmethod
+    def _cache_layer(key: Hashable) -> str:
+        return key[0] if isinstance(key, tuple) else key
+
+    def _evict_subsets(self) -> None:
+        """分割の一部を読み込んだ結果を古いものから捨てる"""
+        subsets = [key for key in self._cache if isinstance(key, tuple)]
+        for key in subsets[:max(0, len(subsets) - MAX_CACHED_SUBSETS)]:
+            del self._cache[key]
+            for factory in (ParcelIndex, SpatialIndex):
+                self._indexes.pop((key, factory), None)
+
+    def _stamp(self, layer: str) -> Any:
+        """キャッシュが有効かを判定する値（版番号または更新時刻）"""
+        if layer in VERSIONED_LAYERS:
+            if self.history.head(layer) == 0:
+                self._import_legacy(layer)
+            return self.history.head(layer)
+        if layer in PARTITIONED_LAYERS:
+            if not os.path.exists(self._manifest_path(layer)):
+                # 分割前の形式（GeoParquet・GeoJSON）しかない場合は一度だけ変換する
+                if os.path.exists(self.path(layer)):
+                    self.save(layer, gpd.read_parquet(self.path(layer)))
+                else:
+                    self.save(layer, self._read_legacy_geojson(layer))
+            return os.stat(self._manifest_path(layer)).st_mtime_ns
+        if not os.path.exists(self.path(layer)):
+            # 旧形式（GeoJSON）しかない場合は一度だけ変換する
+            self.save(layer, self._read_legacy_geojson(layer))
+        return os.path.getmtime(self.path(layer))
+
+    def _manifest_path(self, layer: str) -> str:
+        return os.path.join(self.partition_dir(layer), MANIFEST_FILE)
+
+    def _geojson_path(self, layer: str) -> str:
+        return os.path.join(self.ref_dir, f"{layer}.geojson")
+
+    def _import_legacy(self, layer: str) -> None:
+        """履歴が無いレイヤーを旧形式のファイルから最初の版として取り込む"""
+        if os.path.exists(self.path(layer)):
+            gdf = gpd.read_parquet(self.path(layer))
+        else:
+            gdf = self._read_legacy_geojson(layer)
+        self.save(layer, gdf, message="既存のファイルから取り込み")
+
+    def _read_legacy_geojson(self, layer: str) -> gpd.GeoDataFrame:
+        geojson_path = self._geojson_path(layer)
+        if not os.path.exists(geojson_path):
+            raise FileNotFoundError(f"レイヤー '{layer}' が見つかりません: {self.path(layer)}")
+        return read_geojson(geojson_path)
+
+
+_store: Optional[ParcelStore] = None
+_store_lock = threading.Lock()
+
+
+def get_parcel_store() -> ParcelStore:
+    """プロセス内で共有するParcelStoreを取得する"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ParcelStore()
+    return _store
+
+
+def read_geojson(path: str, chunk_size: int = GEOJSON_CHUNK_SIZE) -> gpd.GeoDataFrame:
+    """GeoJSONファイルをGeoDataFrameとして読み込む
+
+    ファイル全体を辞書として読み込まず、chunk_size 件ずつGeoDataFrameに変換してつなげる。
+
+    Args:
+        path (str): GeoJSONファイルのパス
+        chunk_size (int, optional): 一度に変換する地物の数
+
+    Returns:
+        gpd.GeoDataFrame: EPSG:4326の農地データ
+    """
+    frames = list(read_geojson_chunks(path, chunk_size))
+    if not frames:
+        return gpd.GeoDataFrame(columns=["geometry"], geometry="geometry", crs="EPSG:4326")
+    if len(frames) == 1:
+        return frames[0]
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), geometry="geometry", crs="EPSG:4326")
+
+
+def read_geojson_chunks(path: str, chunk_size: int = GEOJSON_CHUNK_SIZE, crs: Optional[str] = "EPSG:4326") -> Iterator[gpd.GeoDataFrame]:
+    """GeoJSONファイルを chunk_size 件ずつのGeoDataFrameとして読み込む
+
+    メモリ使用量はファイル全体ではなく chunk_size 件分に比例する。
+
+    Args:
+        path (str): GeoJSONファイルのパス
+        chunk_size (int, optional): 一度に読み込む地物の数
+        crs (str, optional): 座標参照系（Noneの場合はファイルの crs を使い、無ければEPSG:4326とする）
+
+    Yields:
+        gpd.GeoDataFrame: 農地データ
+    """
+    with GeoJSONReader(path) as reader:
+        chunk_crs = crs or reader.crs or "EPSG:4326"
+        for features in reader.chunks(chunk_size):
+            yield gpd.GeoDataFrame.from_features(features, crs=chunk_crs)
+
+
+def from_geojson(geojson_data: Dict[str, Any]) -> gpd.GeoDataFrame:
+    """GeoJSONデータ（FeatureCollection）をGeoDataFrameに変換する"""
+    gdf = gpd.GeoDataFrame.from_features(geojson_data)
+    return gdf.set_crs(epsg=4326, allow_override=True)
+
+
+def to_geojson(gdf: gpd.GeoDataFrame, name: Optional[str] = None) -> Dict[str, Any]:
+    """GeoDataFrameをGeoJSONデータ（FeatureCollection）に変換する
+
+    folium への受け渡しやファイル出力など、GeoJSONが必要な箇所でのみ使う。
+
+    Args:
+        gdf (gpd.GeoDataFrame): 農地データ
+        name (str, optional): FeatureCollectionの名前
+
+    Returns:
+        Dict[str, Any]: GeoJSONデータ
+    """
+    features = list(iter_geojson_features(gdf))
+
+    geojson_data = {"type": "FeatureCollection"}
+    if name is not None:
+        geojson_data["name"] = name
+        geojson_data["crs"] = {
+            "type": "name",
+            "properties": {
+                "name": "urn:ogc:def:crs:OGC:1.3:CRS84"
+            }
+        }
+    geojson_data["features"] = features
+    return geojson_data
+
+
+def write_geojson(gdf: gpd.GeoDataFrame, path: str, name: Optional[str] = None, chunk_size: int = GEOJSON_CHUNK_SIZE) -> int:
+    """GeoDataFrameをGeoJSONファイルに書き出す
+
+    to_geojson で FeatureCollection 全体を作らず、chunk_size 件ずつ地物に変換して書き出す。
+
+    Args:
+        gdf (gpd.GeoDataFrame): 農地データ
+        path (str): 出力先のパス
+        name (str, optional): FeatureCollectionの名前
+        chunk_size (int, optional): 一度に変換する地物の数
+
+    Returns:
+        int: 書き出した地物の数
+    """
+    with GeoJSONWriter(path, name=name) as writer:
+        for start in range(0, len(gdf), chunk_size):
+            writer.write(iter_geojson_features(gdf.iloc[start:start + chunk_size]))
+    return writer.count
+
+
+def iter_geojson_features(gdf: gpd.GeoDataFrame) -> Iterator[Dict[str, Any]]:
+    """GeoDataFrameの各行をGeoJSONの地物（EPSG:4326）として返す"""
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+
+    for feature in gdf.iterfeatures(na="null", drop_id=True):
+        properties = feature["properties"]
+        for col in _NESTED_COLUMNS:
+            if isinstance(properties.get(col), str):
+                properties[col] = json.loads(properties[col])
+        yield feature
+
+
+def encode_nested(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """入れ子のプロパティをJSON文字列に変換する"""
+    nested = [col for col in _NESTED_COLUMNS if col in gdf.columns and gdf[col].dtype == object]
+    if not nested:
+        return gdf
+    gdf = gdf.copy()
+    for col in nested:
+        gdf[col] = gdf[col].map(
+            lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else v
+        )
+    return gdf
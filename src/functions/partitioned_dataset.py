@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from functions.shared_dataset import SharedDataset, open_shared, write_shared
+
+# 分割の単位（都道府県コード → 市区町村コード → 集落）
+PREFECTURE_COLUMN = "TodofukenCode"
+CITY_COLUMN = "ShikuchosonCode"
+SETTLEMENT_ID_COLUMN = "Settlement_id"
+SETTLEMENT_COLUMN = "Settlement_name"
+
+MANIFEST_FILE = "manifest.json"
+
+# 値が無い場合のディレクトリ名
+_MISSING = "_"
+
+
+class PartitionedDataset:
+    """都道府県・市区町村・集落ごとに分割して保存した農地データ
+
+    分割ごとにメモリマップするArrow IPCファイル（SharedDataset）を持ち、
+    manifest.json に列の一覧と、分割ごとのキー・農地数・範囲（経緯度）を記録する。
+    select で条件に関係する分割だけを選び、読み込むのは選んだ分割のファイルだけにする。
+
+    ディレクトリ構成:
+        manifest.json
+        <都道府県コード>/<市区町村コード>/<集落ID>.arrow
+    """
+
+    def __init__(self, root: str, manifest: Optional[Dict[str, Any]] = None):
+        self.root = root
+        if manifest is None:
+            with open(os.path.join(root, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        self.manifest = manifest
+        self.partitions: List[Dict[str, Any]] = manifest["partitions"]
+        self._offsets = np.cumsum([0] + [p["count"] for p in self.partitions])
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    def __reduce__(self):
+        return PartitionedDataset, (self.root, self.manifest)
+
+    @property
+    def ids(self) -> Tuple[str, ...]:
+        return tuple(p["id"] for p in self.partitions)
+
+    def select(
+        self,
+        prefecture_code: Optional[str] = None,
+        city_code: Optional[str] = None,
+        settlement: Optional[str] = None,
+        bounds: Optional[Sequence[float]] = None,
+        ids: Optional[Sequence[str]] = None
+    ) -> "PartitionedDataset":
+        """条件に関係する分割だけを含むデータセットを返す（ファイルは読み込まない）
+
+        Args:
+            prefecture_code (str, optional): 都道府県コード
+            city_code (str, optional): 市区町村コード
+            settlement (str, optional): 集落名
+            bounds (Sequence[float], optional): 範囲 [西端経度, 南端緯度, 東端経度, 北端緯度]
+            ids (Sequence[str], optional): 分割ID
+
+        Returns:
+            PartitionedDataset: 条件に関係する分割
+        """
+        selected = []
+        for partition in self.partitions:
+            if prefecture_code is not None and partition["prefecture_code"] != str(prefecture_code):
+                continue
+            if city_code is not None and partition["city_code"] != str(city_code):
+                continue
+            if settlement is not None and settlement not in partition["settlements"]:
+                continue
+            if ids is not None and partition["id"] not in ids:
+                continue
+            if bounds is not None and not _intersects(partition["bounds"], bounds):
+                continue
+            selected.append(partition)
+        return PartitionedDataset(self.root, {**self.manifest, "partitions": selected})
+
+    def to_geodataframe(
+        self,
+        rows: Optional[np.ndarray] = None,
+        columns: Optional[Sequence[str]] = None
+    ) -> gpd.GeoDataFrame:
+        """分割をつなげたGeoDataFrameとして取り出す
+
+        Args:
+            rows (np.ndarray, optional): 取り出す行位置（分割を manifest の順につなげた位置。省略時は全行）
+            columns (Sequence[str], optional): 取り出す属性列（省略時は全列）
+
+        Returns:
+            gpd.GeoDataFrame: 農地データ（行番号は0から振り直す）
+        """
+        frames = []
+        if rows is None:
+            for i in range(len(self.partitions)):
+                frames.append(self.partition(i).to_geodataframe(columns=columns))
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            owner = np.searchsorted(self._offsets, rows, side="right") - 1
+            # 行の順序を保つため、連続して同じ分割に属する行ごとに取り出す
+            breaks = np.flatnonzero(np.diff(owner)) + 1
+            for chunk in np.split(np.arange(len(rows)), breaks):
+                if len(chunk) == 0:
+                    continue
+                i = owner[chunk[0]]
+                frames.append(self.partition(i).to_geodataframe(rows=rows[chunk] - self._offsets[i], columns=columns))
+        if not frames:
+            # 該当する分割が無い場合も列は揃えて返す
+            names = [c for c in self.manifest["columns"] if columns is None or c in columns or c == "geometry"]
+            return gpd.GeoDataFrame(columns=names, geometry="geometry", crs=self.manifest["crs"])
+        if len(frames) == 1:
+            return frames[0]
+        return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), geometry="geometry", crs=frames[0].crs)
+
+    def partition(self, i: int) -> SharedDataset:
+        """i番目の分割をメモリマップして返す"""
+        return open_shared(os.path.join(self.root, self.partitions[i]["file"]))
+
+
+def write_partitions(gdf: gpd.GeoDataFrame, root: str) -> PartitionedDataset:
+    """農地データを分割して保存する
+
+    既存の分割はすべて置き換える。manifest.json は最後に書き込むため、
+    書き込み中に読み込んだ場合は以前の manifest.json の分割が使われる。
+
+    Args:
+        gdf (gpd.GeoDataFrame): 農地データ（入れ子のプロパティはJSON文字列に変換しておくこと）
+        root (str): 保存先のディレクトリ
+
+    Returns:
+        PartitionedDataset: 保存したデータセット
+    """
+    keys = [_key_column(gdf, col) for col in (PREFECTURE_COLUMN, CITY_COLUMN, SETTLEMENT_ID_COLUMN)]
+    bounds = gdf.geometry.bounds.to_numpy() if len(gdf) else np.empty((0, 4))
+
+    partitions = []
+    written = set()
+    groups = pd.Series(np.arange(len(gdf))).groupby(keys, sort=True).indices
+    for (prefecture_code, city_code, settlement_id), positions in groups.items():
+        part = gdf.iloc[positions].reset_index(drop=True)
+        file = os.path.join(prefecture_code, city_code, f"{settlement_id}.arrow")
+        write_shared(part, os.path.join(root, file))
+        written.add(file)
+        settlements = part[SETTLEMENT_COLUMN].dropna().unique().tolist() if SETTLEMENT_COLUMN in part.columns else []
+        partitions.append({
+            "id": f"{prefecture_code}/{city_code}/{settlement_id}",
+            "file": file,
+            "prefecture_code": prefecture_code,
+            "city_code": city_code,
+            "settlements": settlements,
+            "count": len(part),
+            "bounds": [
+                float(bounds[positions, 0].min()), float(bounds[positions, 1].min()),
+                float(bounds[positions, 2].max()), float(bounds[positions, 3].max())
+            ],
+        })
+
+    manifest = {
+        "columns": [c if c != gdf.geometry.name else "geometry" for c in gdf.columns],
+        "crs": gdf.crs.to_string() if gdf.crs is not None else None,
+        "partitions": partitions,
+    }
+    os.makedirs(root, exist_ok=True)
+    tmp_path = os.path.join(root, f"{MANIFEST_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, os.path.join(root, MANIFEST_FILE))
+    _remove_stale(root, written)
+    return PartitionedDataset(root, manifest)
+
+
+_opened: Dict[str, Tuple[Tuple[int, int], PartitionedDataset]] = {}
+_opened_lock = threading.Lock()
+
+
+def open_partitioned(root: str) -> PartitionedDataset:
+    """分割したデータセットを開く（manifest.json が更新された場合のみ読み直す）"""
+    stat = os.stat(os.path.join(root, MANIFEST_FILE))
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _opened_lock:
+        cached = _opened.get(root)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, PartitionedDataset(root))
+            _opened[root] = cached
+        return cached[1]
+
+
+def _key_column(gdf: gpd.GeoDataFrame, column: str) -> np.ndarray:
+    """分割のキー（ディレクトリ名）に使う値。列が無い・値が無い場合は _ とする"""
+    if column not in gdf.columns:
+        return np.full(len(gdf), _MISSING, dtype=object)
+    values = gdf[column].astype(object)
+    values = values.where(values.notna(), _MISSING).astype(str)
+    # パス区切りを含む値はディレクトリ名に使えないため置き換える
+    return values.str.replace(os.sep, "_", regex=False).to_numpy()
+
+
+def _intersects(a: Sequence[float], b: Sequence[float]) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _remove_stale(root: str, written: set) -> None:
+    """新しい manifest.json に含まれない分割のファイルを削除する"""
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.endswith(".arrow"):
+                continue
+            path = os.path.join(dirpath, filename)
+            if os.path.relpath(path, root) not in written:
+                os.remove(path)
+    for dirpath, _, _ in os.walk(root, topdown=False):
+        if dirpath != root and not os.listdir(dirpath):
+            os.rmdir(dirpath)
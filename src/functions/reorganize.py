@@ -1,16 +1,79 @@
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
 import geopandas as gpd
+import atexit
+import hashlib
 import math
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from fractions import Fraction
 import numpy as np
-from shapely.ops import voronoi_diagram
-from shapely.geometry import MultiPolygon, Polygon
+import shapely
 import pandas as pd
 from sklearn.cluster import DBSCAN
 from scipy.spatial import KDTree
-from functions.cost_analyzer import AnalysisResult, run_analysis ##################
+from scipy.sparse import csr_matrix
+from functions.cost_analyzer import AnalysisResult, extend_analysis, run_analysis ##################
+from functions.disk_cache import evict_lru, touch
+from functions.map_history import PARCEL_ID
+from functions.parcel_store import REF_DIR
+from functions.shared_dataset import SharedDataset, close_shared, open_shared, write_shared
 
+logger = logging.getLogger(__name__)
+
+# 田・畑の割り当てとコスト分析を別々のプロセスで実行する農地数の下限（少ない場合はプロセス間の受け渡しの方が遅い）
+PARALLEL_MIN_PARCELS = 2000
+
+# 再編成に使うプロセス数（田・畑・コスト分析）
+MAX_WORKERS = 3
+
+# 分割して再編成する場合の、タイルの一辺の長さ（m）
+SPLIT_TILE_SIZE = 2000
+
+# 分割して再編成する場合の集落の列
+SETTLEMENT_COLUMN = "Settlement_name"
+
+# ワーカープロセスに渡す農地データを一時的に書き出すディレクトリ
+SHARED_DIR = os.path.join(REF_DIR, 'cache', 'shared')
+
+# ワーカープロセスでの割り当て・コスト分析に使う属性列と、割り当てで書き換わる列
+_SHARED_COLUMNS = ["FarmerIndicationNumberHash"]
+_ASSIGNED_COLUMNS = ["cluster", "FarmerIndicationNumberHash", "reorganized"]
+
+# 分けて再編成する場合に、ワーカープロセスの再編成で書き換わる列
+_PIECE_COLUMNS = _ASSIGNED_COLUMNS + ["worktime_reduced", "fuel_cost_reduced"]
+
+# 区画化の結果・階層を保存するディレクトリ（プロセスをまたいで再利用する）
+PARTITION_CACHE_DIR = os.path.join(REF_DIR, 'cache', 'partition')
+
+# 区画化の結果・階層のファイルの合計サイズの上限（超えた分は使われていない順に削除する）
+MAX_PARTITION_CACHE_BYTES = 128 << 20
+
+# 区画化の処理を変更した場合に上げる（キーに含めるため、以前の結果は使われなくなる）
+PARTITION_CACHE_VERSION = 3
+
+# メモリ上に保持する区画化の結果・階層の数
+MAX_CACHED_PARTITIONS = 16
+MAX_CACHED_HIERARCHIES = 4
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# (形状のハッシュ, 区画数) → (農地ごとのクラスタid, 区画ごとの形状)
+_partitions: "OrderedDict[Tuple[str, int], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+# 形状のハッシュ → 区画化の階層
+_hierarchies: "OrderedDict[str, _PartitionHierarchy]" = OrderedDict()
+_partition_lock = threading.Lock()
 
 
 @dataclass
@@ -20,20 +83,645 @@ class Scenario:
     hata_farmer_N: int
     ta_exfarmer_ids_and_rates: Dict[str, float]
     hata_exfarmer_ids_and_rates: Dict[str, float]
+    # 農地の割り当て方法
+    #   "capacity": 農家ごとの面積の割合を上限として、農地を直接割り当てる
+    #   "clusters": 面積割合の分母の最小公倍数の数に区画化し、区画を割り当てる
+    method: str = "capacity"
+    # 割り当て後に局所探索（optimize_plan）で改善する時間（秒）。0 の場合は行わない
+    optimize_seconds: float = 0.0
+
+
+@dataclass
+class OptimizationResult:
+    """局所探索による再編成結果の改善の結果
+
+    Attributes:
+        plan (gpd.GeoDataFrame): 改善後の再編成結果
+        initial_cost (float): 改善前の目的関数の値
+        cost (float): 改善後の目的関数の値
+        moves (int): 農地を別の農家に移した回数
+        swaps (int): 農家の間で農地を交換した回数
+        sweeps (int): すべての境界の農地を調べた回数
+        elapsed (float): かかった時間（秒）
+        stopped (str): 終了した理由（"converged": 改善できなくなった、"time": 時間切れ、"interrupted": 中断）
+    """
+    plan: gpd.GeoDataFrame
+    initial_cost: float
+    cost: float
+    moves: int
+    swaps: int
+    sweeps: int
+    elapsed: float
+    stopped: str
+
+
+@dataclass
+class _SideFarmers:
+    """田または畑に置く農家
+
+    Attributes:
+        exfarmer_ids (List[str]): 現農家のID
+        newfarmer_N (int): 新規農家の数
+        arearates (List[float]): 面積割合のリスト（現農家の順、続けて新規農家）
+    """
+    exfarmer_ids: List[str]
+    newfarmer_N: int
+    arearates: List[float]
 
 def reorganize(
-    geojson_data: Dict[str, Any],
-    scenario: Scenario
-) -> Tuple[Dict[str, Any], AnalysisResult]:
+    parcels: Union[gpd.GeoDataFrame, Dict[str, Any]],
+    scenario: Scenario,
+    parallel: bool = True,
+    stop_event: Optional[threading.Event] = None
+) -> Tuple[gpd.GeoDataFrame, AnalysisResult]:
     """農地データを再編成する
 
+    農地が PARALLEL_MIN_PARCELS 件以上の場合、田・畑の割り当てと再編成前のコスト分析を
+    別々のプロセスで同時に実行する。
+    scenario.optimize_seconds が正の場合は、割り当てた結果を局所探索（optimize_plan）で改善する。
+
     Args:
-        geojson_data (Dict): 再編成対象のGeoJSONデータ
+        parcels (Union[gpd.GeoDataFrame, Dict]): 再編成対象の農地データ（GeoDataFrameまたはGeoJSONデータ）
         scenario (Scenario): 再編成のシナリオ
+        parallel (bool, optional): 複数のプロセスで実行するか. Defaults to True.
+        stop_event (threading.Event, optional): 局所探索を中断するイベント（中断した時点で最良の結果を返す）
+
+    Returns:
+        Tuple[gpd.GeoDataFrame, AnalysisResult]: 再編成後の農地データ、コスト分析結果
+    """
+    gdf, ta_gdf, hata_gdf = _prepare_parcels(parcels)
+    return _reorganize_sides(gdf, ta_gdf, hata_gdf, scenario, parallel, stop_event)
+
+def _reorganize_sides(
+    gdf: gpd.GeoDataFrame,
+    ta_gdf: gpd.GeoDataFrame,
+    hata_gdf: gpd.GeoDataFrame,
+    scenario: Scenario,
+    parallel: bool = True,
+    stop_event: Optional[threading.Event] = None,
+    sides: Optional[Tuple["_SideFarmers", "_SideFarmers"]] = None
+) -> Tuple[gpd.GeoDataFrame, AnalysisResult]:
+    """田畑に分けた農地データを再編成する（reorganize の本体。分類は _create_tahata_gdf で済ませておく）
+
+    sides を渡した場合は、シナリオの農家の代わりに田畑ごとの農家（_piece_sides で範囲に振り分けたもの）を使う。
+    """
+    ta_side, hata_side = sides if sides is not None else _scenario_sides(scenario)
+
+    # 田畑ごとに農家のbasepointをexfarmer_ids_and_ratesから取得
+    ta_ex_basepoint = _getbasepoints(ta_gdf, ta_side.exfarmer_ids)
+    hata_ex_basepoint = _getbasepoints(hata_gdf, hata_side.exfarmer_ids)
+
+    all_exfarmer_ids = list(set(ta_side.exfarmer_ids).union(set(hata_side.exfarmer_ids)))
+    ta_args = (ta_gdf, ta_ex_basepoint, ta_side.arearates, ta_side.newfarmer_N, scenario.method, "田")
+    hata_args = (hata_gdf, hata_ex_basepoint, hata_side.arearates, hata_side.newfarmer_N, scenario.method, "畑")
+
+    if parallel and len(gdf) >= PARALLEL_MIN_PARCELS:
+        # 田畑ごとの割り当てとコスト分析は互いに独立しているため、別々のプロセスで同時に実行する
+        # （ワーカーには共有の農地データと行位置だけを渡し、割り当てた列だけを受け取る）
+        executor = _get_executor()
+        with _shared_parcels(gdf) as dataset:
+            ta_future = executor.submit(_assign_shared, dataset, gdf.index.get_indexer(ta_gdf.index), *ta_args[1:])
+            hata_future = executor.submit(_assign_shared, dataset, gdf.index.get_indexer(hata_gdf.index), *hata_args[1:])
+            analysis_future = executor.submit(_analyze_shared, dataset, all_exfarmer_ids)
+            ta_gdf_poly = _with_assignment(ta_gdf, ta_future.result())
+            hata_gdf_poly = _with_assignment(hata_gdf, hata_future.result())
+            result = analysis_future.result()
+        ta_gdf_poly = _apply_analysis(ta_gdf_poly, result, all_exfarmer_ids)
+        hata_gdf_poly = _apply_analysis(hata_gdf_poly, result, all_exfarmer_ids)
+    else:
+        # 田畑ごとに農地を農家に割り当てる
+        ta_gdf_poly, _ = _assign_farmers(*ta_args)
+        hata_gdf_poly, _ = _assign_farmers(*hata_args)
+
+        # コスト分析結果をgdfに格納(現在はpolyのみ)
+        result, ta_gdf_poly, hata_gdf_poly = _excute_analysis(gdf, ta_gdf_poly, hata_gdf_poly, all_exfarmer_ids)
+
+    # polyのみを結合して返す（GeoJSONへの変換は出力側で行う）
+    reorganized_gdf = gpd.GeoDataFrame(pd.concat([ta_gdf_poly, hata_gdf_poly]), crs="EPSG:4326")
+    if scenario.optimize_seconds > 0:
+        reorganized_gdf = optimize_plan(reorganized_gdf, scenario.optimize_seconds, stop_event).plan
+    return reorganized_gdf, result
+
+def reorganize_many(
+    parcels: Union[gpd.GeoDataFrame, Dict[str, Any]],
+    scenarios: List[Scenario],
+    parallel: bool = True
+) -> Tuple[List[Tuple[gpd.GeoDataFrame, AnalysisResult]], pd.DataFrame]:
+    """同じ農地データを複数のシナリオで再編成し、結果を比較する
+
+    シナリオに依存しない処理（CRSの設定、田畑の再分類、現農家の中心農地、再編成前のコスト分析、区画化の階層）は一度だけ行い、
+    シナリオごとの田・畑の割り当てをプロセスプールで同時に実行する。
+
+    Args:
+        parcels (Union[gpd.GeoDataFrame, Dict]): 再編成対象の農地データ（GeoDataFrameまたはGeoJSONデータ）
+        scenarios (List[Scenario]): 再編成のシナリオのリスト
+        parallel (bool, optional): 複数のプロセスで実行するか. Defaults to True.
 
     Returns:
-        Tuple[Dict[str, Any], AnalysisResult]: 再編成後のGeoJSONデータ、コスト分析結果
+        Tuple[List[Tuple[gpd.GeoDataFrame, AnalysisResult]], pd.DataFrame]:
+            シナリオごとの（再編成後の農地データ、コスト分析結果）のリストと、シナリオごとのコスト削減量の比較表
     """
+    gdf, ta_gdf, hata_gdf = _prepare_parcels(parcels)
+
+    # すべてのシナリオの現農家の中心農地をまとめて求める
+    ta_ids = list(dict.fromkeys(ID for scenario in scenarios for ID in scenario.ta_exfarmer_ids_and_rates))
+    hata_ids = list(dict.fromkeys(ID for scenario in scenarios for ID in scenario.hata_exfarmer_ids_and_rates))
+    ta_basepoints = _getbasepoints(ta_gdf, ta_ids)
+    hata_basepoints = _getbasepoints(hata_gdf, hata_ids)
+    all_exfarmer_ids = list(dict.fromkeys(ta_ids + hata_ids))
+
+    jobs = []
+    for scenario in scenarios:
+        ta_newfarmer_N, hata_newfarmer_N, ta_arearates, hata_arearates = _farmer_arearates(scenario)
+        ta_ex_basepoint = {ID: ta_basepoints[ID] for ID in scenario.ta_exfarmer_ids_and_rates}
+        hata_ex_basepoint = {ID: hata_basepoints[ID] for ID in scenario.hata_exfarmer_ids_and_rates}
+        jobs.append((
+            (ta_gdf, ta_ex_basepoint, ta_arearates, ta_newfarmer_N, scenario.method, "田"),
+            (hata_gdf, hata_ex_basepoint, hata_arearates, hata_newfarmer_N, scenario.method, "畑")
+        ))
+
+    # 区画数の異なる区画化が必要な場合は、区画化の階層を先に作成して各シナリオ（各プロセス）で共有する
+    for side, parcels_side in enumerate((ta_gdf, hata_gdf)):
+        partition_counts = {_find_partition_count(job[side][2]) for job in jobs if job[side][4] == "clusters"}
+        if len(partition_counts) > 1:
+            _partition_hierarchy(parcels_side)
+
+    if parallel and len(gdf) * len(scenarios) >= PARALLEL_MIN_PARCELS:
+        # 再編成前のコスト分析とシナリオごとの割り当てを、別々のプロセスで同時に実行する
+        # （農地データは一度だけ書き出し、すべてのワーカーが同じファイルをメモリマップする）
+        executor = _get_executor()
+        ta_rows = gdf.index.get_indexer(ta_gdf.index)
+        hata_rows = gdf.index.get_indexer(hata_gdf.index)
+        with _shared_parcels(gdf) as dataset:
+            analysis_future = executor.submit(_analyze_shared, dataset, all_exfarmer_ids)
+            futures = [(executor.submit(_assign_shared, dataset, ta_rows, *ta_args[1:]),
+                        executor.submit(_assign_shared, dataset, hata_rows, *hata_args[1:]))
+                       for ta_args, hata_args in jobs]
+            baseline = analysis_future.result()
+            assigned = [(_with_assignment(ta_gdf, ta_future.result()), _with_assignment(hata_gdf, hata_future.result()))
+                        for ta_future, hata_future in futures]
+    else:
+        baseline = run_analysis(gdf, all_exfarmer_ids)
+        assigned = [(_assign_farmers(*ta_args)[0], _assign_farmers(*hata_args)[0]) for ta_args, hata_args in jobs]
+
+    plans = []
+    rows = []
+    for i, (scenario, (ta_gdf_poly, hata_gdf_poly)) in enumerate(zip(scenarios, assigned)):
+        exfarmer_ids = list(set(scenario.ta_exfarmer_ids_and_rates.keys()).union(set(scenario.hata_exfarmer_ids_and_rates.keys())))
+        result = _select_farmers(baseline, exfarmer_ids)
+        ta_gdf_poly = _apply_analysis(ta_gdf_poly, result, exfarmer_ids)
+        hata_gdf_poly = _apply_analysis(hata_gdf_poly, result, exfarmer_ids)
+        reorganized_gdf = gpd.GeoDataFrame(pd.concat([ta_gdf_poly, hata_gdf_poly]), crs="EPSG:4326")
+        if scenario.optimize_seconds > 0:
+            reorganized_gdf = optimize_plan(reorganized_gdf, scenario.optimize_seconds).plan
+        plans.append((reorganized_gdf, result))
+        rows.append({
+            "scenario": i,
+            "method": scenario.method,
+            "ta_farmer_N": scenario.ta_farmer_N,
+            "hata_farmer_N": scenario.hata_farmer_N,
+            "existing_farmers": len(exfarmer_ids),
+            "reorganized_parcels": int(reorganized_gdf["reorganized"].fillna(False).astype(bool).sum()),
+            "total_distance_reduced": result.total_distance_reduced,
+            "total_co2_reduced": result.total_co2_reduced,
+            "worktime_reduced": sum(result.farmers_worktime_reduced.values()),
+            "fuel_cost_reduced": sum(result.farmers_fuel_cost_reduced.values()),
+        })
+
+    return plans, pd.DataFrame(rows).set_index("scenario")
+
+def reorganize_incremental(
+    parcels: Union[gpd.GeoDataFrame, Dict[str, Any]],
+    scenario: Scenario,
+    previous_plan: gpd.GeoDataFrame,
+    previous_result: AnalysisResult,
+    previous_scenario: Scenario
+) -> Tuple[gpd.GeoDataFrame, AnalysisResult]:
+    """前回の再編成結果を使って、シナリオの変更に関係する部分だけ再編成し直す
+
+    田・畑のうち、シナリオ（現農家と面積割合、新規農家の数、割り当て方法）が変わっていない方は前回の割り当てをそのまま使い、
+    変わった方だけ割り当て直す。コスト分析は再編成前の農地について行うため、前回の結果に含まれる農家の値を使い、
+    新たに加わった現農家の経路だけを求める。
+    農地が前回の再編成の対象と異なる場合は、すべて再編成し直す。
+
+    Args:
+        parcels (Union[gpd.GeoDataFrame, Dict]): 再編成対象の農地データ（前回と同じもの）
+        scenario (Scenario): 変更後のシナリオ
+        previous_plan (gpd.GeoDataFrame): 前回の再編成後の農地データ
+        previous_result (AnalysisResult): 前回のコスト分析結果
+        previous_scenario (Scenario): 前回のシナリオ
+
+    Returns:
+        Tuple[gpd.GeoDataFrame, AnalysisResult]: 再編成後の農地データ、コスト分析結果
+    """
+    gdf, ta_gdf, hata_gdf = _prepare_parcels(parcels)
+    previous_ids = pd.Index(previous_plan[PARCEL_ID].to_numpy())
+    if len(previous_ids) != len(gdf) or not previous_ids.is_unique or not previous_ids.isin(gdf[PARCEL_ID]).all():
+        logger.info("農地が前回の再編成と異なるため、すべて再編成し直します")
+        return reorganize(gdf, scenario)
+
+    ta_newfarmer_N, hata_newfarmer_N, ta_arearates, hata_arearates = _farmer_arearates(scenario)
+    previous_sides = _farmer_arearates(previous_scenario)
+    sides = []
+    for side_gdf, exfarmers, previous_exfarmers, newfarmer_N, arearates, previous_newfarmer_N, previous_arearates, label in (
+        (ta_gdf, scenario.ta_exfarmer_ids_and_rates, previous_scenario.ta_exfarmer_ids_and_rates,
+         ta_newfarmer_N, ta_arearates, previous_sides[0], previous_sides[2], "田"),
+        (hata_gdf, scenario.hata_exfarmer_ids_and_rates, previous_scenario.hata_exfarmer_ids_and_rates,
+         hata_newfarmer_N, hata_arearates, previous_sides[1], previous_sides[3], "畑"),
+    ):
+        unchanged = (
+            list(exfarmers) == list(previous_exfarmers)
+            and newfarmer_N == previous_newfarmer_N
+            and arearates == previous_arearates
+            and scenario.method == previous_scenario.method
+        )
+        if unchanged:
+            # 前回の割り当てを、農地の並びを合わせてそのまま使う
+            logger.info("%sのシナリオは変わっていないため、前回の割り当てを使います", label)
+            rows = previous_ids.get_indexer(side_gdf[PARCEL_ID])
+            sides.append(previous_plan.iloc[rows])
+        else:
+            ex_basepoint = _getbasepoints(side_gdf, exfarmers.keys())
+            sides.append(_assign_farmers(side_gdf, ex_basepoint, arearates, newfarmer_N, scenario.method, label)[0])
+
+    all_exfarmer_ids = list(set(scenario.ta_exfarmer_ids_and_rates.keys()).union(set(scenario.hata_exfarmer_ids_and_rates.keys())))
+    result = extend_analysis(previous_result, gdf, all_exfarmer_ids)
+    ta_gdf_poly, hata_gdf_poly = (_apply_analysis(side.copy(), result, all_exfarmer_ids) for side in sides)
+
+    reorganized_gdf = gpd.GeoDataFrame(pd.concat([ta_gdf_poly, hata_gdf_poly]), crs="EPSG:4326")
+    if scenario.optimize_seconds > 0:
+        # 前回の割り当てを使った方は、前回の改善の続きから探索する
+        reorganized_gdf = optimize_plan(reorganized_gdf, scenario.optimize_seconds).plan
+    return reorganized_gdf, result
+
+def optimize_plan(
+    plan: gpd.GeoDataFrame,
+    time_budget: float,
+    stop_event: Optional[threading.Event] = None,
+    area_tolerance: float = 0.05,
+    fragmentation_weight: float = 1.0,
+    distance: float = 30,
+    k_neighbors: int = 6,
+    seed: int = 0
+) -> OptimizationResult:
+    """再編成結果を、隣接する農家の間で農地を移す・交換する局所探索で改善する
+
+    reorganize の結果や前回の再編成結果から始め、目的関数（農家ごとの農地の重心からの二乗距離の和と、
+    農家が異なる隣接する農地の組の数に重みを掛けたものの和）が小さくなる移動・交換だけを行う。
+    農家の面積は開始時の面積の ±area_tolerance の範囲に保ち、田・畑それぞれの中でだけ農地を移す。
+    割り当て対象外の農地（reorganized が False）は動かさない。
+    time_budget 秒を過ぎるか stop_event が設定されると、その時点の結果（それまでで最良の結果）を返す。
+
+    Args:
+        plan (gpd.GeoDataFrame): 再編成結果（EPSG:4326）
+        time_budget (float): 探索に使う時間（秒）
+        stop_event (threading.Event, optional): 探索を中断するイベント
+        area_tolerance (float, optional): 農家の面積の許容する変化の割合. Defaults to 0.05.
+        fragmentation_weight (float, optional): 分断の度合いの重み（隣接する農地の典型的な距離の二乗を 1 とする）. Defaults to 1.0.
+        distance (float, optional): 隣接とみなす距離（m）. Defaults to 30.
+        k_neighbors (int, optional): 隣接とみなす重心が近い農地の数. Defaults to 6.
+        seed (int, optional): 農地を調べる順序の乱数のシード. Defaults to 0.
+
+    Returns:
+        OptimizationResult: 改善の結果
+    """
+    started = time.monotonic()
+    deadline = started + time_budget
+    plan = plan.copy()
+    farmer_ids = plan["FarmerIndicationNumberHash"].to_numpy(dtype=object)
+    movable = plan["reorganized"].fillna(False).astype(bool).to_numpy() if "reorganized" in plan.columns else np.ones(len(plan), dtype=bool)
+    sides = plan["ClassificationOfLand"].to_numpy()
+    projected = plan.geometry.to_crs(epsg=32654).reset_index(drop=True)
+
+    changed = np.zeros(len(plan), dtype=bool)
+    initial_cost = cost = 0.0
+    moves = swaps = sweeps = 0
+    stopped = "converged"
+    side_values = [side for side in pd.unique(sides[movable])]
+    for number, side in enumerate(side_values):
+        rows = np.flatnonzero(movable & (sides == side))
+        if len(rows) < 2:
+            continue
+        # 残りの時間を、残りの田・畑の農地の数で分ける
+        remaining_rows = sum((movable & (sides == other)).sum() for other in side_values[number:])
+        side_deadline = time.monotonic() + max(deadline - time.monotonic(), 0) * len(rows) / remaining_rows
+
+        side_farmers, labels = np.unique(farmer_ids[rows].astype(str), return_inverse=True)
+        side_projected = projected.iloc[rows].reset_index(drop=True)
+        centroids = shapely.get_coordinates(side_projected.centroid.to_numpy())
+        adjacency = _parcel_adjacency(side_projected, centroids, distance, k_neighbors)
+        search = _LocalSearch(labels, side_projected.area.to_numpy(), centroids, adjacency,
+                              area_tolerance, fragmentation_weight, seed)
+        initial_cost += search.cost()
+        # 中断された後の田・畑は探索せず、目的関数の値だけ求める
+        reason = search.run(side_deadline, stop_event) if stopped != "interrupted" else stopped
+        cost += search.cost()
+        moves += search.moves
+        swaps += search.swaps
+        sweeps += search.sweeps
+
+        moved = search.labels != labels
+        farmer_ids[rows[moved]] = side_farmers[search.labels[moved]]
+        changed[rows[moved]] = True
+        if reason != "converged" and stopped != "interrupted":
+            stopped = reason
+
+    if changed.any():
+        plan["FarmerIndicationNumberHash"] = farmer_ids
+        plan = refresh_edited_parcels(plan, changed)
+    elapsed = time.monotonic() - started
+    logger.info("局所探索: 目的関数 %.0f → %.0f（移動%d回、交換%d回、%.1f秒、%s）", initial_cost, cost, moves, swaps, elapsed, stopped)
+    return OptimizationResult(plan, initial_cost, cost, moves, swaps, sweeps, elapsed, stopped)
+
+def refresh_edited_parcels(plan: gpd.GeoDataFrame, changed: np.ndarray) -> gpd.GeoDataFrame:
+    """修正で農家を変更した農地の区画とコスト分析結果の列を、変更後の農家に合わせる
+
+    修正していない農地から農家ごとの区画（最初のもの）とコスト分析結果を求め、修正した農地にだけ書き込む。
+    変更後の農家に修正していない農地が無い場合（新規農家など）、コスト分析結果は空にする。
+    コスト分析結果は再編成前の農地について求めたものなので、再計算は不要。
+
+    Args:
+        plan (gpd.GeoDataFrame): 修正を適用した再編成後の農地データ（変更される）
+        changed (np.ndarray): 修正した農地を表す真偽値配列
+
+    Returns:
+        gpd.GeoDataFrame: 区画とコスト分析結果を書き換えた農地データ
+    """
+    columns = [column for column in ("cluster", "worktime_reduced", "fuel_cost_reduced") if column in plan.columns]
+    if not changed.any() or not columns:
+        return plan
+    farmer_ids = plan["FarmerIndicationNumberHash"]
+    per_farmer = pd.DataFrame(plan.loc[~changed, columns]).groupby(farmer_ids[~changed].to_numpy()).first()
+    edited = farmer_ids[changed]
+    for column in columns:
+        values = edited.map(per_farmer[column]).to_numpy()
+        if column == "cluster":
+            # 区画が分からない農家の場合は元の区画のまま
+            values = np.where(pd.isna(values), plan.loc[changed, column].to_numpy(), values)
+        plan.loc[changed, column] = values
+    return plan
+
+def reorganize_split(
+    parcels: Union[gpd.GeoDataFrame, Dict[str, Any]],
+    scenario: Scenario,
+    by: str = "settlement",
+    tile_size: float = SPLIT_TILE_SIZE,
+    max_workers: int = MAX_WORKERS,
+    parallel: bool = True
+) -> Tuple[gpd.GeoDataFrame, AnalysisResult]:
+    """農地データを集落またはタイルごとに分けて、それぞれ独立に再編成し、結果をつなげる
+
+    市区町村全体などの大きな入力でも、一度にメモリに載るのは分けた一つ分の農地・距離行列・区画に限られる。
+    農地が PARALLEL_MIN_PARCELS 件以上の場合、分けた農地はプロセスプールで同時に再編成し、プロセスは一つ再編成するごとに起動し直すため、
+    各プロセスのメモリは一つ分の再編成の分しか増えない。ワーカーには共有用のファイルに書き出した農地データと範囲の行位置だけを渡す。
+
+    シナリオの農家は、範囲の田（畑）の面積の比で範囲に振り分ける（_piece_sides）。現農家はその範囲に農地を持つ場合だけ置き、
+    シナリオでの面積を置く範囲に分ける。新規農家は合計がシナリオの数になるように範囲に分ける（IDは「範囲の名前/newfarmer0」のようにする）。
+    コスト分析は範囲ごとに行い、地域全体の削減量と農家ごとの削減量を範囲について合計する（範囲をまたぐ移動は含まない）。
+
+    Args:
+        parcels (Union[gpd.GeoDataFrame, Dict]): 再編成対象の農地データ（GeoDataFrameまたはGeoJSONデータ）
+        scenario (Scenario): 再編成のシナリオ（農家を範囲に振り分けて適用する）
+        by (str, optional): 分け方（"settlement": 集落ごと、"tile": tile_size m 四方のタイルごと）. Defaults to "settlement".
+        tile_size (float, optional): タイルの一辺の長さ（m）. Defaults to SPLIT_TILE_SIZE.
+        max_workers (int, optional): 同時に再編成するプロセス数. Defaults to MAX_WORKERS.
+        parallel (bool, optional): 複数のプロセスで実行するか. Defaults to True.
+
+    Returns:
+        Tuple[gpd.GeoDataFrame, AnalysisResult]: 再編成後の農地データ、コスト分析結果
+    """
+    if isinstance(parcels, gpd.GeoDataFrame):
+        gdf = parcels.reset_index(drop=True)
+    else:
+        gdf = gpd.GeoDataFrame.from_features(parcels)
+    gdf = gdf.set_crs(epsg=4326, allow_override=True)
+
+    pieces = _classified_pieces(gdf, by, tile_size)
+    logger.info("%d個の範囲に分けて再編成します", len(pieces))
+    piece_sides = _piece_sides(scenario, pieces)
+
+    if parallel and len(pieces) > 1 and len(gdf) >= PARALLEL_MIN_PARCELS:
+        # プロセスは一つ再編成するごとに起動し直し（maxtasksperchild=1）、実行待ちの範囲も同時に実行する数の2倍までにする
+        # （ワーカーには共有の農地データと行位置だけを渡し、書き換わる列だけを受け取る）
+        done: "queue.Queue[Any]" = queue.Queue()
+        results: Dict[str, Tuple[np.ndarray, Dict[str, np.ndarray], AnalysisResult]] = {}
+        context = multiprocessing.get_context("spawn")
+        with _shared_parcels(gdf, _SHARED_COLUMNS + ["ClassificationOfLand"]) as dataset, \
+                context.Pool(processes=max_workers, maxtasksperchild=1) as pool:
+            pending = 0
+            for (name, piece, ta_gdf, hata_gdf), sides in zip(pieces, piece_sides):
+                if pending >= max_workers * 2:
+                    _collect_piece(done, results)
+                    pending -= 1
+                args = (name, dataset, piece.index.to_numpy(), ta_gdf.index.to_numpy(), hata_gdf.index.to_numpy(), scenario, sides)
+                pool.apply_async(_reorganize_shared_piece, args, callback=done.put, error_callback=done.put)
+                pending += 1
+            for _ in range(pending):
+                _collect_piece(done, results)
+        plans = [(_with_piece_result(piece, *results[name][:2]), results[name][2], name) for name, piece, _, _ in pieces]
+    else:
+        plans = [_reorganize_piece(name, piece, ta_gdf, hata_gdf, scenario, sides)
+                 for (name, piece, ta_gdf, hata_gdf), sides in zip(pieces, piece_sides)]
+
+    return _stitch_pieces(plans)
+
+def _split_parcels(gdf: gpd.GeoDataFrame, by: str, tile_size: float) -> Iterator[Tuple[str, gpd.GeoDataFrame]]:
+    """農地を集落またはタイルごとに分ける（名前、農地）"""
+    if by == "settlement":
+        if SETTLEMENT_COLUMN not in gdf.columns:
+            raise ValueError(f"集落の列（{SETTLEMENT_COLUMN}）がありません")
+        keys = gdf[SETTLEMENT_COLUMN].fillna("_").astype(str).to_numpy()
+    elif by == "tile":
+        centroids = shapely.get_coordinates(gdf.geometry.to_crs(epsg=32654).centroid.to_numpy())
+        cells = np.floor(centroids / tile_size).astype(np.int64)
+        keys = np.array([f"{x}_{y}" for x, y in cells], dtype=object)
+    else:
+        raise ValueError(f"分け方が不正です（'settlement' または 'tile'）: {by}")
+    for name, rows in pd.Series(np.arange(len(gdf))).groupby(keys, sort=True).indices.items():
+        yield name, gdf.iloc[rows]
+
+def _classified_pieces(
+    gdf: gpd.GeoDataFrame,
+    by: str,
+    tile_size: float
+) -> List[Tuple[str, gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame]]:
+    """農地を範囲に分け、範囲ごとに田畑を一度だけ分類する（名前、農地、田、畑）
+
+    分類した結果は gdf（ワーカーに渡す農地データ）にも書き込む。
+    """
+    pieces = []
+    for name, piece in _split_parcels(gdf, by, tile_size):
+        piece = piece.copy()
+        ta_gdf, hata_gdf = _create_tahata_gdf(piece, distance=30)
+        gdf.loc[piece.index, "ClassificationOfLand"] = piece["ClassificationOfLand"]
+        pieces.append((name, piece, ta_gdf, hata_gdf))
+    return pieces
+
+def _piece_sides(
+    scenario: Scenario,
+    pieces: List[Tuple[str, gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame]]
+) -> List[Tuple["_SideFarmers", "_SideFarmers"]]:
+    """シナリオの農家を、分けた範囲（名前、農地、田、畑）に田畑ごとの面積の比で振り分ける
+
+    現農家は範囲に農地を持つ場合だけ置き、シナリオでの面積（面積割合 × 田または畑の全体の面積）を、
+    その農家を置く範囲の田（畑）の面積の比で分ける。
+    新規農家の数は範囲の田（畑）の面積の比で分け（最大剰余法、合計はシナリオの数）、
+    新規農家全体の面積割合は各範囲で保つ。ただし現農家がいない範囲には、新規農家を少なくとも一人置く。
+    範囲の中の面積割合は、合計が 1 になるように正規化する。
+    """
+    farmers = [set(piece["FarmerIndicationNumberHash"].dropna()) for _, piece, _, _ in pieces]
+    ta_areas = [ta_gdf.geometry.to_crs(epsg=32654).area.sum() for _, _, ta_gdf, _ in pieces]
+    hata_areas = [hata_gdf.geometry.to_crs(epsg=32654).area.sum() for _, _, _, hata_gdf in pieces]
+    ta_side, hata_side = _scenario_sides(scenario)
+    return list(zip(
+        _split_side(ta_side, farmers, ta_areas, scenario.method),
+        _split_side(hata_side, farmers, hata_areas, scenario.method)
+    ))
+
+def _split_side(
+    side: "_SideFarmers",
+    farmers: List[set],
+    areas: List[float],
+    method: str
+) -> List["_SideFarmers"]:
+    """田または畑の農家を、範囲ごとの農家（範囲の農地の農家、範囲の田または畑の面積）に振り分ける（_piece_sides を参照）"""
+    areas = np.asarray(areas, dtype=float)
+    ex_N = len(side.exfarmer_ids)
+
+    # 現農家の面積を、農地を持つ範囲に面積の比で分ける
+    present = np.array([[ID in piece_farmers for ID in side.exfarmer_ids] for piece_farmers in farmers], dtype=bool)
+    present = present.reshape(len(areas), ex_N) & (areas > 0)[:, None]
+    weights = present * areas[:, None]
+    totals = weights.sum(axis=0)
+    ex_areas = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+    ex_areas *= np.asarray(side.arearates[:ex_N], dtype=float) * areas.sum()
+
+    # 新規農家の数を範囲の面積の比で分ける
+    new_rate = sum(side.arearates[ex_N:])
+    new_counts = _apportion(side.newfarmer_N, areas / areas.sum()) if areas.sum() > 0 else np.zeros(len(areas), dtype=int)
+    if side.newfarmer_N > 0:
+        new_counts[(areas > 0) & ~present.any(axis=1) & (new_counts == 0)] = 1
+
+    piece_sides = []
+    for number, area in enumerate(areas):
+        ids = [ID for ID, keep in zip(side.exfarmer_ids, present[number]) if keep]
+        new_N = int(new_counts[number])
+        rates = list(ex_areas[number][present[number]]) + ([new_rate * area / new_N] * new_N if new_N else [])
+        piece_sides.append(_normalize_side(ids, new_N, rates, method))
+    return piece_sides
+
+def _normalize_side(exfarmer_ids: List[str], newfarmer_N: int, rates: List[float], method: str) -> "_SideFarmers":
+    """範囲の農家の面積を、合計が 1 の面積割合にする
+
+    "clusters" の場合は区画数が大きくならないよう 0.1 刻みに丸め、0 になった農家は置かない。
+    """
+    total = sum(rates)
+    if total <= 0:
+        return _SideFarmers([], 0, [])
+    rates = [r / total for r in rates]
+    if method != "clusters":
+        return _SideFarmers(exfarmer_ids, newfarmer_N, rates)
+    tenths = _apportion(10, np.asarray(rates))
+    ex_N = len(exfarmer_ids)
+    return _SideFarmers(
+        exfarmer_ids=[ID for ID, tenth in zip(exfarmer_ids, tenths[:ex_N]) if tenth > 0],
+        newfarmer_N=int((tenths[ex_N:] > 0).sum()),
+        arearates=[tenth / 10 for tenth in tenths if tenth > 0]
+    )
+
+def _apportion(total: int, shares: np.ndarray) -> np.ndarray:
+    """total を shares の比で整数に分ける（最大剰余法。合計は total になる）"""
+    quotas = shares * total
+    counts = np.floor(quotas).astype(int)
+    order = np.argsort(-(quotas - counts), kind="stable")
+    counts[order[:total - counts.sum()]] += 1
+    return counts
+
+def _reorganize_piece(
+    name: str,
+    piece: gpd.GeoDataFrame,
+    ta_gdf: gpd.GeoDataFrame,
+    hata_gdf: gpd.GeoDataFrame,
+    scenario: Scenario,
+    sides: Tuple["_SideFarmers", "_SideFarmers"]
+) -> Tuple[gpd.GeoDataFrame, AnalysisResult, str]:
+    """分けた範囲を、範囲に振り分けた農家で再編成する（田畑は分類済み）"""
+    logger.info("%sを再編成します（%d件）", name, len(piece))
+    plan, result = _reorganize_sides(piece, ta_gdf, hata_gdf, scenario, parallel=False, sides=sides)
+    # 新規農家のIDは範囲ごとに区別する
+    farmer_ids = plan["FarmerIndicationNumberHash"]
+    new_farmers = farmer_ids.astype(str).str.startswith("newfarmer") & plan["reorganized"].fillna(False).astype(bool)
+    plan["FarmerIndicationNumberHash"] = farmer_ids.where(~new_farmers, name + "/" + farmer_ids.astype(str))
+    return plan, result, name
+
+def _reorganize_shared_piece(
+    name: str,
+    dataset: SharedDataset,
+    rows: np.ndarray,
+    ta_rows: np.ndarray,
+    hata_rows: np.ndarray,
+    scenario: Scenario,
+    sides: Tuple["_SideFarmers", "_SideFarmers"]
+) -> Tuple[np.ndarray, Dict[str, np.ndarray], AnalysisResult, str]:
+    """共有の農地データのうち rows の範囲を再編成し、農地の行位置と書き換わる列だけを返す（ワーカープロセスで実行する）"""
+    piece = _read_shared(dataset, rows)
+    piece.index = rows
+    plan, result, _ = _reorganize_piece(name, piece, piece.loc[ta_rows], piece.loc[hata_rows], scenario, sides)
+    return plan.index.to_numpy(), {col: plan[col].to_numpy() for col in _PIECE_COLUMNS}, result, name
+
+def _collect_piece(
+    done: "queue.Queue[Any]",
+    results: Dict[str, Tuple[np.ndarray, Dict[str, np.ndarray], AnalysisResult]]
+) -> None:
+    """終わった範囲の再編成結果を一つ受け取る（ワーカーで発生した例外はそのまま送出する）"""
+    item = done.get()
+    if isinstance(item, BaseException):
+        raise item
+    rows, columns, result, name = item
+    results[name] = (rows, columns, result)
+
+def _with_piece_result(piece: gpd.GeoDataFrame, rows: np.ndarray, columns: Dict[str, np.ndarray]) -> gpd.GeoDataFrame:
+    """ワーカープロセスで再編成した列を、範囲の農地データ（行位置 rows の順）に書き込む"""
+    plan = piece.loc[rows].copy()
+    for col, values in columns.items():
+        plan[col] = values
+    return plan
+
+def _stitch_pieces(plans: List[Tuple[gpd.GeoDataFrame, AnalysisResult, str]]) -> Tuple[gpd.GeoDataFrame, AnalysisResult]:
+    """範囲ごとの再編成結果とコスト分析結果をつなげる
+
+    区画の番号は範囲ごとにずらして重ならないようにし、削減量は範囲について合計する。
+    """
+    frames = []
+    offset = 0
+    total_distance = total_co2 = 0.0
+    worktime: Dict[str, float] = {}
+    fuel_cost: Dict[str, float] = {}
+    for plan, result, _ in plans:
+        if "cluster" in plan.columns and plan["cluster"].notna().any():
+            plan["cluster"] = plan["cluster"] + offset
+            offset = int(plan["cluster"].max()) + 1
+        frames.append(plan)
+        total_distance += result.total_distance_reduced
+        total_co2 += result.total_co2_reduced
+        for ID, value in result.farmers_worktime_reduced.items():
+            worktime[ID] = worktime.get(ID, 0.0) + value
+        for ID, value in result.farmers_fuel_cost_reduced.items():
+            fuel_cost[ID] = fuel_cost.get(ID, 0.0) + value
+
+    reorganized_gdf = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs="EPSG:4326")
+    result = AnalysisResult(
+        total_distance_reduced=total_distance,
+        total_co2_reduced=total_co2,
+        farmers_worktime_reduced=worktime,
+        farmers_fuel_cost_reduced=fuel_cost
+    )
+    # 農地ごとのコスト分析結果も、農家の合計に書き換える
+    reorganized_gdf = _apply_analysis(reorganized_gdf, result, list(worktime))
+    return reorganized_gdf, result
+
+def _farmer_arearates(scenario: Scenario) -> Tuple[int, int, list[float], list[float]]:
+    """田畑ごとの新規農家の数と、農家ごとの面積割合（現農家の順、続けて新規農家）を求める"""
     # 新規農家の数
     print(scenario.ta_farmer_N)
     print(scenario.hata_farmer_N)
@@ -44,19 +732,45 @@ def reorganize(
     hata_newfarmer_N = scenario.hata_farmer_N - len(scenario.hata_exfarmer_ids_and_rates.keys())
     print("田の新規農家数："+str(ta_newfarmer_N)+"畑の新規農家数："+str(hata_newfarmer_N))
 
-    # 新規農家は固定で0.1
-    ta_arearates = _scale_ratios([r for r in scenario.ta_exfarmer_ids_and_rates.values()], 1-ta_newfarmer_N*0.1)
-    ta_arearates.extend([0.1]*ta_newfarmer_N)
-    hata_arearates = _scale_ratios([r for r in scenario.hata_exfarmer_ids_and_rates.values()], 1-hata_newfarmer_N*0.1)
-    hata_arearates.extend([0.1]*hata_newfarmer_N)
+    # 新規農家は固定で0.1（現農家がいない場合は新規農家で等分する）
+    ta_arearates = _newfarmer_arearates(scenario.ta_exfarmer_ids_and_rates, ta_newfarmer_N)
+    hata_arearates = _newfarmer_arearates(scenario.hata_exfarmer_ids_and_rates, hata_newfarmer_N)
     print("田：",ta_arearates)
     print("畑：",hata_arearates)
+    return ta_newfarmer_N, hata_newfarmer_N, ta_arearates, hata_arearates
+
+def _scenario_sides(scenario: Scenario) -> Tuple["_SideFarmers", "_SideFarmers"]:
+    """シナリオの田畑ごとの農家（現農家のID、新規農家の数、面積割合）を求める"""
+    ta_newfarmer_N, hata_newfarmer_N, ta_arearates, hata_arearates = _farmer_arearates(scenario)
+    return (
+        _SideFarmers(list(scenario.ta_exfarmer_ids_and_rates), ta_newfarmer_N, ta_arearates),
+        _SideFarmers(list(scenario.hata_exfarmer_ids_and_rates), hata_newfarmer_N, hata_arearates)
+    )
+
+def _newfarmer_arearates(exfarmer_ids_and_rates: Dict[str, float], newfarmer_N: int) -> list[float]:
+    """現農家の面積割合（整数比を0.1刻みに丸めたもの）に続けて、新規農家の面積割合を並べる"""
+    if not exfarmer_ids_and_rates:
+        return [1 / newfarmer_N] * newfarmer_N if newfarmer_N > 0 else []
+    arearates = _scale_ratios([r for r in exfarmer_ids_and_rates.values()], 1-newfarmer_N*0.1)
+    arearates.extend([0.1]*newfarmer_N)
+    return arearates
+
+def _prepare_parcels(
+    parcels: Union[gpd.GeoDataFrame, Dict[str, Any]]
+) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """農地データを GeoDataFrame（EPSG:4326）にして、田畑ごとに分ける
 
-    # GeoDataFrameを作成
-    gdf = gpd.GeoDataFrame.from_features(geojson_data)
+    Returns:
+        Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame]: 農地全体、田、畑のGeoDataFrame
+    """
+    # GeoDataFrameを作成（GeoJSONが渡された場合のみ変換する）
+    if isinstance(parcels, gpd.GeoDataFrame):
+        gdf = parcels.reset_index(drop=True)
+    else:
+        gdf = gpd.GeoDataFrame.from_features(parcels)
 
     # projectionを設定
-    gdf = gdf.set_crs(epsg=4326)
+    gdf = gdf.set_crs(epsg=4326, allow_override=True)
 
     # 田畑ごとのGeoJSONデータを作成
     ta_gdf, hata_gdf = _create_tahata_gdf(gdf, distance=30)
@@ -64,52 +778,128 @@ def reorganize(
     # CRSを設定
     ta_gdf.set_crs(epsg=4326, inplace=True)  # WGS84座標系を設定
     hata_gdf.set_crs(epsg=4326, inplace=True)  # WGS84座標系を設定
+    return gdf, ta_gdf, hata_gdf
+
+def _select_farmers(result: AnalysisResult, existing_farmer_ids: list[str]) -> AnalysisResult:
+    """コスト分析結果のうち、指定した農家の結果だけを残す"""
+    return AnalysisResult(
+        total_distance_reduced=result.total_distance_reduced,
+        total_co2_reduced=result.total_co2_reduced,
+        farmers_worktime_reduced={ID: result.farmers_worktime_reduced[ID] for ID in existing_farmer_ids},
+        farmers_fuel_cost_reduced={ID: result.farmers_fuel_cost_reduced[ID] for ID in existing_farmer_ids}
+    )
 
-    # 田畑ごとに農家のbasepointをexfarmer_ids_and_ratesから取得
-    ta_ex_basepoint = {ID: _getbasepoint(ta_gdf, ID) for ID in scenario.ta_exfarmer_ids_and_rates.keys()}
-    hata_ex_basepoint = {ID: _getbasepoint(hata_gdf, ID) for ID in scenario.hata_exfarmer_ids_and_rates.keys()}
-
-    # 区画数を取得
-    ta_area_n = _find_partition_count(ta_arearates)
-    hata_area_n = _find_partition_count(hata_arearates)
-    print("田の区画数："+str(ta_area_n)+"畑の区画数："+str(hata_area_n))
-
-    # 田畑ごとに区画化
-    ta_gdf_poly, ta_gdf_multipoly = _partition(ta_gdf, ta_area_n)
-    hata_gdf_poly, hata_gdf_multipoly = _partition(hata_gdf, hata_area_n)
+def _get_executor() -> ProcessPoolExecutor:
+    """再編成に使うプロセスプールを取得する（プロセスの起動は初回のみ）
 
-    ta_area_nums = {ID: math.ceil(r * ta_area_n) for ID, r in zip(scenario.ta_exfarmer_ids_and_rates.keys(), ta_arearates)}
-    hata_area_nums = {ID: math.ceil(r * hata_area_n) for ID, r in zip(scenario.hata_exfarmer_ids_and_rates.keys(), hata_arearates)}
+    Streamlitなどスレッドを使うプロセスからも安全に使えるように、プロセスは spawn で起動する。
+    プロセスはインタプリタの終了時に終了させる。
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_shutdown_executor)
+    return _executor
+
+def _shutdown_executor() -> None:
+    """再編成に使うプロセスプールを終了する（実行待ちの処理は取り消す）"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+@contextmanager
+def _shared_parcels(gdf: gpd.GeoDataFrame, columns: List[str] = _SHARED_COLUMNS) -> Iterator[SharedDataset]:
+    """ワーカープロセスに渡す農地データ（columns の列と形状のみ）を共有用のファイルに書き出す
+
+    ワーカーには返り値（pickle ではパスだけが送られる）と行位置を渡し、
+    各プロセスは同じファイルをメモリマップして必要な行だけを取り出す。ファイルは with を抜けると削除する。
+    """
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".arrow", dir=SHARED_DIR)
+    os.close(fd)
+    try:
+        write_shared(gdf[columns + [gdf.geometry.name]], path)
+        yield open_shared(path)
+    finally:
+        close_shared(path)
+        os.remove(path)
+
+def _read_shared(dataset: SharedDataset, rows: Optional[np.ndarray] = None) -> gpd.GeoDataFrame:
+    """共有の農地データから行を取り出す（ワーカープロセスでは取り出した後にマップを保持しない）"""
+    gdf = dataset.to_geodataframe(rows)
+    close_shared(dataset.path)
+    return gdf
+
+def _assign_shared(
+    dataset: SharedDataset,
+    rows: np.ndarray,
+    ex_basepoint: Dict[str, Tuple[float, float]],
+    arearates: list[float],
+    newfarmer_N: int,
+    method: str,
+    label: str
+) -> Dict[str, np.ndarray]:
+    """共有の農地データのうち rows の農地を割り当て、割り当てで書き換わる列だけを返す（ワーカープロセスで実行する）"""
+    gdf_poly, _ = _assign_farmers(_read_shared(dataset, rows), ex_basepoint, arearates, newfarmer_N, method, label)
+    return {col: gdf_poly[col].to_numpy() for col in _ASSIGNED_COLUMNS}
+
+def _analyze_shared(dataset: SharedDataset, existing_farmer_ids: list[str]) -> AnalysisResult:
+    """共有の農地データの再編成前のコスト分析を行う（ワーカープロセスで実行する）"""
+    return run_analysis(_read_shared(dataset), existing_farmer_ids)
+
+def _with_assignment(gdf: gpd.GeoDataFrame, assigned: Dict[str, np.ndarray]) -> gpd.GeoDataFrame:
+    """ワーカープロセスで割り当てた列を、田または畑の農地データに書き込む（行の順序は同じ）"""
+    gdf_poly = gdf.copy()
+    for col, values in assigned.items():
+        gdf_poly[col] = values
+    return gdf_poly
+
+def _assign_farmers(
+    gdf: gpd.GeoDataFrame,
+    ex_basepoint: Dict[str, Tuple[float, float]],
+    arearates: list[float],
+    newfarmer_N: int,
+    method: str,
+    label: str
+) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """田または畑の農地を、現農家と新規農家に割り当てる
 
-    # 現農家の配置
-    ta_gdf_poly, ta_gdf_multipoly = _put_existing_farmers(ta_gdf_poly, ta_gdf_multipoly, ta_ex_basepoint, ta_area_nums)
-    hata_gdf_poly, hata_gdf_multipoly = _put_existing_farmers(hata_gdf_poly, hata_gdf_multipoly, hata_ex_basepoint, hata_area_nums)
+    Args:
+        gdf (gpd.GeoDataFrame): 田または畑の農地データ
+        ex_basepoint (Dict[str, Tuple[float, float]]): 現農家のID → 中心農地の座標
+        arearates (list[float]): 面積割合のリスト（現農家の順、続けて新規農家）
+        newfarmer_N (int): 新規農家の数
+        method (str): 割り当て方法（"capacity" または "clusters"）
+        label (str): 表示用の名称（田・畑）
 
-    # 新規農家の配置
-    ta_gdf_poly, ta_gdf_multipoly = _put_new_farmers(ta_gdf_poly, ta_gdf_multipoly, scenario.ta_farmer_N - len(scenario.ta_exfarmer_ids_and_rates))
-    hata_gdf_poly, hata_gdf_multipoly = _put_new_farmers(hata_gdf_poly, hata_gdf_multipoly, scenario.hata_farmer_N - len(scenario.hata_exfarmer_ids_and_rates))
+    Returns:
+        Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]: 農地ごと、農家の区画ごとのGeoDataFrame（EPSG:4326）
+    """
+    if method == "capacity" or len(gdf) == 0 or not arearates:
+        # 農地または農家が無い場合は、区画化せずにそのまま返す
+        gdf_poly, gdf_multipoly = _assign_by_capacity(gdf, ex_basepoint, arearates, newfarmer_N)
+    elif method == "clusters":
+        # 区画数を取得
+        area_n = _find_partition_count(arearates)
+        print(label+"の区画数："+str(area_n))
+
+        # 区画化
+        gdf_poly, gdf_multipoly = _partition(gdf, area_n)
+        area_nums = {ID: math.ceil(r * area_n) for ID, r in zip(ex_basepoint.keys(), arearates)}
+
+        # 現農家の配置
+        gdf_poly, gdf_multipoly = _put_existing_farmers(gdf_poly, gdf_multipoly, ex_basepoint, area_nums)
+
+        # 新規農家の配置
+        gdf_poly, gdf_multipoly = _put_new_farmers(gdf_poly, gdf_multipoly, newfarmer_N)
+    else:
+        raise ValueError(f"割り当て方法が不正です（'capacity' または 'clusters'）: {method}")
 
     # CRS84に変換
-    ta_gdf_poly = ta_gdf_poly.to_crs(epsg=4326)
-    ta_gdf_multipoly = ta_gdf_multipoly.to_crs(epsg=4326)
-    hata_gdf_poly = hata_gdf_poly.to_crs(epsg=4326)
-    hata_gdf_multipoly = hata_gdf_multipoly.to_crs(epsg=4326)
-
-    # コスト分析結果をgdfに格納(現在はpolyのみ)
-    all_exfarmer_ids = list(set(scenario.ta_exfarmer_ids_and_rates.keys()).union(set(scenario.hata_exfarmer_ids_and_rates.keys())))
-    result, ta_gdf_poly, hata_gdf_poly = _excute_analysis(gdf, ta_gdf_poly, hata_gdf_poly, all_exfarmer_ids)
-
-    # GeoJSONデータに変換
-    # geojson_data = {
-    #     "type": "FeatureCollection",
-    #     "features": list(ta_gdf_poly.__geo_interface__["features"]) + list(ta_gdf_multipoly.__geo_interface__["features"]) + list(hata_gdf_poly.__geo_interface__["features"]) + list(hata_gdf_multipoly.__geo_interface__["features"])
-    # }
-    # polyのみのGeoJSONデータ
-    poly_geojson_data = {
-        "type": "FeatureCollection",
-        "features": list(ta_gdf_poly.__geo_interface__["features"]) + list(hata_gdf_poly.__geo_interface__["features"])
-    }
-    return poly_geojson_data, result
+    return gdf_poly.to_crs(epsg=4326), gdf_multipoly.to_crs(epsg=4326)
 
 def _scale_ratios(ratios: Tuple[int], total: float) -> list[float]:
     """
@@ -138,67 +928,40 @@ def _create_tahata_gdf(
     ) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
     """田畑ごとのGeoJSONデータを作成する。孤立している田畑を周りの田畑の分類に基づいて再分類する。
 
+    一定の距離内の農地（自分自身を含む）の組を空間インデックスで一度に求め、
+    農地ごとの田・畑の数をまとめて数える。距離は投影座標系（EPSG:32654）のメートルで判定する。
+
     Args:
         gdf (gpd.GeoDataFrame): GeoDataFrame
-        distance (float, optional): 一定の距離. Defaults to 30.
+        distance (float, optional): 一定の距離（m）. Defaults to 30.
 
     Returns:
         Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]: 田畑ごとのGeoDataFrame
     """
+    classifications = gdf["ClassificationOfLand"].to_numpy()
+
+    # 一定の距離内の農地の組（農地の位置, 近傍の農地の位置）を求める
+    geometry = gdf.geometry.to_crs(epsg=32654) if gdf.crs is not None else gdf.geometry
+    source, neighbor = geometry.sindex.query(geometry, predicate="dwithin", distance=distance)
+
+    # 近傍の農地の分類を農地ごとに数える
+    ta_counts = np.bincount(source, weights=classifications[neighbor] == "1", minlength=len(gdf))
+    hata_counts = np.bincount(source, weights=classifications[neighbor] == "2", minlength=len(gdf))
+
+    # 隣接するポリゴンの分類に基づいて変更
+    # 畑 → 田、田 → 畑 は多い方に変更し、田畑（"1, 2", "2, 1"）は同数の場合は畑にする
+    new_classifications = classifications.copy()
+    mixed = np.isin(classifications, ["1, 2", "2, 1"])
+    new_classifications[((classifications == "2") | mixed) & (ta_counts > hata_counts)] = "1"
+    new_classifications[(classifications == "1") & (hata_counts > ta_counts)] = "2"
+    new_classifications[mixed & (hata_counts >= ta_counts)] = "2"
 
-    # 空間インデックスを作成
-    sindex = gdf.sindex
-
-    # 各ポリゴンの新しい分類を格納するリスト
-    new_classifications = gdf["ClassificationOfLand"].copy()
-
-    for i, geom in enumerate(gdf.geometry):
-        # print(str(i) + "番目のポリゴン")
-        # 一定の距離内のポリゴンを検索
-        buffer = geom.buffer(distance/1000/100)
-        nearby = gdf[gdf.geometry.intersects(buffer)]
-
-        # 一定の距離内のポリゴンの分類を取得
-        neighbor_classifications = nearby["ClassificationOfLand"]
-
-        # 一定の距離内のポリゴンの分類のカウント
-        counts = neighbor_classifications.value_counts()
-
-        # 現在の分類
-        current_classification = gdf.loc[i, "ClassificationOfLand"]
-        # print("現在："+current_classification)
-        # print("隣接するポリゴンの分類："+str(counts))
-
-        # 隣接するポリゴンの分類に基づいて変更
-        if current_classification == "2" and counts.get("1", 0) > counts.get("2", 0):
-            # print("畑を田に変更")
-            new_classifications[i] = "1"
-        elif current_classification == "1" and counts.get("2", 0) > counts.get("1", 0):
-            new_classifications[i] = "2"
-            # print("田を畑に変更")
-        elif current_classification == "1, 2" and counts.get("1", 0) > counts.get("2", 0):
-            new_classifications[i] = "1"
-            # print("田畑を田に変更")
-        elif current_classification == "1, 2" and counts.get("2", 0) >= counts.get("1", 0):
-            new_classifications[i] = "2"
-            # print("田畑を畑に変更")
-        elif current_classification == "2, 1" and counts.get("1", 0) > counts.get("2", 0):
-            new_classifications[i] = "1"
-            # print("畑田を田に変更")
-        elif current_classification == "2, 1" and counts.get("2", 0) >= counts.get("1", 0):
-            new_classifications[i] = "2"
-            # print("畑田を畑に変更")
-
-    # print(new_classifications.unique())
     # 新しい分類を適用
     gdf["ClassificationOfLand"] = new_classifications
 
     ta_gdf = gdf[gdf["ClassificationOfLand"] == "1"]
     hata_gdf = gdf[gdf["ClassificationOfLand"] == "2"]
 
-    # print(ta_gdf['ClassificationOfLand'].value_counts())
-    # print(hata_gdf)
-
     return ta_gdf, hata_gdf
 
 def _find_partition_count(arearates: list[float]) -> int:
@@ -225,154 +988,451 @@ def _partition(
         gdf (gpd.GeoDataFrame): GeoDataFrame
         partition_count (int): 区画数
 
+    区画化の結果は田・畑の農地の形状と区画数だけで決まるため、形状のハッシュと区画数をキーとして
+    メモリとディスク（PARTITION_CACHE_DIR）に保存し、シナリオやプロセスをまたいで再利用する。
+    農地の形状に対する階層（_PartitionHierarchy）が作成済みの場合は、クラスタリングをやり直さずに階層から求める。
+
     Returns:
         Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]: 区画化後のGeoDataFrame"""
-    Model = _PartitionModel(gdf, partition_count)
-    result_poly, result_multipoly = Model.run()
+    key = _partition_key(gdf)
+    cached = _load_partition(key, partition_count)
+    if cached is not None:
+        labels, geometry = cached
+        return _partition_frames(gdf, labels, geometry)
+
+    hierarchy = _load_hierarchy(key)
+    if hierarchy is not None:
+        labels = hierarchy.labels(partition_count, gdf)
+    else:
+        labels = _PartitionModel(gdf, partition_count).cluster_labels()
+    result_poly, result_multipoly = _partition_frames(gdf, labels)
+    _store_partition(key, partition_count, labels, result_multipoly.geometry.to_numpy())
     return result_poly, result_multipoly
 
-def _getbasepoint(
+def _partition_frames(
+    gdf: gpd.GeoDataFrame,
+    labels: np.ndarray,
+    geometry: Optional[np.ndarray] = None
+) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """農地ごとのクラスタidから、農地ごと・区画ごとのGeoDataFrame（EPSG:6674）を作成する
+
+    Args:
+        gdf (gpd.GeoDataFrame): 農地データ
+        labels (np.ndarray): 農地ごとのクラスタid（0, 1, ...）
+        geometry (np.ndarray, optional): 区画ごとの形状（保存した結果を使う場合。省略時は dissolve で求める）
+    """
+    farmland = gdf.to_crs(epsg=6674)
+    farmland["cluster"] = labels
+    if geometry is None:
+        grouped = farmland.dissolve(by="cluster") # dissolve: クラスタごとにまとめる
+        return farmland, grouped.reset_index(drop=True)
+
+    # 属性は dissolve と同じく区画ごとの最初の値とし、形状は保存したものを使う
+    attributes = pd.DataFrame(farmland.drop(columns=farmland.geometry.name)).groupby("cluster").first()
+    grouped = gpd.GeoDataFrame(attributes, geometry=geometry, crs=farmland.crs)
+    grouped = grouped[[grouped.geometry.name] + list(attributes.columns)]
+    return farmland, grouped.reset_index(drop=True)
+
+def _partition_key(gdf: gpd.GeoDataFrame) -> str:
+    """区画化の結果のキー（農地の形状の並びのハッシュ）"""
+    geometry = gdf.geometry.to_crs(epsg=6674) if gdf.crs is not None else gdf.geometry
+    digest = hashlib.blake2b(f"v{PARTITION_CACHE_VERSION}".encode("utf-8"), digest_size=16)
+    for wkb in shapely.to_wkb(geometry.to_numpy()):
+        # WKBの長さを先に入れて、農地の境目を一意にする
+        digest.update(len(wkb or b"").to_bytes(8, "little"))
+        digest.update(wkb or b"")
+    return digest.hexdigest()
+
+def _partition_path(key: str, partition_count: Optional[int] = None) -> str:
+    name = key if partition_count is None else f"{key}-{partition_count}"
+    return os.path.join(PARTITION_CACHE_DIR, name)
+
+def _load_partition(key: str, partition_count: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """保存した区画化の結果（農地ごとのクラスタid、区画ごとの形状）を返す（無い場合はNone）"""
+    with _partition_lock:
+        cached = _partitions.get((key, partition_count))
+        if cached is not None:
+            _partitions.move_to_end((key, partition_count))
+            return cached
+
+    path = _partition_path(key, partition_count)
+    try:
+        labels = np.load(path + ".npy")
+        geometry = gpd.read_parquet(path + ".parquet").geometry.to_numpy()
+    except FileNotFoundError:
+        return None
+    touch((path + ".npy", path + ".parquet"))
+    _remember(_partitions, (key, partition_count), (labels, geometry), MAX_CACHED_PARTITIONS)
+    return labels, geometry
+
+def _store_partition(key: str, partition_count: int, labels: np.ndarray, geometry: np.ndarray) -> None:
+    """区画化の結果をメモリとディスクに保存する"""
+    _remember(_partitions, (key, partition_count), (labels, geometry), MAX_CACHED_PARTITIONS)
+
+    # 区画ごとの形状を先に書き、クラスタidのファイルを最後に置き換える（読み込む側はクラスタidから読む）
+    path = _partition_path(key, partition_count)
+    tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(PARTITION_CACHE_DIR, exist_ok=True)
+    gpd.GeoDataFrame(geometry=geometry, crs="EPSG:6674").to_parquet(path + ".parquet" + tmp_suffix)
+    os.replace(path + ".parquet" + tmp_suffix, path + ".parquet")
+    with open(path + ".npy" + tmp_suffix, 'wb') as f:
+        np.save(f, labels)
+    os.replace(path + ".npy" + tmp_suffix, path + ".npy")
+    evict_lru(PARTITION_CACHE_DIR, MAX_PARTITION_CACHE_BYTES)
+
+def _load_hierarchy(key: str) -> Optional["_PartitionHierarchy"]:
+    """保存した区画化の階層を返す（無い場合はNone）"""
+    with _partition_lock:
+        hierarchy = _hierarchies.get(key)
+        if hierarchy is not None:
+            _hierarchies.move_to_end(key)
+            return hierarchy
+    path = _partition_path(key) + ".npz"
+    try:
+        hierarchy = _PartitionHierarchy.load(path)
+    except FileNotFoundError:
+        return None
+    touch((path,))
+    _remember(_hierarchies, key, hierarchy, MAX_CACHED_HIERARCHIES)
+    return hierarchy
+
+def _partition_hierarchy(gdf: gpd.GeoDataFrame) -> "_PartitionHierarchy":
+    """農地の区画化の階層を取得する（無い場合は作成してメモリとディスクに保存する）
+
+    一度作成すれば、以降の _partition はどの区画数でもクラスタリングをやり直さずに階層から求める。
+    同じ農地を複数の区画数で区画化する場合（reorganize_many など）に先に作成しておく。
+    """
+    key = _partition_key(gdf)
+    hierarchy = _load_hierarchy(key)
+    if hierarchy is None:
+        hierarchy = _PartitionHierarchy.build(gdf)
+        os.makedirs(PARTITION_CACHE_DIR, exist_ok=True)
+        hierarchy.save(_partition_path(key) + ".npz")
+        evict_lru(PARTITION_CACHE_DIR, MAX_PARTITION_CACHE_BYTES)
+        _remember(_hierarchies, key, hierarchy, MAX_CACHED_HIERARCHIES)
+    return hierarchy
+
+def _remember(cache: "OrderedDict[Any, Any]", key: Any, value: Any, max_size: int) -> None:
+    """メモリ上のキャッシュに保存し、上限を超えた分を使われていない順に削除する"""
+    with _partition_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+def _apply_merges(labels: np.ndarray, merges: Iterable[Tuple[int, int]]) -> np.ndarray:
+    """クラスタの統合（統合したクラスタid, 統合先のクラスタid）を順に適用し、農地ごとの統合先のクラスタidを返す"""
+    cluster_ids, inverse = np.unique(labels, return_inverse=True)
+    parent = {c: c for c in cluster_ids}
+    for child, root in merges:
+        parent[child] = root
+
+    def find(c):
+        while parent[c] != c:
+            c = parent[c]
+        return c
+
+    return np.array([find(c) for c in cluster_ids], dtype=labels.dtype)[inverse]
+
+def _apply_splits(labels: np.ndarray, splits: Iterable[Tuple[int, np.ndarray]]) -> np.ndarray:
+    """クラスタの分割（新しいクラスタid, 移した農地の位置）を順に適用した農地ごとのクラスタidを返す"""
+    labels = np.array(labels)
+    for next_id, rows in splits:
+        labels[rows] = next_id
+    return labels
+
+def _getbasepoints(
     gdf: gpd.GeoDataFrame,
-    ID: int
-    ) ->Tuple[float, float]:
-    """1km範囲での自分の農地の面積が広い農地を中心農地として設定する
+    IDs: Iterable[str],
+    distance: float = 1000
+    ) -> Dict[str, Tuple[float, float]]:
+    """農家ごとに、1km範囲での自分の農地の面積が広い農地を中心農地として設定する
+
+    指定された農家の農地を投影座標系（EPSG:32654）に変換し、一定の距離内の農地の組を空間インデックスで一度に求める。
+    同じ農家の農地の組だけを残して面積を農地ごとに合計し、合計が最大の農地を農家ごとに選ぶ。
 
     Args:
         gdf (gpd.GeoDataFrame): geoPandasのGeoDataFrame
-        ID (int): 農家のID
+        IDs (Iterable[str]): 農家のIDのリスト
+        distance (float, optional): 範囲（m）. Defaults to 1000.
 
     Returns:
-        Tuple[float, float]: 中心農地の座標
+        Dict[str, Tuple[float, float]]: 農家のID → 中心農地の座標（経度, 緯度）
     """
-
-    farms = gdf[gdf['FarmerIndicationNumberHash'] == ID]
-    max_area = 0
-    central_farm = None
+    IDs = list(IDs)
+    farms = gdf[gdf['FarmerIndicationNumberHash'].isin(IDs)]
+    farmer_ids = farms['FarmerIndicationNumberHash'].to_numpy()
+    projected = farms.geometry.to_crs(epsg=32654)
+    areas = projected.area.to_numpy()
+
+    # 一定の距離内にある同じ農家の農地の組を求め、農地ごとに面積を合計する
+    source, neighbor = projected.sindex.query(projected, predicate="dwithin", distance=distance)
+    same_farmer = farmer_ids[source] == farmer_ids[neighbor]
+    total_areas = np.bincount(source[same_farmer], weights=areas[neighbor[same_farmer]], minlength=len(farms))
+
+    # 農家ごとに合計が最大の農地（同じ場合は先に現れる農地）を中心農地とする
+    central = pd.Series(total_areas).groupby(farmer_ids, sort=False).idxmax()
+    central_farms = farms.geometry.iloc[central.to_numpy()]
+    basepoints = {ID: farm.centroid.coords[0] for ID, farm in zip(central.index, central_farms)}
 
     # 農地を持っていない場合は、gdfの座標の範囲の中でランダムに選択
-    if len(farms) == 0:
+    for ID in IDs:
+        if ID in basepoints:
+            continue
         if len(gdf) == 0:
             raise ValueError("GeoDataFrame is empty. Cannot select a random farm.")
-        # ランダム選択
+        # 座標は他の農家と同じく経緯度で返す
         random_farm = gdf.sample()
-        # projected CRSに変換
-        random_farm = random_farm.to_crs(epsg=32654)
-        return random_farm.geometry.centroid.iloc[0].coords[0]
+        basepoints[ID] = random_farm.geometry.iloc[0].centroid.coords[0]
 
-    # 一つ一つの農地に対して、1km範囲での自分の農地の面積が広い農地を中心農地として設定する
-    for farm in farms.geometry:
-        # 1kmのバッファを作成
-        buffer = farm.buffer(1/440)
-        # バッファと交差する農地を取得
-        intersecting_farms = farms[farms.geometry.intersects(buffer)]
-        # print(len(intersecting_farms))
-        total_area = intersecting_farms.to_crs(epsg=32654).geometry.area.sum()
-        # print('Farmer ID:', ID, 'Total Area:', total_area)
+    return {ID: basepoints[ID] for ID in IDs}
 
-        if total_area > max_area:
-            max_area = total_area
-            central_farm = farm
+def _assign_by_capacity(
+    gdf: gpd.GeoDataFrame,
+    ex_basepoint: Dict[str, Tuple[float, float]],
+    arearates: list[float],
+    newfarmer_N: int,
+    distance: float = 30,
+    k_neighbors: int = 6,
+    iterations: int = 5
+) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """農家ごとの面積の割合を上限として、農地を農家に直接割り当てる
 
-        # print('Farmer ID:', ID, 'central_farm:', central_farm)
-        # print(max_area)
+    農地の隣接グラフ（distance m 以内の農地と、重心が近い k_neighbors 件の農地）の上で、
+    農家ごとの起点の農地から同時に領域を広げる。起点から近い農地から順に割り当て、
+    割り当てた面積が上限（面積割合 × 全体の面積）に達した農家はそれ以上広げない。
+    現農家の起点は中心農地に最も近い農地、新規農家の起点は他の起点から最も遠い農地から始め、
+    割り当てた農地の重心に移しながら割り当て直す。
+    計算量は農地の数と隣接の数に比例し、面積割合の分母には依存しない。
 
-    return central_farm.centroid.coords[0]
+    Args:
+        gdf (gpd.GeoDataFrame): 田または畑の農地データ
+        ex_basepoint (Dict[str, Tuple[float, float]]): 現農家のID → 中心農地の座標（経度, 緯度）
+        arearates (list[float]): 面積割合のリスト（現農家の順、続けて新規農家）
+        newfarmer_N (int): 新規農家の数
+        distance (float, optional): 隣接とみなす距離（m）. Defaults to 30.
+        k_neighbors (int, optional): 隣接とみなす重心が近い農地の数. Defaults to 6.
+        iterations (int, optional): 新規農家の起点を移して割り当て直す最大の回数. Defaults to 5.
+
+    Returns:
+        Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]: 農地ごと、農家の区画ごとのGeoDataFrame
+    """
+    # 田と畑を結合した時に行が重複しないよう、入力のインデックスを残す
+    gdf_poly = gdf.copy()
+    farmer_ids = list(ex_basepoint.keys()) + [f"newfarmer{i}" for i in range(newfarmer_N)]
+    n = len(gdf_poly)
+    if n == 0 or not farmer_ids:
+        gdf_poly["cluster"] = pd.Series(dtype=int)
+        gdf_poly["reorganized"] = False
+        return gdf_poly, gdf_poly.dissolve(by="cluster")
+
+    projected = gdf_poly.geometry.to_crs(epsg=32654)
+    areas = projected.area.to_numpy()
+    centroids = shapely.get_coordinates(projected.centroid.to_numpy())
+    capacities = np.asarray(arearates[:len(farmer_ids)], dtype=float) * areas.sum()
+    adjacency = _parcel_adjacency(projected, centroids, distance, k_neighbors)
+
+    # 起点の農地を決める
+    tree = KDTree(centroids)
+    seeds = []
+    if ex_basepoint:
+        basepoints = gpd.GeoSeries(gpd.points_from_xy(*zip(*ex_basepoint.values())), crs="EPSG:4326").to_crs(epsg=32654)
+        for point in shapely.get_coordinates(basepoints.to_numpy()):
+            # 他の農家と同じ農地になる場合は次に近い農地にする
+            _, candidates = tree.query(point, k=min(len(seeds) + 1, n))
+            seeds.append(next((c for c in np.atleast_1d(candidates) if c not in seeds), int(np.atleast_1d(candidates)[0])))
+    # 現農家がいない場合、最初の新規農家は全体の中心から最も遠い農地から始める
+    min_dists = np.hypot(*(centroids - centroids.mean(axis=0)).T)
+    for seed in seeds:
+        min_dists = np.minimum(min_dists, np.hypot(*(centroids - centroids[seed]).T))
+    for _ in range(newfarmer_N):
+        seed = int(np.argmax(min_dists))
+        seeds.append(seed)
+        min_dists = np.minimum(min_dists, np.hypot(*(centroids - centroids[seed]).T))
+
+    # 新規農家の起点は、割り当てた農地の重心（面積で重み付け）に最も近い農地に移して割り当て直す
+    n_existing = len(ex_basepoint)
+    for _ in range(iterations):
+        assignment = _grow_regions(seeds, capacities, areas, centroids, adjacency)
+        moved = False
+        for farmer in range(n_existing, len(farmer_ids)):
+            rows = np.flatnonzero(assignment == farmer)
+            if len(rows) == 0:
+                continue
+            center = np.average(centroids[rows], axis=0, weights=areas[rows])
+            seed = int(rows[np.argmin(np.hypot(*(centroids[rows] - center).T))])
+            if seed != seeds[farmer] and seed not in seeds:
+                seeds[farmer] = seed
+                moved = True
+        if not moved:
+            break
+
+    gdf_poly["cluster"] = assignment
+    gdf_poly["FarmerIndicationNumberHash"] = np.asarray(farmer_ids, dtype=object)[assignment]
+    gdf_poly["reorganized"] = True
+
+    gdf_multipoly = gdf_poly[["cluster", "FarmerIndicationNumberHash", "reorganized", "geometry"]].dissolve(by="cluster")
+    return gdf_poly, gdf_multipoly
+
+def _grow_regions(
+    seeds: list[int],
+    capacities: np.ndarray,
+    areas: np.ndarray,
+    centroids: np.ndarray,
+    adjacency: csr_matrix
+) -> np.ndarray:
+    """起点の農地から隣接グラフ上で同時に領域を広げ、農地ごとの農家の番号を返す
+
+    起点から近い農地から順に割り当て、割り当てた面積が上限に達した農家はそれ以上広げない。
+    上限に達した農家に囲まれたり、隣接グラフでつながっていなかったりして残った農地は、
+    上限に達していない農家のうち起点が近い農家から順に割り当てる。
+    """
+    n = len(areas)
+    assignment = np.full(n, -1)
+    filled = np.zeros(len(seeds))
+    seed_points = centroids[seeds]
+
+    heap = [(0.0, farmer, seed) for farmer, seed in enumerate(seeds)]
+    while heap:
+        _, farmer, parcel = heapq.heappop(heap)
+        if assignment[parcel] >= 0 or filled[farmer] >= capacities[farmer]:
+            continue
+        assignment[parcel] = farmer
+        filled[farmer] += areas[parcel]
+        for neighbor in adjacency.indices[adjacency.indptr[parcel]:adjacency.indptr[parcel + 1]]:
+            if assignment[neighbor] < 0:
+                cost = float(np.hypot(*(centroids[neighbor] - seed_points[farmer])))
+                heapq.heappush(heap, (cost, farmer, neighbor))
+
+    remaining = np.flatnonzero(assignment < 0)
+    if len(remaining):
+        dists = np.hypot(*(centroids[remaining][:, None, :] - seed_points[None, :, :]).transpose(2, 0, 1))
+        for flat in np.argsort(dists, axis=None, kind="stable"):
+            parcel, farmer = remaining[flat // len(seeds)], flat % len(seeds)
+            if assignment[parcel] < 0 and filled[farmer] < capacities[farmer]:
+                assignment[parcel] = farmer
+                filled[farmer] += areas[parcel]
+        # すべての農家が上限に達した場合は、起点が最も近い農家に割り当てる
+        left = assignment[remaining] < 0
+        assignment[remaining[left]] = np.argmin(dists[left], axis=1)
+    return assignment
+
+def _parcel_adjacency(
+    projected: gpd.GeoSeries,
+    centroids: np.ndarray,
+    distance: float,
+    k_neighbors: int
+) -> csr_matrix:
+    """農地の隣接グラフ（distance m 以内の農地と、重心が近い k_neighbors 件の農地）を疎行列で返す"""
+    n = len(projected)
+    source, target = projected.sindex.query(projected, predicate="dwithin", distance=distance)
+    k = min(k_neighbors + 1, n)
+    if k > 1:
+        _, nearest = KDTree(centroids).query(centroids, k=k)
+        source = np.concatenate([source, np.repeat(np.arange(n), k), nearest.ravel()])
+        target = np.concatenate([target, nearest.ravel(), np.repeat(np.arange(n), k)])
+    other = source != target
+    adjacency = csr_matrix((np.ones(other.sum(), dtype=bool), (source[other], target[other])), shape=(n, n))
+    adjacency.sum_duplicates()
+    return adjacency
 
 def _put_existing_farmers(
     gdf_poly: gpd.GeoDataFrame,
     gdf_multipoly: gpd.GeoDataFrame,
     ex_basepoint: Dict[str, Tuple[float, float]],
-    area_nums: Dict[str, int]
+    area_nums: Dict[str, int],
+    distance: float = 30,
+    k_neighbors: int = 6
 ) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """現農家を配置する
+
+    クラスターの隣接グラフ（distance m 以内と、重心が近い k_neighbors 件）を投影座標系（EPSG:32654）で一度だけ作り、
+    すべての農家の領域を一つの優先度付きキューで同時に広げる。
+    候補は割り当て済みのクラスターから隣接するクラスターまでの重心の距離の順に取り出し、
+    最初のクラスターは中心農地から最も近いクラスターとする。
+    複数の農家が同じクラスターに最も近い場合は近い方の農家が取り、他の農家は次に近いクラスターから始める。
+    隣接するクラスターが残っていない農家は、領域から最も近い未割り当てのクラスターに移る。
 
+    Args:
+        gdf_poly (gpd.GeoDataFrame): 単一のポリゴンを持つGeoDataFrame
+        gdf_multipoly (gpd.GeoDataFrame): 複数のポリゴンを持つGeoDataFrame
+        ex_basepoint (Dict[str, Tuple[float, float]]): 現農家のID → 中心農地の座標（経度, 緯度）
+        area_nums (Dict[str, int]): 現農家のID → 割り当てるクラスターの数
+        distance (float, optional): 隣接とみなす距離（m）. Defaults to 30.
+        k_neighbors (int, optional): 隣接とみなす重心が近いクラスターの数. Defaults to 6.
+
+    Returns:
+        Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]: 現農家を配置後のGeoDataFrame
+    """
     # EPSG:4326 (緯度経度) に変換
     if gdf_multipoly.crs and gdf_multipoly.crs.to_epsg() != 4326:
         gdf_multipoly = gdf_multipoly.to_crs(epsg=4326)
 
-    # 各クラスターの重心を計算
-    gdf_multipoly["centroid"] = gdf_multipoly.geometry.centroid
-    centroids = gpd.GeoDataFrame(geometry=gdf_multipoly["centroid"], crs=gdf_multipoly.crs)
-
-
-    # KDTreeを作成して最近傍探索を効率化
-    tree = KDTree(centroids.geometry.apply(lambda p: (p.x, p.y)).tolist())
-
-    # 各農家の最近傍クラスターを決定（被りなしを優先）
-    cluster_assignment = {}
-    assigned_clusters = set()
-    remaining_farmers = set(ex_basepoint.keys())
-    conflicted_farmers = []
-
-    for farmer_id, (lon, lat) in ex_basepoint.items():
-        _, idx = tree.query((lon, lat))
-        cluster_idx = gdf_multipoly.index[idx]
-
-        if cluster_idx not in assigned_clusters:
-            cluster_assignment[farmer_id] = [cluster_idx]
-            assigned_clusters.add(cluster_idx)
-            remaining_farmers.remove(farmer_id)
-        else:
-            conflicted_farmers.append((farmer_id, cluster_idx))
-
-    # クラスターを増やす処理（最近傍ベースで拡張）
-    def expand_farmer_clusters(farmer_id, required_area):
-        while len(cluster_assignment[farmer_id]) < required_area:
-            current_clusters = cluster_assignment[farmer_id]
-            candidate_clusters = list(set(gdf_multipoly.index) - assigned_clusters)
-
-            if not candidate_clusters:
-                break
-
-            if not current_clusters:
-                # 最初のクラスターをbasepointからの距離で決める（すでに割り当てられたクラスターは除外）
-                base_lon, base_lat = ex_basepoint[farmer_id]
-                distances, indices = tree.query((base_lon, base_lat), k=len(gdf_multipoly))
-                first_cluster = next((gdf_multipoly.index[i] for i in indices if gdf_multipoly.index[i] not in assigned_clusters), None)
-                if first_cluster is None:
-                    break
-                cluster_assignment[farmer_id] = [first_cluster]
-                assigned_clusters.add(first_cluster)
-                current_clusters = [first_cluster]
-
-            new_cluster = min(
-                (c for c in candidate_clusters if c not in assigned_clusters),
-                key=lambda c: min(
-                    (gdf_multipoly.loc[c, "centroid"].distance(gdf_multipoly.loc[cc, "centroid"])
-                     for cc in current_clusters),
-                    default=float("inf")
-                ),
-                default=None
-            )
-
-            if new_cluster is not None:
-                cluster_assignment[farmer_id].append(new_cluster)
-                assigned_clusters.add(new_cluster)
-
-    # まず被ってない農家に対してクラスターを拡張
-    for farmer_id in list(cluster_assignment.keys()):
-        expand_farmer_clusters(farmer_id, area_nums[farmer_id])
-
-    # 被った農家のうちクラスターに近い方を優先
-    conflicted_farmers.sort(key=lambda x: tree.query(ex_basepoint[x[0]])[0])
-
-    for farmer_id, _ in conflicted_farmers:
-        if farmer_id not in cluster_assignment:
-            cluster_assignment[farmer_id] = []
-        expand_farmer_clusters(farmer_id, area_nums[farmer_id])
+    # クラスターの重心と隣接グラフを投影座標系で作成
+    projected = gdf_multipoly.geometry.to_crs(epsg=32654) if gdf_multipoly.crs else gdf_multipoly.geometry
+    centroids = shapely.get_coordinates(shapely.centroid(projected.to_numpy()))
+    adjacency = _parcel_adjacency(projected, centroids, distance, k_neighbors)
+    owner = np.full(len(centroids), -1)
+
+    farmer_ids = list(ex_basepoint.keys())
+    counts = np.zeros(len(farmer_ids), dtype=int)
+    required = np.array([area_nums[farmer_id] for farmer_id in farmer_ids], dtype=int)
+    regions = [[] for _ in farmer_ids]
+
+    # 中心農地の座標もクラスターと同じ投影座標系に変換
+    seed_points = np.asarray(list(ex_basepoint.values()), dtype=float).reshape(-1, 2)
+    if gdf_multipoly.crs:
+        seeds = gpd.GeoSeries(gpd.points_from_xy(seed_points[:, 0], seed_points[:, 1]), crs="EPSG:4326")
+        seed_points = shapely.get_coordinates(seeds.to_crs(epsg=32654).to_numpy())
+
+    # 候補: (距離, 農家の番号, クラスター)。pending は農家ごとのキューに残っている候補の数
+    heap = []
+    pending = np.zeros(len(farmer_ids), dtype=int)
+
+    def push(cost, farmer, cluster):
+        heapq.heappush(heap, (cost, farmer, cluster))
+        pending[farmer] += 1
+
+    def push_nearest_unassigned(farmer):
+        # 領域（まだ無ければ中心農地）から最も近い未割り当てのクラスターを候補にする
+        unassigned = np.flatnonzero(owner < 0)
+        if len(unassigned) == 0 or counts[farmer] >= required[farmer]:
+            return
+        points = centroids[regions[farmer]] if regions[farmer] else seed_points[farmer:farmer + 1]
+        costs, _ = KDTree(points).query(centroids[unassigned])
+        nearest = int(np.argmin(costs))
+        push(float(costs[nearest]), farmer, int(unassigned[nearest]))
+
+    for farmer in range(len(farmer_ids)):
+        push_nearest_unassigned(farmer)
+
+    while heap:
+        _, farmer, cluster = heapq.heappop(heap)
+        pending[farmer] -= 1
+        if counts[farmer] >= required[farmer]:
+            continue
+        if owner[cluster] < 0:
+            owner[cluster] = farmer
+            counts[farmer] += 1
+            regions[farmer].append(cluster)
+            for neighbor in adjacency.indices[adjacency.indptr[cluster]:adjacency.indptr[cluster + 1]]:
+                if owner[neighbor] < 0:
+                    push(float(np.hypot(*(centroids[neighbor] - centroids[cluster]))), farmer, int(neighbor))
+        if pending[farmer] == 0:
+            # 他の農家に先に割り当てられた、または隣接するクラスターが無くなった場合
+            push_nearest_unassigned(farmer)
 
     # 結果をGeoDataFrameに反映
-    assignment_series = pd.Series({c: f for f, clusters in cluster_assignment.items() for c in clusters})
+    assigned = owner >= 0
+    assignment_series = pd.Series(np.asarray(farmer_ids, dtype=object)[owner[assigned]], index=gdf_multipoly.index[assigned])
     gdf_multipoly["FarmerIndicationNumberHash"] = gdf_multipoly.index.map(assignment_series.get)
     # reorganizedというカラムを作り、FarmerIndicationNumberHashが更新されたもののみTrueにする
-    gdf_multipoly["reorganized"] = gdf_multipoly.index.isin(assignment_series.index)
+    gdf_multipoly["reorganized"] = assigned
 
     # polyの方で、"cluster"キーの値がassignment_series.indexに一致するものの"FarmerIndicationNumberHash"を更新
     gdf_poly.loc[gdf_poly["cluster"].isin(assignment_series.index), "FarmerIndicationNumberHash"] = gdf_poly["cluster"].map(assignment_series)
     gdf_poly.loc[gdf_poly["cluster"].isin(assignment_series.index), "reorganized"] = True
 
-    # gdf_multipolyからcentroidを削除
-    gdf_multipoly = gdf_multipoly.drop(columns=["centroid"])
-
     return gdf_poly, gdf_multipoly
 
 def _put_new_farmers(
@@ -390,16 +1450,18 @@ def _put_new_farmers(
     Returns:
         Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]: 新規農家を配置後のGeoDataFrame
     """
-    # reorganizedがFalseのインデックスを取得
-    unassigned_indices = gdf_multipoly.index[~gdf_multipoly["reorganized"]]
-    i=0
-    for unassigned_index in unassigned_indices:
-        gdf_multipoly.loc[unassigned_index, "FarmerIndicationNumberHash"] = f"newfarmer{str(i)}"
-        gdf_multipoly.loc[unassigned_index, "reorganized"] = True
-        # polyの方で、"cluster"キーの値がunassigned_indexに一致するものの"FarmerIndicationNumberHash"を更新
-        gdf_poly.loc[gdf_poly["cluster"] == unassigned_index, "FarmerIndicationNumberHash"] = f"newfarmer{str(i)}"
-        gdf_poly.loc[gdf_poly["cluster"] == unassigned_index, "reorganized"] = True
-        i+=1
+    # reorganizedがFalseのクラスターに、順に新規農家を割り当てる（クラスター → 新規農家の対応表）
+    unassigned_indices = gdf_multipoly.index[~gdf_multipoly["reorganized"].astype(bool)]
+    new_farmers = pd.Series([f"newfarmer{i}" for i in range(len(unassigned_indices))], index=unassigned_indices, dtype=object)
+
+    gdf_multipoly.loc[unassigned_indices, "FarmerIndicationNumberHash"] = new_farmers
+    gdf_multipoly.loc[unassigned_indices, "reorganized"] = True
+
+    # polyの方は、"cluster"キーの値で対応表を引いて更新
+    mapped = gdf_poly["cluster"].map(new_farmers)
+    targets = mapped.notna()
+    gdf_poly.loc[targets, "FarmerIndicationNumberHash"] = mapped[targets]
+    gdf_poly.loc[targets, "reorganized"] = True
 
     return gdf_poly, gdf_multipoly
 
@@ -424,50 +1486,217 @@ def _excute_analysis(
     # コスト分析を実行
     result = run_analysis(gdf, existing_farmer_ids)
     # existing_farmer_idsに記載されている農家のコスト分析結果を反映
-    for farmer_id in existing_farmer_ids:
-        reorg_ta_gdf.loc[reorg_ta_gdf["FarmerIndicationNumberHash"] == farmer_id, "worktime_reduced"] = result.farmers_worktime_reduced[farmer_id]
-        reorg_ta_gdf.loc[reorg_ta_gdf["FarmerIndicationNumberHash"] == farmer_id, "fuel_cost_reduced"] = result.farmers_fuel_cost_reduced[farmer_id]
-        reorg_hata_gdf.loc[reorg_hata_gdf["FarmerIndicationNumberHash"] == farmer_id, "worktime_reduced"] = result.farmers_worktime_reduced[farmer_id]
-        reorg_hata_gdf.loc[reorg_hata_gdf["FarmerIndicationNumberHash"] == farmer_id, "fuel_cost_reduced"] = result.farmers_fuel_cost_reduced[farmer_id]
+    reorg_ta_gdf = _apply_analysis(reorg_ta_gdf, result, existing_farmer_ids)
+    reorg_hata_gdf = _apply_analysis(reorg_hata_gdf, result, existing_farmer_ids)
 
     return result, reorg_ta_gdf, reorg_hata_gdf
 
+def _apply_analysis(
+    reorg_gdf: gpd.GeoDataFrame,
+    result: AnalysisResult,
+    existing_farmer_ids: list[str]
+) -> gpd.GeoDataFrame:
+    """農家ごとのコスト分析結果を、農家IDで引いて農地に書き込む
+
+    Args:
+        reorg_gdf (gpd.GeoDataFrame): 最適化後のGeoDataFrame
+        result (AnalysisResult): コスト分析結果
+        existing_farmer_ids (list[str]): 既存農家のIDリスト
+
+    Returns:
+        gpd.GeoDataFrame: コスト分析結果を書き込んだGeoDataFrame
+    """
+    # 農家ID → 分析結果の対応表
+    metrics = pd.DataFrame({
+        "worktime_reduced": {farmer_id: result.farmers_worktime_reduced[farmer_id] for farmer_id in existing_farmer_ids},
+        "fuel_cost_reduced": {farmer_id: result.farmers_fuel_cost_reduced[farmer_id] for farmer_id in existing_farmer_ids},
+    }, index=pd.Index(existing_farmer_ids, dtype=object), dtype=float)
+
+    farmer_ids = reorg_gdf["FarmerIndicationNumberHash"]
+    targets = farmer_ids.isin(metrics.index)
+    for column in metrics.columns:
+        values = farmer_ids.map(metrics[column])
+        if column in reorg_gdf.columns:
+            # 既存農家以外の農地の値はそのまま残す
+            values = values.where(targets, reorg_gdf[column])
+        reorg_gdf[column] = values
+    return reorg_gdf
+
+
+class _LocalSearch:
+    """農家の間で農地を移す・交換する局所探索（optimize_plan で使う）
+
+    目的関数は、農家ごとの農地の重心からの二乗距離の和（巡回する移動距離の近似）と、
+    隣接グラフで農家が異なる農地の組の数（分断の度合い）に重みを掛けたものの和。
+    農家ごとの農地の数・座標の和・二乗の和を保持し、移動・交換による変化を農地の隣接の数に比例する計算量で求める。
+    """
+
+    def __init__(
+        self,
+        labels: np.ndarray,
+        areas: np.ndarray,
+        centroids: np.ndarray,
+        adjacency: csr_matrix,
+        area_tolerance: float,
+        fragmentation_weight: float,
+        seed: int
+    ):
+        self.labels = np.array(labels)
+        self.areas = areas
+        # 桁落ちを避けるため、座標は平均を原点にする
+        self.points = centroids - centroids.mean(axis=0)
+        self.norms = (self.points ** 2).sum(axis=1)
+        self.indptr, self.indices = adjacency.indptr, adjacency.indices
+        self.rng = np.random.default_rng(seed)
+
+        k = self.labels.max() + 1
+        self.count = np.bincount(self.labels, minlength=k)
+        self.sums = np.stack([np.bincount(self.labels, weights=self.points[:, d], minlength=k) for d in range(2)], axis=1)
+        self.squares = np.bincount(self.labels, weights=self.norms, minlength=k)
+        self.farmer_areas = np.bincount(self.labels, weights=areas, minlength=k)
+        self.lower = self.farmer_areas * (1 - area_tolerance)
+        self.upper = self.farmer_areas * (1 + area_tolerance)
+
+        # 分断の重みは、隣接する農地の重心の距離の中央値の二乗を単位とする
+        source = np.repeat(np.arange(len(self.labels)), np.diff(self.indptr))
+        edge_lengths = np.hypot(*(centroids[source] - centroids[self.indices]).T)
+        self.weight = fragmentation_weight * (np.median(edge_lengths) ** 2 if len(edge_lengths) else 0.0)
+        self.moves = self.swaps = self.sweeps = 0
+
+    def cost(self) -> float:
+        """目的関数の値"""
+        spread = self.squares - (self.sums ** 2).sum(axis=1) / np.maximum(self.count, 1)
+        source = np.repeat(np.arange(len(self.labels)), np.diff(self.indptr))
+        cut = np.count_nonzero(self.labels[source] != self.labels[self.indices]) / 2
+        return float(spread.sum() + self.weight * cut)
+
+    def run(self, deadline: float, stop_event: Optional[threading.Event] = None) -> str:
+        """改善できなくなるまで境界の農地を調べる
+
+        Returns:
+            str: 終了した理由（"converged", "time", "interrupted"）
+        """
+        while True:
+            labels = self.labels
+            source = np.repeat(np.arange(len(labels)), np.diff(self.indptr))
+            boundary = np.unique(source[labels[source] != labels[self.indices]])
+            improved = False
+            for step, parcel in enumerate(self.rng.permutation(boundary)):
+                if step % 32 == 0:
+                    if stop_event is not None and stop_event.is_set():
+                        return "interrupted"
+                    if time.monotonic() >= deadline:
+                        return "time"
+                improved |= self._improve(parcel)
+            self.sweeps += 1
+            if not improved:
+                return "converged"
+
+    def _improve(self, parcel: int) -> bool:
+        """農地を別の農家に移す、または隣接する別の農家の農地と交換する中で最も良いものを行う"""
+        farmer = self.labels[parcel]
+        neighbors = self.indices[self.indptr[parcel]:self.indptr[parcel + 1]]
+        others = neighbors[self.labels[neighbors] != farmer]
+        best, best_move = -1e-9, None
+        for target in np.unique(self.labels[others]):
+            delta = self._move_delta(parcel, target)
+            if delta < best:
+                best, best_move = delta, ("move", target)
+        for other in others:
+            delta = self._swap_delta(parcel, other)
+            if delta < best:
+                best, best_move = delta, ("swap", other)
+        if best_move is None:
+            return False
+        kind, value = best_move
+        if kind == "move":
+            self._apply(parcel, value)
+            self.moves += 1
+        else:
+            target = self.labels[value]
+            self._apply(parcel, target)
+            self._apply(value, farmer)
+            self.swaps += 1
+        return True
+
+    def _spread(self, count: int, sums: np.ndarray, squares: float) -> float:
+        return squares - (sums @ sums) / count if count > 0 else 0.0
+
+    def _cut_delta(self, parcel: int, source: int, target: int, exclude: int = -1) -> int:
+        """農地を source から target に移したときの、農家が異なる隣接の組の数の変化"""
+        neighbors = self.indices[self.indptr[parcel]:self.indptr[parcel + 1]]
+        neighbors = neighbors[neighbors != exclude]
+        labels = self.labels[neighbors]
+        return int(np.count_nonzero(labels == source) - np.count_nonzero(labels == target))
+
+    def _move_delta(self, parcel: int, target: int) -> float:
+        source = self.labels[parcel]
+        area = self.areas[parcel]
+        if (self.count[source] <= 1 or self.farmer_areas[source] - area < self.lower[source]
+                or self.farmer_areas[target] + area > self.upper[target]):
+            return np.inf
+        point, norm = self.points[parcel], self.norms[parcel]
+        before = (self._spread(self.count[source], self.sums[source], self.squares[source])
+                  + self._spread(self.count[target], self.sums[target], self.squares[target]))
+        after = (self._spread(self.count[source] - 1, self.sums[source] - point, self.squares[source] - norm)
+                 + self._spread(self.count[target] + 1, self.sums[target] + point, self.squares[target] + norm))
+        return after - before + self.weight * self._cut_delta(parcel, source, target)
+
+    def _swap_delta(self, parcel: int, other: int) -> float:
+        source, target = self.labels[parcel], self.labels[other]
+        difference = self.areas[parcel] - self.areas[other]
+        if not (self.lower[source] <= self.farmer_areas[source] - difference <= self.upper[source]
+                and self.lower[target] <= self.farmer_areas[target] + difference <= self.upper[target]):
+            return np.inf
+        shift = self.points[parcel] - self.points[other]
+        norm_shift = self.norms[parcel] - self.norms[other]
+        before = (self._spread(self.count[source], self.sums[source], self.squares[source])
+                  + self._spread(self.count[target], self.sums[target], self.squares[target]))
+        after = (self._spread(self.count[source], self.sums[source] - shift, self.squares[source] - norm_shift)
+                 + self._spread(self.count[target], self.sums[target] + shift, self.squares[target] + norm_shift))
+        cut = self._cut_delta(parcel, source, target, exclude=other) + self._cut_delta(other, target, source, exclude=parcel)
+        return after - before + self.weight * cut
+
+    def _apply(self, parcel: int, target: int) -> None:
+        source = self.labels[parcel]
+        for farmer, sign in ((source, -1), (target, 1)):
+            self.count[farmer] += sign
+            self.sums[farmer] += sign * self.points[parcel]
+            self.squares[farmer] += sign * self.norms[parcel]
+            self.farmer_areas[farmer] += sign * self.areas[parcel]
+        self.labels[parcel] = target
+
 
 class _PartitionModel:
     def __init__(self, gdf: gpd.GeoDataFrame, partition_count: int):
         self.gdf = gdf
         self.partition_count = partition_count
 
-    def estimate_eps(self, farmland):
-        """適切な eps を推定する（農地の距離分布から計算）"""
-        centroids = np.array([geom.centroid.coords[0] for geom in farmland.geometry])
-        from scipy.spatial import distance_matrix
-        dist_matrix = distance_matrix(centroids, centroids)
-        np.fill_diagonal(dist_matrix, np.inf)  # 自分自身を除外
-        min_dists = np.min(dist_matrix, axis=1)
-        return np.percentile(min_dists, 75)  # 75パーセンタイルの距離を eps にする
-
-    def split_largest_cluster(grouped, target_n):
-        """クラスタ数が target_n より少ない場合、大きなクラスタを分割"""
-        while len(grouped) < target_n:
-            largest_idx = grouped.area.idxmax()
-            largest_poly = grouped.loc[largest_idx].geometry
-
-            # 重心を基に Voronoi 分割
-            points = [largest_poly.centroid]
-            for _ in range(2):  # 2分割する
-                new_point = largest_poly.representative_point()
-                points.append(new_point)
-
-            voronoi_regions = voronoi_diagram(MultiPolygon([largest_poly]), [p for p in points])
-            new_polys = [r.intersection(largest_poly) for r in voronoi_regions.geoms]
-
-            # 分割後のポリゴンを追加
-            new_geos = [p for p in new_polys if isinstance(p, Polygon)]
-            grouped = grouped.drop(largest_idx)
-            new_df = gpd.GeoDataFrame(geometry=new_geos)
-            grouped = pd.concat([grouped, new_df]).reset_index(drop=True)
-        return grouped
+    @staticmethod
+    def centroids(farmland: gpd.GeoDataFrame) -> np.ndarray:
+        """農地の重心の座標を (n, 2) の配列で返す"""
+        return shapely.get_coordinates(shapely.centroid(farmland.geometry.to_numpy()))
+
+    def estimate_eps(self, farmland, centroids=None):
+        """適切な eps を推定する（農地の距離分布から計算）
+
+        各農地の重心から最も近い他の農地の重心までの距離を KDTree で求める。
+        """
+        if centroids is None:
+            centroids = self.centroids(farmland)
+        # k=2 で自分自身と最も近い他の農地を求める
+        min_dists, _ = KDTree(centroids).query(centroids, k=2)
+        return np.percentile(min_dists[:, 1], 75)  # 75パーセンタイルの距離を eps にする
+
+    def dbscan(self, farmland: gpd.GeoDataFrame, centroids: np.ndarray) -> Tuple[np.ndarray, float]:
+        """DBSCAN を使用して隣接する農地をクラスタリングする
+
+        Returns:
+            Tuple[np.ndarray, float]: 農地ごとのクラスタid、eps
+        """
+        eps_value = self.estimate_eps(farmland, centroids)  # 自動的に eps を決定
+        clustering = DBSCAN(eps=eps_value, min_samples=1).fit(centroids)
+        return clustering.labels_, eps_value
 
     def run(self) -> gpd.GeoDataFrame:
         """クラスタリングを実行する
@@ -475,53 +1704,346 @@ class _PartitionModel:
         Returns:
             gpd.GeoDataFrame: クラスタリング結果
         """
-        farmland = self.gdf
+        return _partition_frames(self.gdf, self.cluster_labels())
+
+    def cluster_labels(self) -> np.ndarray:
+        """農地ごとのクラスタid（0, 1, ... と振り直したもの）を求める"""
         target_n = self.partition_count
         # 重心を基にクラスタリング
-        farmland = farmland.to_crs(epsg=6674)  # 座標系を投影に
-        centroids = np.array([geom.centroid.coords[0] for geom in farmland.geometry])
-        eps_value = self.estimate_eps(farmland)  # 自動的に eps を決定
+        farmland = self.gdf.to_crs(epsg=6674)  # 座標系を投影に
+        centroids = self.centroids(farmland)
+        labels, eps_value = self.dbscan(farmland, centroids)
 
-        # DBSCAN を使用して隣接する農地をクラスタリング
-        clustering = DBSCAN(eps=eps_value, min_samples=1).fit(centroids)
-        farmland["cluster"] = clustering.labels_ # クラスタリング結果を追加
-
-        grouped = farmland.dissolve(by="cluster") # dissolve: クラスタごとにまとめる
-        # 座標系を投影に
-
-        # クラスタid変更履歴
-        change_cluster_id = {}
         # クラスタ数が target_n より多い場合 → 統合
-        while len(grouped) > target_n:
-            # print(len(grouped))
-            smallest_idx = grouped.area.idxmin()
-            smallest_poly = grouped.loc[smallest_idx]
-            remaining = grouped.drop(smallest_idx)
-            nearest_idx = remaining.distance(smallest_poly.geometry).idxmin()
-            grouped.loc[nearest_idx, "geometry"] = remaining.loc[nearest_idx].geometry.union(smallest_poly.geometry)
-            grouped = grouped.drop(smallest_idx)
-            change_cluster_id[smallest_idx] = nearest_idx
-        # print(change_cluster_id)
+        labels = self.merge_clusters(farmland, labels, target_n, eps_value)
 
         # クラスタ数が target_n より少ない場合 → 分割
-        # grouped = split_largest_cluster(grouped, target_n)
-        # groupedのタイプはGeoDataFrame
+        labels = self.split_clusters(farmland, labels, target_n, centroids)
+
+        # クラスタidを振り直す（クラスタidの順に 0, 1, ... とし、groupedの行番号と一致させる）
+        return np.searchsorted(np.unique(labels), labels)
+
+    def merge_clusters(
+        self,
+        farmland: gpd.GeoDataFrame,
+        labels: np.ndarray,
+        target_n: int,
+        radius: float
+    ) -> np.ndarray:
+        """最も面積の小さいクラスタを最も近いクラスタに統合することを、クラスタ数が target_n になるまで繰り返す
+
+        Args:
+            farmland (gpd.GeoDataFrame): 農地データ（投影座標系）
+            labels (np.ndarray): 農地ごとのクラスタid
+            target_n (int): クラスタ数
+            radius (float): 事前に隣接を求める距離
 
-        # クラスタid変更履歴を適用
-        for k, v in change_cluster_id.items():
-            farmland.loc[farmland["cluster"] == k, "cluster"] = v
+        Returns:
+            np.ndarray: 統合後の農地ごとのクラスタid（統合先のクラスタidを引き継ぐ）
+        """
+        labels = np.asarray(labels)
+        merge_count = len(np.unique(labels)) - target_n
+        if merge_count <= 0:
+            return labels
+        merges = list(itertools.islice(self.merge_steps(farmland, labels, radius), merge_count))
+        return _apply_merges(labels, merges)
+
+    def merge_steps(
+        self,
+        farmland: gpd.GeoDataFrame,
+        labels: np.ndarray,
+        radius: float
+    ) -> Iterator[Tuple[int, int]]:
+        """最も面積の小さいクラスタを最も近いクラスタに統合し、（統合したクラスタid, 統合先のクラスタid）を順に返す
+
+        クラスタが一つになるまで続くが、必要な数だけ取り出せばそれ以降の統合は行わない。
+        統合の順序はクラスタ数に依存しないため、取り出す数を変えれば任意のクラスタ数の結果が得られる。
+
+        クラスタの面積は優先度付きキューで管理し、クラスタ間の距離（農地間の最短距離）は
+        radius 以内にある農地の組から隣接するクラスタの表として事前に求めておく。
+        統合したクラスタの距離は統合前の距離の小さい方になるため、ジオメトリの結合は行わない。
+        クラスタごとに、表にすべてのクラスタが含まれている距離（最初は radius）を記録し、
+        表の中で最も近いクラスタがその距離より遠い場合（隣接するクラスタが無い場合など）のみ、
+        探索範囲を広げて農地の組を求め直す。見つかった距離は両方のクラスタの表に記録し、
+        統合したクラスタの表が完全な距離は統合前の小さい方とする。
+        面積・距離が同じ場合はクラスタidの小さい方を選ぶ。
+
+        Args:
+            farmland (gpd.GeoDataFrame): 農地データ（投影座標系）
+            labels (np.ndarray): 農地ごとのクラスタid
+            radius (float): 事前に隣接を求める距離
+
+        Yields:
+            Tuple[int, int]: 統合したクラスタid、統合先のクラスタid
+        """
+        geometry = farmland.geometry.to_numpy()
+        sindex = farmland.sindex
+        labels = np.asarray(labels)
+        cluster_ids = np.unique(labels)
+        if len(cluster_ids) <= 1:
+            return
+
+        # クラスタごとの面積と農地
+        areas = dict(zip(cluster_ids, np.bincount(np.searchsorted(cluster_ids, labels), weights=shapely.area(geometry))))
+        members = {c: list(rows) for c, rows in pd.Series(np.arange(len(labels))).groupby(labels).indices.items()}
+
+        # 統合先のクラスタ（統合されていないクラスタは自分自身）
+        parent = {c: c for c in cluster_ids}
+
+        def find(c):
+            while parent[c] != c:
+                parent[c] = parent[parent[c]]
+                c = parent[c]
+            return c
+
+        # 隣接するクラスタとの距離と、表にすべてのクラスタが含まれている距離
+        neighbors = {c: {} for c in cluster_ids}
+        reach = {c: radius for c in cluster_ids}
+
+        def cluster_roots(rows):
+            ids, inverse = np.unique(labels[rows], return_inverse=True)
+            return np.array([find(c) for c in ids], dtype=labels.dtype)[inverse]
+
+        def connect(rows_a, rows_b):
+            # 農地の組を現在のクラスタの組に置き換え、異なるクラスタの組だけ距離を求める
+            a = cluster_roots(rows_a)
+            b = cluster_roots(rows_b)
+            other = a != b
+            pairs = pd.DataFrame({
+                "a": a[other],
+                "b": b[other],
+                "distance": shapely.distance(geometry[rows_a[other]], geometry[rows_b[other]])
+            }).groupby(["a", "b"], sort=False)["distance"].min()
+            for (a, b), distance in pairs.items():
+                if distance < neighbors[a].get(b, np.inf):
+                    neighbors[a][b] = distance
+                    neighbors[b][a] = distance
+
+        source, target = sindex.query(geometry, predicate="dwithin", distance=radius)
+        connect(source, target)
+
+        heap = [(areas[c], c) for c in cluster_ids]
+        heapq.heapify(heap)
+        count = len(cluster_ids)
+        while count > 1:
+            area, smallest = heapq.heappop(heap)
+            if parent[smallest] != smallest or area != areas[smallest]:
+                continue  # 統合済み、または面積が更新されたクラスタ
+
+            # 表の中で最も近いクラスタが表の完全な距離より遠い場合は、表に無いクラスタの方が近い可能性があるため、
+            # 探索範囲を広げて求め直す（クラスタの凸包の近くにある他のクラスタの農地だけを候補とする）
+            rows = None
+            while not neighbors[smallest] or min(neighbors[smallest].values()) > reach[smallest]:
+                if rows is None:
+                    rows = np.asarray(members[smallest])
+                    hull = shapely.convex_hull(shapely.geometrycollections(geometry[rows]))
+                search_radius = max(reach[smallest], 1.0) * 2
+                candidates = sindex.query(hull, predicate="dwithin", distance=search_radius)
+                candidates = candidates[cluster_roots(candidates) != smallest]
+                if len(candidates):
+                    source, target = shapely.STRtree(geometry[candidates]).query(
+                        geometry[rows], predicate="dwithin", distance=search_radius)
+                    connect(rows[source], candidates[target])
+                reach[smallest] = search_radius
+
+            nearest = min(neighbors[smallest].items(), key=lambda item: (item[1], item[0]))[0]
+
+            # smallest を nearest に統合する
+            parent[smallest] = nearest
+            members[nearest].extend(members.pop(smallest))
+            areas[nearest] += areas.pop(smallest)
+            reach[nearest] = min(reach[nearest], reach.pop(smallest))
+            for c, distance in neighbors.pop(smallest).items():
+                del neighbors[c][smallest]
+                if c != nearest and distance < neighbors[nearest].get(c, np.inf):
+                    neighbors[nearest][c] = distance
+                    neighbors[c][nearest] = distance
+            heapq.heappush(heap, (areas[nearest], nearest))
+            count -= 1
+            yield smallest, nearest
+
+    def split_clusters(
+        self,
+        farmland: gpd.GeoDataFrame,
+        labels: np.ndarray,
+        target_n: int,
+        centroids: np.ndarray
+    ) -> np.ndarray:
+        """最も面積の大きいクラスタを二分することを、クラスタ数が target_n になるまで繰り返す
+
+        Args:
+            farmland (gpd.GeoDataFrame): 農地データ（投影座標系）
+            labels (np.ndarray): 農地ごとのクラスタid
+            target_n (int): クラスタ数
+            centroids (np.ndarray): 農地の重心の座標 (n, 2)
 
-        # クラスタidを振り直す
-        cluster_id_map = {k: i for i, k in enumerate(farmland["cluster"].unique())}
-        farmland["cluster"] = farmland["cluster"].map(cluster_id_map)
-        grouped = grouped.reset_index(drop=True)
-        return farmland, grouped
+        Returns:
+            np.ndarray: 分割後の農地ごとのクラスタid（分割したクラスタの片方には新しいidを振る）
+        """
+        labels = np.array(labels)
+        split_count = target_n - len(np.unique(labels))
+        if split_count <= 0:
+            return labels
+        if target_n > len(labels):
+            logger.info("農地の数（%d）が区画数（%d）より少ないため、区画数を農地の数にします", len(labels), target_n)
+        splits = itertools.islice(self.split_steps(farmland, labels, centroids), split_count)
+        return _apply_splits(labels, splits)
+
+    def split_steps(
+        self,
+        farmland: gpd.GeoDataFrame,
+        labels: np.ndarray,
+        centroids: np.ndarray
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """最も面積の大きいクラスタを二分し、（新しいクラスタid, 新しいクラスタに移した農地の位置）を順に返す
+
+        クラスタの農地を重心の広がりが大きい方の軸に沿って並べ、面積の累積が半分になる位置で二つに分ける。
+        農地を分割することはないため、すべてのクラスタの農地が一つになった時点で終わる。
+        分割の順序はクラスタ数に依存しないため、取り出す数を変えれば任意のクラスタ数の結果が得られる。
+
+        Args:
+            farmland (gpd.GeoDataFrame): 農地データ（投影座標系）
+            labels (np.ndarray): 農地ごとのクラスタid
+            centroids (np.ndarray): 農地の重心の座標 (n, 2)
+
+        Yields:
+            Tuple[int, np.ndarray]: 新しいクラスタid、新しいクラスタに移した農地の位置
+        """
+        labels = np.asarray(labels)
+        cluster_ids = np.unique(labels)
+        if len(cluster_ids) == 0:
+            return
+
+        parcel_areas = shapely.area(farmland.geometry.to_numpy())
+        members = {c: rows for c, rows in pd.Series(np.arange(len(labels))).groupby(labels).indices.items()}
+        heap = [(-parcel_areas[rows].sum(), c) for c, rows in members.items()]
+        heapq.heapify(heap)
+        next_id = cluster_ids.max() + 1
+        while heap:
+            _, largest = heapq.heappop(heap)
+            rows = members[largest]
+            if len(rows) < 2:
+                continue  # 農地が一つのクラスタは分割できない
+
+            # 広がりが大きい方の軸に沿って並べ、面積の累積が半分に最も近い位置で分ける
+            points = centroids[rows]
+            axis = np.argmax(points.max(axis=0) - points.min(axis=0))
+            order = rows[np.argsort(points[:, axis], kind="stable")]
+            cumulative = np.cumsum(parcel_areas[order])
+            split = np.searchsorted(cumulative, cumulative[-1] / 2)
+            if split > 0 and cumulative[-1] / 2 - cumulative[split - 1] < cumulative[split] - cumulative[-1] / 2:
+                split -= 1
+            split = min(max(split + 1, 1), len(order) - 1)
+
+            members[largest], members[next_id] = order[:split], order[split:]
+            for c in (largest, next_id):
+                heapq.heappush(heap, (-parcel_areas[members[c]].sum(), c))
+            yield next_id, members[next_id]
+            next_id += 1
+
+
+class _PartitionHierarchy:
+    """区画化の階層（デンドログラム）
+
+    _PartitionModel の統合・分割は区画数に関係なく同じ順序で進み、区画数に達した時点で止まる。
+    DBSCAN のクラスタがすべて一つになるまでの統合の順序と、分割の順序を記録しておけば、
+    任意の区画数の結果を、記録の先頭から必要な数だけ適用して求められる（_PartitionModel の結果と一致する）。
+    分割の記録は、要求された区画数の分だけ延ばし、ファイルから読み込んだ（保存した）階層の場合は保存し直す。
+    """
+
+    def __init__(
+        self,
+        base_labels: np.ndarray,
+        merges: np.ndarray,
+        splits: Optional[List[Tuple[int, np.ndarray]]] = None,
+        split_done: bool = False
+    ):
+        self.base_labels = base_labels  # DBSCAN の農地ごとのクラスタid
+        self.merges = merges  # (統合したクラスタid, 統合先のクラスタid) の配列
+        self.splits = splits or []  # (新しいクラスタid, 移した農地の位置) のリスト
+        self.split_done = split_done  # これ以上分割できないか
+        self.base_n = len(np.unique(base_labels))
+        self.path: Optional[str] = None  # 保存先のファイル（save / load で設定する）
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, gdf: gpd.GeoDataFrame) -> "_PartitionHierarchy":
+        """農地をクラスタリングし、すべてのクラスタを統合するまでの順序を記録する"""
+        model = _PartitionModel(gdf, 1)
+        farmland = gdf.to_crs(epsg=6674)
+        centroids = model.centroids(farmland)
+        labels, eps_value = model.dbscan(farmland, centroids)
+        merges = np.array(list(model.merge_steps(farmland, labels, eps_value)), dtype=np.int64).reshape(-1, 2)
+        return cls(np.asarray(labels), merges)
+
+    def labels(self, partition_count: int, gdf: gpd.GeoDataFrame) -> np.ndarray:
+        """区画数 partition_count の農地ごとのクラスタid（0, 1, ... と振り直したもの）を求める
+
+        Args:
+            partition_count (int): 区画数
+            gdf (gpd.GeoDataFrame): 農地データ（分割の記録を延ばす場合に使う）
+        """
+        if partition_count <= self.base_n:
+            labels = _apply_merges(self.base_labels, self.merges[:self.base_n - partition_count])
+        else:
+            if partition_count > len(self.base_labels):
+                logger.info("農地の数（%d）が区画数（%d）より少ないため、区画数を農地の数にします", len(self.base_labels), partition_count)
+            split_count = partition_count - self.base_n
+            self._extend_splits(split_count, gdf)
+            labels = _apply_splits(self.base_labels, self.splits[:split_count])
+        return np.searchsorted(np.unique(labels), labels)
+
+    def save(self, path: str) -> None:
+        """階層をファイル（.npz）に保存する"""
+        split_rows = [rows for _, rows in self.splits]
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                base_labels=self.base_labels,
+                merges=self.merges,
+                split_ids=np.array([c for c, _ in self.splits], dtype=np.int64),
+                split_offsets=np.cumsum([0] + [len(rows) for rows in split_rows]),
+                split_rows=np.concatenate(split_rows) if split_rows else np.array([], dtype=np.int64),
+                split_done=self.split_done
+            )
+        os.replace(tmp_path, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str) -> "_PartitionHierarchy":
+        """ファイルから階層を読み込む"""
+        with np.load(path) as data:
+            offsets = data["split_offsets"]
+            splits = [(int(c), data["split_rows"][start:end])
+                      for c, start, end in zip(data["split_ids"], offsets[:-1], offsets[1:])]
+            hierarchy = cls(data["base_labels"], data["merges"], splits, bool(data["split_done"]))
+        hierarchy.path = path
+        return hierarchy
+
+    def _extend_splits(self, split_count: int, gdf: gpd.GeoDataFrame) -> None:
+        """分割の記録を split_count 個まで延ばす（記録済みの分割は計算し直して読み飛ばす）
+
+        保存先がある場合は、延ばした記録を他のプロセスでも使えるように保存し直す。
+        """
+        with self._lock:
+            if len(self.splits) >= split_count or self.split_done:
+                return
+            model = _PartitionModel(gdf, split_count)
+            farmland = gdf.to_crs(epsg=6674)
+            steps = model.split_steps(farmland, self.base_labels, model.centroids(farmland))
+            self.splits = list(itertools.islice(steps, split_count))
+            self.split_done = len(self.splits) < split_count
+            if self.path is not None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.save(self.path)
+                evict_lru(os.path.dirname(self.path), MAX_PARTITION_CACHE_BYTES)
 
 # 直接実行された時は、テストデータを使って動作確認
 if __name__ == "__main__":
     import json
-    with open("../../notebooks/data/geojson_filtered_by_settlement/筑地.geojson") as f:
-        geojson_data = json.load(f)
+    from functions.parcel_store import read_geojson, write_geojson
+    geojson_data = read_geojson("../../notebooks/data/geojson_filtered_by_settlement/筑地.geojson")
     scenario = Scenario(
         ta_farmer_N=6,
         hata_farmer_N=3,
@@ -534,22 +2056,9 @@ if __name__ == "__main__":
             "2dacba93d45b0f46a25b29b985bd90e2": 1
         }
     )
-    test_reorganized_geojson, result = reorganize(geojson_data, scenario)
+    test_reorganized_gdf, result = reorganize(geojson_data, scenario)
     # 新しいGeoJSONを保存
-    new_geojson_data = {
-        "type": "FeatureCollection",
-        "name": "reorganized_geojson",
-        "crs": {
-            "type": "name",
-            "properties": {
-                "name": "urn:ogc:def:crs:OGC:1.3:CRS84"
-            }
-        },
-        "features": test_reorganized_geojson["features"]
-    }
-
-    with open("test_reorganized.geojson", "w") as f:
-        json.dump(new_geojson_data, f, ensure_ascii=False)
+    write_geojson(test_reorganized_gdf, "test_reorganized.geojson", name="reorganized_geojson")
 
     print("最適化前のリソースシミュレーション結果:")
     print(json.dumps(result.__dict__, indent=2, ensure_ascii=False))
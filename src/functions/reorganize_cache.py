@@ -0,0 +1,261 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import geopandas as gpd
+
+from functions.cost_analyzer import AnalysisResult
+from functions.disk_cache import evict_lru, touch
+from functions.map_history import row_hashes
+from functions.parcel_store import REF_DIR, encode_nested, from_geojson
+from functions.reorganize import Scenario, reorganize, reorganize_incremental
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(REF_DIR, 'cache', 'reorganize')
+
+# キャッシュの合計サイズの上限（超えた分は使われていない順に削除する）
+MAX_CACHE_BYTES = 256 << 20
+
+# 再編成の処理を変更した場合に上げる（キーに含めるため、以前の結果は使われなくなる）
+CACHE_VERSION = 3
+
+_SOURCE_FILE = "source.json"
+
+
+class ReorganizeCache:
+    """再編成結果のディスクキャッシュ（LRU）
+
+    キーは入力の農地の内容のハッシュ（農地ごとの row_hashes）と、正規化したシナリオのハッシュから作る。
+    同じ地図・同じシナリオで再編成を依頼された場合は、保存した結果をそのまま返す。
+    最後に使われた時刻はファイルの更新時刻で管理し、合計サイズが max_bytes を超えたら古い順に削除する。
+    元データが変わった場合（source が変わった場合）はすべて削除する。
+    同じ農地の別のシナリオの結果（find_base）は、シナリオを変更したときの差分の再編成に使う。
+
+    ディレクトリ構成:
+        <key>.parquet  再編成後の農地
+        <key>.json     コスト分析結果、農地のハッシュ、シナリオ（書き込みの最後に作成する）
+        source.json    キャッシュを作成した元データ
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def parcels_key(self, parcels: gpd.GeoDataFrame) -> str:
+        """入力の農地の内容のハッシュを求める
+
+        Args:
+            parcels (gpd.GeoDataFrame): 再編成対象の農地データ
+
+        Returns:
+            str: 農地のハッシュ
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        ids, hashes = row_hashes(encode_nested(parcels))
+        for parcel_id, row_hash in zip(ids, hashes):
+            digest.update(f"{parcel_id}\x1f{row_hash}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def key(self, parcels_key: str, scenario: Scenario) -> str:
+        """農地のハッシュとシナリオからキーを作る
+
+        Args:
+            parcels_key (str): 農地のハッシュ（parcels_key の返り値）
+            scenario (Scenario): 再編成のシナリオ
+
+        Returns:
+            str: キー
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"v{CACHE_VERSION}\n{parcels_key}\n".encode("utf-8"))
+        digest.update(_normalize_scenario(scenario).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[gpd.GeoDataFrame, AnalysisResult]]:
+        """保存した再編成結果を返す（無い場合はNone）"""
+        meta_path, plan_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            gdf = gpd.read_parquet(plan_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # 使われた時刻を記録する
+        touch((meta_path, plan_path))
+        return gdf, AnalysisResult(**meta["result"])
+
+    def find_base(self, parcels_key: str) -> Optional[Tuple[str, Scenario]]:
+        """同じ農地の再編成結果のうち、最後に使われたもののキーとシナリオを返す（無い場合はNone）"""
+        latest = None
+        for key in self._keys():
+            meta_path, _ = self._paths(key)
+            try:
+                mtime = os.stat(meta_path).st_mtime
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if meta.get("parcels") == parcels_key and (latest is None or mtime > latest[0]):
+                latest = (mtime, key, Scenario(**meta["scenario"]))
+        return latest[1:] if latest is not None else None
+
+    def put(
+        self,
+        key: str,
+        gdf: gpd.GeoDataFrame,
+        result: AnalysisResult,
+        parcels_key: Optional[str] = None,
+        scenario: Optional[Scenario] = None
+    ) -> None:
+        """再編成結果を保存する（農地のハッシュとシナリオは find_base で使う）"""
+        meta_path, plan_path = self._paths(key)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+
+        encode_nested(gdf).to_parquet(plan_path + tmp_suffix)
+        os.replace(plan_path + tmp_suffix, plan_path)
+        with open(meta_path + tmp_suffix, 'w', encoding='utf-8') as f:
+            json.dump({
+                "result": _result_to_dict(result),
+                "parcels": parcels_key,
+                "scenario": asdict(scenario) if scenario is not None else None
+            }, f, ensure_ascii=False)
+        os.replace(meta_path + tmp_suffix, meta_path)
+        self._evict()
+
+    def check_source(self, source: Any) -> None:
+        """元データが変わっていた場合はキャッシュをすべて削除する
+
+        Args:
+            source (Any): 元データを識別する値（JSONに変換できる値）
+        """
+        path = os.path.join(self.root, _SOURCE_FILE)
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    current = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                current = None
+            if current == source:
+                return
+            if current is not None:
+                logger.info("元データが変更されたため、再編成結果のキャッシュを削除します")
+            self.clear()
+            os.makedirs(self.root, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(source, f)
+
+    def clear(self) -> None:
+        """キャッシュをすべて削除する"""
+        for key in self._keys():
+            self._remove(key)
+
+    # ================
+    # 内部処理
+    # ================
+    def _paths(self, key: str) -> Tuple[str, str]:
+        return os.path.join(self.root, f"{key}.json"), os.path.join(self.root, f"{key}.parquet")
+
+    def _keys(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return [name[:-len(".json")] for name in os.listdir(self.root)
+                if name.endswith(".json") and name != _SOURCE_FILE]
+
+    def _remove(self, key: str) -> None:
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> None:
+        """合計サイズが上限を超えた分を、使われていない順に削除する"""
+        with self._lock:
+            evict_lru(self.root, self.max_bytes, keep=(_SOURCE_FILE,))
+
+
+_cache: Optional[ReorganizeCache] = None
+
+
+def get_reorganize_cache() -> ReorganizeCache:
+    """プロセス内で共有するReorganizeCacheを取得する"""
+    global _cache
+    if _cache is None:
+        _cache = ReorganizeCache()
+    return _cache
+
+
+def cached_reorganize(
+    parcels: Union[gpd.GeoDataFrame, Dict[str, Any]],
+    scenario: Scenario,
+    source: Any = None,
+    cache: Optional[ReorganizeCache] = None,
+    incremental: bool = True
+) -> Tuple[gpd.GeoDataFrame, AnalysisResult]:
+    """キャッシュを使って農地データを再編成する
+
+    同じ農地データ・同じシナリオの結果が保存されていればそれを返す。
+    無い場合、同じ農地データの別のシナリオの結果があれば、それを元にシナリオの変更に関係する部分だけ再編成し直し
+    （reorganize_incremental）、無ければ reorganize を実行する。結果は保存する。
+
+    Args:
+        parcels (Union[gpd.GeoDataFrame, Dict]): 再編成対象の農地データ（GeoDataFrameまたはGeoJSONデータ）
+        scenario (Scenario): 再編成のシナリオ
+        source (Any, optional): 元データを識別する値（変わった場合はキャッシュを削除する）
+        cache (ReorganizeCache, optional): 使用するキャッシュ（省略時は共有のキャッシュ）
+        incremental (bool, optional): 別のシナリオの結果を元に再編成するか. Defaults to True.
+
+    Returns:
+        Tuple[gpd.GeoDataFrame, AnalysisResult]: 再編成後の農地データ、コスト分析結果
+    """
+    cache = cache or get_reorganize_cache()
+    if source is not None:
+        cache.check_source(source)
+    if not isinstance(parcels, gpd.GeoDataFrame):
+        parcels = from_geojson(parcels)
+
+    parcels_key = cache.parcels_key(parcels)
+    key = cache.key(parcels_key, scenario)
+    cached = cache.get(key)
+    if cached is not None:
+        logger.info("保存されている再編成結果を使用します")
+        return cached
+
+    base = cache.find_base(parcels_key) if incremental else None
+    previous = cache.get(base[0]) if base is not None else None
+    if previous is not None:
+        logger.info("保存されている別のシナリオの再編成結果から、変更に関係する部分だけ再編成します")
+        gdf, result = reorganize_incremental(parcels, scenario, previous[0], previous[1], base[1])
+    else:
+        gdf, result = reorganize(parcels, scenario)
+    cache.put(key, gdf, result, parcels_key, scenario)
+    return gdf, result
+
+
+def _normalize_scenario(scenario: Scenario) -> str:
+    """シナリオをJSON文字列に正規化する（数値の型・IDの型の違いを無視する）
+
+    現農家の順序は面積割合の丸めに影響するため、並べ替えずにそのまま残す。
+    """
+    values = asdict(scenario)
+    for name in ("ta_exfarmer_ids_and_rates", "hata_exfarmer_ids_and_rates"):
+        values[name] = [[str(ID), float(rate)] for ID, rate in values[name].items()]
+    for name in ("ta_farmer_N", "hata_farmer_N"):
+        values[name] = int(values[name])
+    return json.dumps(values, sort_keys=True, ensure_ascii=False)
+
+
+def _result_to_dict(result: AnalysisResult) -> Dict[str, Any]:
+    return {
+        "total_distance_reduced": float(result.total_distance_reduced),
+        "total_co2_reduced": float(result.total_co2_reduced),
+        "farmers_worktime_reduced": {k: float(v) for k, v in result.farmers_worktime_reduced.items()},
+        "farmers_fuel_cost_reduced": {k: float(v) for k, v in result.farmers_fuel_cost_reduced.items()},
+    }
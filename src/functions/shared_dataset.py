@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import shapely
+import geopandas as gpd
+
+# ジオメトリ（WKB）を格納する列名
+GEOMETRY_COLUMN = "geometry"
+
+# スキーマのメタデータに記録するキー
+_METADATA_KEY = b"parcel_dataset"
+
+
+class SharedDataset:
+    """メモリマップしたArrow IPCファイル上の読み取り専用の農地データ
+
+    ファイルは圧縮せずに書き込み、読み込み時は pa.memory_map でマップするだけで列をコピーしない。
+    同じファイルをマップしたセッションやワーカープロセスはOSのページキャッシュを共有するため、
+    利用者やワーカーが増えても常駐メモリは増えない。
+    GeoDataFrameが必要な場合は to_geodataframe で必要な行・列だけを取り出す。
+
+    pickle するとファイルのパスだけが渡され、受け取ったプロセスでは同じファイルをマップし直す。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._source = pa.memory_map(path, 'r')
+        self.table = pa.ipc.open_file(self._source).read_all()
+        metadata = json.loads(self.table.schema.metadata[_METADATA_KEY])
+        self.crs = metadata["crs"]
+        self.columns: List[str] = metadata["columns"]
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __reduce__(self):
+        return open_shared, (self.path,)
+
+    def column(self, name: str) -> np.ndarray:
+        """列をNumPy配列として返す
+
+        欠損の無い数値列はマップしたバッファをそのまま参照する（読み取り専用）。
+        """
+        column = self.table.column(name)
+        if column.null_count == 0 and column.num_chunks == 1 and pa.types.is_primitive(column.type):
+            return column.chunk(0).to_numpy(zero_copy_only=True)
+        return column.to_numpy()
+
+    def points(self) -> Tuple[np.ndarray, np.ndarray]:
+        """農地の代表点の経度・緯度（point_lng, point_lat）を返す"""
+        return self.column("point_lng"), self.column("point_lat")
+
+    def to_geodataframe(
+        self,
+        rows: Optional[np.ndarray] = None,
+        columns: Optional[Sequence[str]] = None
+    ) -> gpd.GeoDataFrame:
+        """GeoDataFrameとして取り出す
+
+        Args:
+            rows (np.ndarray, optional): 取り出す行位置（省略時は全行）
+            columns (Sequence[str], optional): 取り出す属性列（省略時は全列）
+
+        Returns:
+            gpd.GeoDataFrame: 農地データ（行番号は0から振り直す）
+        """
+        table = self.table if rows is None else self.table.take(pa.array(rows, type=pa.int64()))
+        names = [c for c in self.columns if c != GEOMETRY_COLUMN and (columns is None or c in columns)]
+        df = table.select(names).to_pandas()
+        geometry = shapely.from_wkb(table.column(GEOMETRY_COLUMN).to_numpy(zero_copy_only=False))
+        df[GEOMETRY_COLUMN] = geometry
+        order = [c for c in self.columns if c in df.columns]
+        return gpd.GeoDataFrame(df[order], geometry=GEOMETRY_COLUMN, crs=self.crs)
+
+
+def write_shared(gdf: gpd.GeoDataFrame, path: str) -> None:
+    """農地データを共有用のArrow IPCファイルに書き出す
+
+    マップ中のファイルを読んでいるプロセスに影響しないように、別名で書き込んでから置き換える。
+
+    Args:
+        gdf (gpd.GeoDataFrame): 農地データ（入れ子のプロパティはJSON文字列に変換しておくこと）
+        path (str): 出力先のパス
+    """
+    geometry_name = gdf.geometry.name
+    attributes = gdf.drop(columns=geometry_name)
+    table = pa.Table.from_pandas(attributes, preserve_index=False)
+    table = table.append_column(GEOMETRY_COLUMN, pa.array(shapely.to_wkb(gdf.geometry.to_numpy()), type=pa.binary()))
+    metadata = {
+        "crs": gdf.crs.to_string() if gdf.crs is not None else None,
+        "columns": [GEOMETRY_COLUMN if c == geometry_name else c for c in gdf.columns],
+    }
+    table = table.replace_schema_metadata({_METADATA_KEY: json.dumps(metadata).encode("utf-8")})
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+_opened: Dict[str, Tuple[Tuple[int, int], SharedDataset]] = {}
+_opened_lock = threading.Lock()
+
+
+def open_shared(path: str) -> SharedDataset:
+    """共有用のArrow IPCファイルをマップする
+
+    プロセス内では同じファイルを一度だけマップし、ファイルが置き換えられた場合のみマップし直す。
+
+    Args:
+        path (str): Arrow IPCファイルのパス
+
+    Returns:
+        SharedDataset: 農地データ
+    """
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _opened_lock:
+        cached = _opened.get(path)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, SharedDataset(path))
+            _opened[path] = cached
+        return cached[1]
+
+
+def close_shared(path: str) -> None:
+    """プロセス内で保持しているマップを破棄する（削除する一時ファイルなどに使う）
+
+    Args:
+        path (str): Arrow IPCファイルのパス
+    """
+    with _opened_lock:
+        _opened.pop(path, None)
@@ -0,0 +1,74 @@
+from typing import Any, Dict, Union
+
+import numpy as np
+import shapely
+import geopandas as gpd
+from pyproj import Transformer
+from shapely.geometry import box, shape, Point
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import transform
+
+# 距離をメートルで扱うための投影座標系（UTM 54N）
+METRIC_EPSG = 32654
+
+
+class SpatialIndex:
+    """農地ジオメトリのSTRtree
+
+    ジオメトリは投影座標系（METRIC_EPSG）で保持し、検索条件は経緯度（EPSG:4326）で受け取る。
+    返す行位置は作成元のGeoDataFrameの iloc に対応する。
+    """
+
+    def __init__(self, gdf: gpd.GeoDataFrame):
+        if gdf.crs is None:
+            gdf = gdf.set_crs(epsg=4326)
+        self._geometries = gdf.geometry.to_crs(epsg=METRIC_EPSG).to_numpy()
+        self._tree = shapely.STRtree(self._geometries)
+        self._to_metric = Transformer.from_crs(4326, METRIC_EPSG, always_xy=True)
+
+    def __len__(self) -> int:
+        return len(self._geometries)
+
+    def bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> np.ndarray:
+        """矩形範囲と交差する農地の行位置を返す
+
+        Args:
+            min_lon (float): 西端の経度
+            min_lat (float): 南端の緯度
+            max_lon (float): 東端の経度
+            max_lat (float): 北端の緯度
+
+        Returns:
+            np.ndarray: 行位置（昇順）
+        """
+        return self.polygon(box(min_lon, min_lat, max_lon, max_lat))
+
+    def radius(self, lon: float, lat: float, radius_m: float) -> np.ndarray:
+        """指定地点から radius_m メートル以内にある農地の行位置を返す
+
+        Args:
+            lon (float): 経度
+            lat (float): 緯度
+            radius_m (float): 半径（m）
+
+        Returns:
+            np.ndarray: 行位置（昇順）
+        """
+        center = transform(self._to_metric.transform, Point(lon, lat))
+        return np.sort(self._tree.query(center, predicate="dwithin", distance=radius_m))
+
+    def polygon(self, geometry: Union[Dict[str, Any], BaseGeometry]) -> np.ndarray:
+        """ポリゴン（GeoJSONのgeometryまたはshapelyのジオメトリ）と交差する農地の行位置を返す
+
+        Args:
+            geometry (Union[Dict, BaseGeometry]): 経緯度のポリゴン
+
+        Returns:
+            np.ndarray: 行位置（昇順）
+        """
+        if isinstance(geometry, dict):
+            geometry = shape(geometry)
+        # 投影後も辺の形が保たれるように細分化してから変換する
+        geometry = transform(self._to_metric.transform, shapely.segmentize(geometry, 0.001))
+        return np.sort(self._tree.query(geometry, predicate="intersects"))
+
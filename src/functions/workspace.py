@@ -0,0 +1,286 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import geopandas as gpd
+
+from functions.map_history import MapHistory, undo_target
+from functions.parcel_index import ParcelIndex
+from functions.parcel_store import ParcelStore, get_parcel_store, encode_nested, ROW_LAYER, VERSIONED_LAYERS
+from functions.spatial_index import SpatialIndex
+
+# メモリ上に最新版を保持するセッションの作業領域の数（超えた分は使われていない順にメモリから外す）
+MAX_ACTIVE_WORKSPACES = 16
+
+# 作業領域の版は、共有の履歴の中の workspaces/<作業領域ID>/<レイヤー名> に記録する
+_WORKSPACE_PREFIX = "workspaces"
+
+
+class Workspace:
+    """セッションごとの作業領域
+
+    フィルタリング後の地図・再編成後の地図の版を、共有の履歴の workspaces/<作業領域ID>/<レイヤー名> に記録する。
+    履歴には変更された農地だけが書き込まれ、内容は元データや他の作業領域と共有される。
+    メモリ上にはレイヤーごとに最新版の農地データだけを保持し、過去の版は必要になった時に履歴から復元する。
+    元データは共有のParcelStoreから読み込み、作業領域ごとには複製しない。
+    地図は空の状態から始め、検索（フィルタリング）で読み込んだ分割の農地だけを保持する。
+    ParcelStoreと同じ load / save / update / restore の操作で使える。
+    Streamlitでは同じセッションのスクリプトが複数のスレッドで実行されるため、操作は作業領域ごとのロックで排他する。
+    """
+
+    def __init__(self, workspace_id: str, store: ParcelStore):
+        self.workspace_id = workspace_id
+        self.store = store
+        # レイヤー → (版番号, 最新版の農地データ)
+        self._heads: Dict[str, Tuple[int, gpd.GeoDataFrame]] = {}
+        self._indexes: Dict[Tuple[str, type], Tuple[int, Any]] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def history(self) -> MapHistory:
+        return self.store.history
+
+    def head(self, layer: str) -> int:
+        """最新の版番号を返す（版が無い場合は0）"""
+        return self.history.head(self._history_layer(layer))
+
+    def load(self, layer: str, partitions: Optional[Sequence[str]] = None) -> gpd.GeoDataFrame:
+        """レイヤーを読み込む
+
+        返り値は共有されるため、変更する場合は copy() してから行うこと。
+
+        Args:
+            layer (str): レイヤー名
+            partitions (Sequence[str], optional): 元データの場合、読み込む分割ID
+
+        Returns:
+            gpd.GeoDataFrame: 農地データ
+        """
+        if layer not in VERSIONED_LAYERS:
+            return self.store.load(layer, partitions)
+        with self._lock:
+            head = self.head(layer)
+            if head == 0:
+                # 最初は空の地図（元データ全体は読み込まない）
+                return _empty_layer()
+            cached = self._heads.get(layer)
+            if cached is None or cached[0] != head:
+                cached = (head, self.history.checkout(self._history_layer(layer)))
+                self._heads[layer] = cached
+            return cached[1]
+
+    def load_index(self, layer: str, partitions: Optional[Sequence[str]] = None) -> ParcelIndex:
+        """レイヤーの属性インデックスを取得する"""
+        if layer not in VERSIONED_LAYERS:
+            return self.store.load_index(layer, partitions)
+        return self._load_derived(layer, ParcelIndex)
+
+    def load_spatial_index(self, layer: str, partitions: Optional[Sequence[str]] = None) -> SpatialIndex:
+        """レイヤーの空間インデックスを取得する"""
+        if layer not in VERSIONED_LAYERS:
+            return self.store.load_spatial_index(layer, partitions)
+        return self._load_derived(layer, SpatialIndex)
+
+    def select_partitions(self, layer: str = ROW_LAYER, **conditions: Any) -> Optional[Tuple[str, ...]]:
+        """条件に関係する元データの分割IDを返す（ParcelStore.select_partitions と同じ）"""
+        return self.store.select_partitions(layer, **conditions)
+
+    def save(self, layer: str, gdf: gpd.GeoDataFrame, message: str = "") -> int:
+        """レイヤーの新しい版を作成する
+
+        最新版と比較して内容が変わった農地と削除された農地だけを履歴に記録する。
+
+        Args:
+            layer (str): レイヤー名
+            gdf (gpd.GeoDataFrame): 保存する農地データ
+            message (str, optional): 版の説明
+
+        Returns:
+            int: 版番号（変更が無い場合は最新の版番号）
+        """
+        self._check_layer(layer)
+        gdf = encode_nested(gdf)
+        with self._lock:
+            version = self.history.commit(self._history_layer(layer), gdf, message)
+            self._heads[layer] = (version, gdf)
+            return version
+
+    def update(self, layer: str, gdf: gpd.GeoDataFrame, changed: np.ndarray, message: str = "") -> int:
+        """レイヤーの一部の農地を更新する
+
+        変更された農地だけを履歴に書き込むため、入出力は変更数に比例する。
+
+        Args:
+            layer (str): レイヤー名
+            gdf (gpd.GeoDataFrame): 更新後のレイヤー全体（load の返り値を copy して変更したもの）
+            changed (np.ndarray): 変更された行を表す真偽値配列
+            message (str, optional): 版の説明
+
+        Returns:
+            int: 版番号
+        """
+        self._check_layer(layer)
+        with self._lock:
+            version = self.history.commit_changes(self._history_layer(layer), encode_nested(gdf[changed]), message=message)
+            self._heads[layer] = (version, gdf)
+            return version
+
+    def restore(self, layer: str, version: Optional[int] = None) -> int:
+        """レイヤーを過去の版に戻す
+
+        Args:
+            layer (str): レイヤー名
+            version (int, optional): 戻す版番号（省略時は直前の操作を取り消す）
+
+        Returns:
+            int: 新しい版番号
+        """
+        self._check_layer(layer)
+        history_layer = self._history_layer(layer)
+        with self._lock:
+            if version is None:
+                version, undone = undo_target(self.history.entries(history_layer), layer)
+                return self.history.restore(history_layer, version, message="操作を取り消し", undone=undone)
+            head = self.head(layer)
+            if version < 1 or version > head:
+                raise ValueError(f"レイヤー '{layer}' に版 {version} はありません（最新: {head}）")
+            return self.history.restore(history_layer, version)
+
+    def versions(self, layer: str) -> List[Dict[str, Any]]:
+        """版の一覧を返す"""
+        self._check_layer(layer)
+        return self.history.versions(self._history_layer(layer))
+
+    def spill(self) -> None:
+        """メモリ上の最新版とインデックスを解放する
+
+        版はすべて履歴に記録済みのため、書き込みは行わない。次に使われた時に履歴から最新版を復元する。
+        """
+        with self._lock:
+            self._heads.clear()
+            self._indexes.clear()
+            self.history.release([self._history_layer(layer) for layer in VERSIONED_LAYERS])
+
+    # ================
+    # 内部処理
+    # ================
+    def _load_derived(self, layer: str, factory: type) -> Any:
+        with self._lock:
+            gdf = self.load(layer)
+            head = self.head(layer)
+            cached = self._indexes.get((layer, factory))
+            if cached is not None and cached[0] == head:
+                return cached[1]
+            derived = factory(gdf)
+            self._indexes[(layer, factory)] = (head, derived)
+            return derived
+
+    def _history_layer(self, layer: str) -> str:
+        return f"{_WORKSPACE_PREFIX}/{self.workspace_id}/{layer}"
+
+    def _check_layer(self, layer: str) -> None:
+        if layer not in VERSIONED_LAYERS:
+            raise ValueError(f"レイヤー '{layer}' は変更できません")
+
+
+class WorkspaceManager:
+    """セッションごとの作業領域を管理する
+
+    最近使われた作業領域を max_active 個までメモリ上に保持し、
+    それを超えた場合は最も長く使われていない作業領域の最新版をメモリから外す（版は履歴に記録済み）。
+    外した作業領域は次に使われた時に履歴から読み込み直す。
+    use で使用中の作業領域は参照数を数え、使用中はメモリから外さない（上限を超えた分は使用が終わった時に外す）。
+    """
+
+    def __init__(self, store: Optional[ParcelStore] = None, max_active: int = MAX_ACTIVE_WORKSPACES):
+        self.store = store or get_parcel_store()
+        self.max_active = max_active
+        self._active: "OrderedDict[str, Workspace]" = OrderedDict()
+        self._in_use: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def use(self, workspace_id: str) -> Iterator[Workspace]:
+        """作業領域を使用する（with の間はメモリから外されない）
+
+        Args:
+            workspace_id (str): 作業領域ID（セッションID）
+
+        Yields:
+            Workspace: 作業領域
+        """
+        with self._lock:
+            workspace = self._activate(workspace_id)
+            self._in_use[workspace_id] = self._in_use.get(workspace_id, 0) + 1
+        try:
+            yield workspace
+        finally:
+            with self._lock:
+                self._in_use[workspace_id] -= 1
+                if not self._in_use[workspace_id]:
+                    del self._in_use[workspace_id]
+                self._evict()
+
+    def get(self, workspace_id: str) -> Workspace:
+        """作業領域を取得する（無い場合は作成する）
+
+        返り値を保持している間に他の作業領域が使われるとメモリから外される可能性があるため、
+        操作の間保持する場合は use を使うこと。
+
+        Args:
+            workspace_id (str): 作業領域ID（セッションID）
+
+        Returns:
+            Workspace: 作業領域
+        """
+        with self._lock:
+            workspace = self._activate(workspace_id)
+            self._evict(keep=workspace_id)
+            return workspace
+
+    def spill_all(self) -> None:
+        """すべての作業領域をメモリから外す（終了時など）"""
+        with self._lock:
+            while self._active:
+                _, workspace = self._active.popitem(last=False)
+                workspace.spill()
+
+    def _activate(self, workspace_id: str) -> Workspace:
+        """作業領域をメモリ上に用意し、最近使われたものにする"""
+        workspace = self._active.get(workspace_id)
+        if workspace is None:
+            workspace = Workspace(workspace_id, self.store)
+            self._active[workspace_id] = workspace
+        self._active.move_to_end(workspace_id)
+        return workspace
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """上限を超えた分を、使用中でないものから使われていない順にメモリから外す（keep は外さない）"""
+        excess = len(self._active) - self.max_active
+        for workspace_id in list(self._active):
+            if excess <= 0:
+                break
+            if workspace_id in self._in_use or workspace_id == keep:
+                continue
+            self._active.pop(workspace_id).spill()
+            excess -= 1
+
+
+_manager: Optional[WorkspaceManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_workspace_manager() -> WorkspaceManager:
+    """プロセス内で共有するWorkspaceManagerを取得する"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = WorkspaceManager()
+    return _manager
+
+
+def _empty_layer() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(columns=["geometry"], geometry="geometry", crs="EPSG:4326")
+
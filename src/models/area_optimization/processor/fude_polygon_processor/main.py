@@ -1,57 +1,66 @@
 import os
-import json
 import geopandas as gpd
 import pandas as pd
 from shapely.geometry import shape
 from shapely.ops import unary_union
+from typing import Iterator
+
+from functions.geojson_stream import GeoJSONReader, GeoJSONWriter
+from functions.parcel_store import iter_geojson_features
 
 class FudePolygonProcessor:
-    def __init__(self, input_file: str, output_file: str):
+    def __init__(self, input_file: str, output_file: str, chunk_size: int = 10000):
         """
         筆ポリゴンの前処理クラス（JSON形式対応）
 
         Args:
             input_file (str): 入力JSON（GeoJSONまたは通常のJSON）
             output_file (str): 処理後の出力ファイル（GeoJSON）
+            chunk_size (int, optional): process で一度に読み込む筆ポリゴンの数
         """
         self.input_file = input_file
         self.output_file = output_file
+        self.chunk_size = chunk_size
         self.gdf = None
 
-    def load_data(self):
-        """JSONデータをGeoDataFrameに変換"""
-        print("📥 データを読み込み中...")
+    # 通常のJSON（GeoJSON構造）から取り出す属性
+    PLAIN_JSON_COLUMNS = [
+        "polygon_uuid", "land_type", "issue_year", "edit_year", "history",
+        "last_polygon_uuid", "prev_last_polygon_uuid", "local_government_cd", "point_lng", "point_lat",
+    ]
+
+    def read_chunks(self) -> Iterator[gpd.GeoDataFrame]:
+        """入力JSONを chunk_size 件ずつGeoDataFrameとして読み込む
 
-        try:
-            # GeoJSONとして直接読み込む
-            self.gdf = gpd.read_file(self.input_file)
-            print("✅ GeoJSONデータを読み込みました")
-        except:
-            # 通常のJSONの場合
-            with open(self.input_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            # GeoJSON形式の場合
-            if "features" in data:
-                features = data["features"]
+        GeoJSON（type が FeatureCollection）の場合はファイルの crs（無ければEPSG:4326）とし、
+        通常のJSON（GeoJSON構造）の場合は PLAIN_JSON_COLUMNS の属性だけを取り出してEPSG:6668とする。
+
+        Yields:
+            gpd.GeoDataFrame: 筆ポリゴン
+        """
+        with GeoJSONReader(self.input_file) as reader:
+            if reader.header.get("type") == "FeatureCollection":
+                crs = reader.crs or "EPSG:4326"
+                for features in reader.chunks(self.chunk_size):
+                    yield gpd.GeoDataFrame.from_features(features, crs=crs)
+                return
+
+            for features in reader.chunks(self.chunk_size):
                 df = pd.DataFrame([{
-                    "polygon_uuid": feature["properties"].get("polygon_uuid"),
-                    "land_type": feature["properties"].get("land_type"),
-                    "issue_year": feature["properties"].get("issue_year"),
-                    "edit_year": feature["properties"].get("edit_year"),
-                    "history": feature["properties"].get("history"),
-                    "last_polygon_uuid": feature["properties"].get("last_polygon_uuid"),
-                    "prev_last_polygon_uuid": feature["properties"].get("prev_last_polygon_uuid"),
-                    "local_government_cd": feature["properties"].get("local_government_cd"),
-                    "point_lng": feature["properties"].get("point_lng"),
-                    "point_lat": feature["properties"].get("point_lat"),
+                    **{col: feature["properties"].get(col) for col in self.PLAIN_JSON_COLUMNS},
                     "geometry": shape(feature["geometry"])  # ShapelyのPolygonに変換
                 } for feature in features])
+                yield gpd.GeoDataFrame(df, geometry="geometry", crs="EPSG:6668")
 
-                self.gdf = gpd.GeoDataFrame(df, geometry="geometry", crs="EPSG:6668")
-                print("✅ 通常JSON（GeoJSON構造）を変換しました")
-            else:
-                raise ValueError("❌ 不明なJSONフォーマットです")
+    def load_data(self):
+        """JSONデータをGeoDataFrameに変換"""
+        print("📥 データを読み込み中...")
+        chunks = list(self.read_chunks())
+        if chunks:
+            self.gdf = gpd.GeoDataFrame(pd.concat(chunks, ignore_index=True), crs=chunks[0].crs)
+        else:
+            self.gdf = gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+        print("✅ データを読み込みました")
 
     def filter_land_use(self):
         """田・畑以外の地目データを削除"""
@@ -93,14 +102,30 @@ class FudePolygonProcessor:
         self.gdf.to_file(self.output_file, driver="GeoJSON")
         print("✅ 前処理完了！ファイルを保存しました:", self.output_file)
 
-    def process(self):
-        """一連の処理を実行"""
-        self.load_data()
-        self.remove_small_polygons()
-        self.save_data()
-
-# 実行例
-input_path = "../../data/raw/fude_polygon/2024_08/2024_082015.json"
-output_path = "../../data/processed/fude_polygon/processed_fude_polygon.geojson"
-processor = FudePolygonProcessor(input_path, output_path)
-processor.process()
+    def process(self, filter_land_use: bool = False):
+        """一連の処理を実行
+
+        筆ポリゴンを chunk_size 件ずつ読み込んで処理し、そのまま書き出すため、
+        メモリ使用量は入力ファイルの大きさによらない。
+
+        Args:
+            filter_land_use (bool, optional): 田・畑以外の地目データも削除するか
+        """
+        print("📥 データを読み込み中...")
+        with GeoJSONWriter(self.output_file) as writer:
+            for chunk in self.read_chunks():
+                self.gdf = chunk
+                if filter_land_use:
+                    self.filter_land_use()
+                self.remove_small_polygons()
+                # 出力はGeoJSONの標準に合わせて経緯度に戻す
+                writer.write(iter_geojson_features(self.gdf))
+        print("✅ 前処理完了！ファイルを保存しました:", self.output_file)
+
+# 実行例（src ディレクトリで python -m models.area_optimization.processor.fude_polygon_processor.main）
+if __name__ == "__main__":
+    data_dir = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+    input_path = os.path.join(data_dir, "raw/fude_polygon/2024_08/2024_082015.json")
+    output_path = os.path.join(data_dir, "processed/fude_polygon/processed_fude_polygon.geojson")
+    processor = FudePolygonProcessor(input_path, output_path)
+    processor.process()
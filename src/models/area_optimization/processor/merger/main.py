@@ -1,6 +1,11 @@
+import os
 import geopandas as gpd
+import pandas as pd
 from shapely.geometry import Point, shape
 
+from functions.geojson_stream import GeoJSONWriter
+from functions.parcel_store import read_geojson_chunks, iter_geojson_features
+
 def merge_farm_properties(farm_features):
     """
     複数の農地ピンのプロパティをマージします。
@@ -21,55 +26,54 @@ def merge_farm_properties(farm_features):
             merged[col] = unique_vals[0] if len(unique_vals) == 1 else ", ".join(unique_vals)
     return merged
 
-def merge_farm_polygon(farm_filepath, polygon_filepath, output_filepath):
+def merge_farm_polygon(farm_filepath, polygon_filepath, output_filepath, chunk_size=10000):
     """
     農地ピン（Point）と筆ポリゴン（Polygon）を読み込み、
     各筆ポリゴン内に含まれる農地ピンの属性をすべて統合して結合しGeoJSONとして出力します。
     1:1 の対応となるよう、農地ピンが複数の場合はその属性情報をマージします。
+    筆ポリゴンは chunk_size 件ずつ読み込んで結合し、そのまま書き出します。
     """
-    # 農地ピンのGeoJSONを読み込む
-    farm_gdf = gpd.read_file(farm_filepath)
-    
-    # 筆ポリゴンのGeoJSONを読み込む
-    polygon_gdf = gpd.read_file(polygon_filepath)
-    
-    # 座標参照系（CRS）の統一（EPSG:4326）
-    if farm_gdf.crs != 'EPSG:4326':
-        farm_gdf = farm_gdf.to_crs('EPSG:4326')
-    if polygon_gdf.crs != 'EPSG:4326':
-        polygon_gdf = polygon_gdf.to_crs('EPSG:4326')
-    
-    merged_features = []
-    
-    for _, poly in polygon_gdf.iterrows():
-        # 筆ポリゴン内にある農地ピンを抽出
-        within_poly = farm_gdf[farm_gdf.within(poly.geometry)]
-        poly_properties = poly.copy()
-    
-        if not within_poly.empty:
-            # 農地ピンの件数を追加
-            poly_properties['num_farm_pins'] = len(within_poly)
-            # 農地ピンの属性をすべてマージ（geometry は除外）
-            merged_farm_props = merge_farm_properties(within_poly)
-            # マージした農地ピンの属性を筆ポリゴンの属性に結合
-            for key, value in merged_farm_props.items():
-                poly_properties[key] = value
-        else:
-            poly_properties['num_farm_pins'] = 0
+    # 農地ピンのGeoJSONを読み込む（各筆ポリゴンの検索に使うため全件を保持する）
+    farm_chunks = [chunk.to_crs('EPSG:4326') for chunk in read_geojson_chunks(farm_filepath, chunk_size, crs=None)]
+    farm_gdf = gpd.GeoDataFrame(pd.concat(farm_chunks, ignore_index=True), crs='EPSG:4326') if farm_chunks else gpd.GeoDataFrame(geometry=[], crs='EPSG:4326')
+    farm_columns = [col for col in farm_gdf.columns if col != 'geometry']
 
-        merged_features.append(poly_properties)
-    
-    # 結合結果を GeoDataFrame に変換
-    merged_gdf = gpd.GeoDataFrame(merged_features, crs='EPSG:4326')
-    
-    # GeoJSON として出力
-    merged_gdf.to_file(output_filepath, driver='GeoJSON')
+    with GeoJSONWriter(output_filepath) as writer:
+        # 筆ポリゴンのGeoJSONを chunk_size 件ずつ読み込む
+        for polygon_gdf in read_geojson_chunks(polygon_filepath, chunk_size, crs=None):
+            # 座標参照系（CRS）の統一（EPSG:4326）
+            polygon_gdf = polygon_gdf.to_crs('EPSG:4326').reset_index(drop=True)
+
+            # 筆ポリゴン内にある農地ピンを空間インデックスでまとめて求める
+            pin_positions, poly_positions = polygon_gdf.sindex.query(farm_gdf.geometry, predicate="within")
+            pins_by_polygon = {}
+            for pin, poly in zip(pin_positions, poly_positions):
+                pins_by_polygon.setdefault(poly, []).append(pin)
+
+            merged_gdf = polygon_gdf.copy()
+            merged_gdf['num_farm_pins'] = 0
+            for col in farm_columns:
+                if col not in merged_gdf.columns:
+                    merged_gdf[col] = None
+            merged_gdf = merged_gdf.astype({col: object for col in farm_columns})
+            for poly, pins in pins_by_polygon.items():
+                within_poly = farm_gdf.iloc[sorted(pins)]
+                # 農地ピンの件数を追加
+                merged_gdf.at[poly, 'num_farm_pins'] = len(within_poly)
+                # 農地ピンの属性をすべてマージ（geometry は除外）し、筆ポリゴンの属性に結合
+                for key, value in merge_farm_properties(within_poly).items():
+                    merged_gdf.at[poly, key] = value
+
+            # GeoJSON として出力
+            writer.write(iter_geojson_features(merged_gdf))
     print("データの結合と出力が完了しました。")
 
 def main():
-    farm_filepath = '../../data/raw/eMAFF/農地ピン_20250220013122.geojson'          # 農地ピンデータのパス
-    polygon_filepath = '../../data/processed/fude_polygon/processed_fude_polygon.geojson'     # 筆ポリゴンのデータのパス
-    output_filepath = '../../data/processed/merged_polygon_with_farm_pin.geojson'
+    # src ディレクトリで python -m models.area_optimization.processor.merger.main として実行する
+    data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+    farm_filepath = os.path.join(data_dir, 'raw/eMAFF/農地ピン_20250220013122.geojson')          # 農地ピンデータのパス
+    polygon_filepath = os.path.join(data_dir, 'processed/fude_polygon/processed_fude_polygon.geojson')     # 筆ポリゴンのデータのパス
+    output_filepath = os.path.join(data_dir, 'processed/merged_polygon_with_farm_pin.geojson')
     
     merge_farm_polygon(farm_filepath, polygon_filepath, output_filepath)
 
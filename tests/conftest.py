@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# アプリと同じく src 直下のパッケージ（functions など）を読み込めるようにする
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from functions.parcel_store import read_geojson  # noqa: E402
+
+# 集落一つ分のサンプルの農地データ
+SAMPLE_PATH = os.path.join(ROOT_DIR, "notebooks", "data", "geojson_filtered_by_settlement", "筑地.geojson")
+
+
+@pytest.fixture(scope="session")
+def sample_parcels():
+    return read_geojson(SAMPLE_PATH)
+
+
+@pytest.fixture
+def parcels(sample_parcels):
+    return sample_parcels.copy()
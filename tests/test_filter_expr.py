@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from functions.filter_expr import And, Eq, In, Not, Or, Range, parse_filter
+
+FARMER_A = "2dacba93d45b0f46a25b29b985bd90e2"
+FARMER_B = "10aad9b486abee43973bb555cc3362c2"
+
+
+def _area(gdf):
+    return pd.to_numeric(gdf["AreaOnRegistry"], errors="coerce")
+
+
+def test_leaf_masks_match_pandas(parcels):
+    farmer = parcels["FarmerIndicationNumberHash"]
+
+    assert (Eq("farmer_id", FARMER_A).mask(parcels) == (farmer == FARMER_A).to_numpy()).all()
+    assert (In("farmer_id", [FARMER_A, FARMER_B]).mask(parcels) == farmer.isin([FARMER_A, FARMER_B]).to_numpy()).all()
+    # 数値列に文字列で指定しても数値として比較する
+    assert (Eq("land_type", "100").mask(parcels) == (parcels["land_type"] == 100).to_numpy()).all()
+
+    area = _area(parcels)
+    assert (Range("area", 500, 1500).mask(parcels) == ((area >= 500) & (area <= 1500)).to_numpy()).all()
+    assert (Range("area", min=1000).mask(parcels) == (area >= 1000).to_numpy()).all()
+    # 数値に変換できない面積は範囲の指定に関わらず一致しない
+    assert not Range("area").mask(parcels)[area.isna().to_numpy()].any()
+
+
+def test_boolean_combinations_match_pandas(parcels):
+    farmer = parcels["FarmerIndicationNumberHash"]
+    area = _area(parcels)
+    expr = parse_filter({"or": [
+        {"and": [{"field": "farmer_id", "in": [FARMER_A, FARMER_B]}, {"field": "area", "max": 1000}]},
+        {"not": {"field": "classification", "eq": "田"}},
+    ]})
+    expected = (farmer.isin([FARMER_A, FARMER_B]) & (area <= 1000)) | ~(parcels["ClassificationOfLandCodeName"] == "田")
+
+    assert expr == Or([
+        And([In("farmer_id", [FARMER_A, FARMER_B]), Range("area", None, 1000.0)]),
+        Not(Eq("classification", "田")),
+    ])
+    assert (expr.mask(parcels) == expected.to_numpy()).all()
+    assert 0 < expr.mask(parcels).sum() < len(parcels)
+
+    # 空の And はすべて、空の Or はどれにも一致しない
+    assert And([]).mask(parcels).all()
+    assert not Or([]).mask(parcels).any()
+
+
+def test_parse_filter_rejects_invalid_expressions(parcels):
+    for data in (["farmer_id"], {"eq": 1}, {"field": "farmer_id", "like": "x"}):
+        with pytest.raises(ValueError):
+            parse_filter(data)
+    with pytest.raises(ValueError):
+        Eq("no_such_field", 1).mask(parcels)
@@ -0,0 +1,48 @@
+import pytest
+
+from functions.fix_reorganization import apply_edits, parse_edits
+
+FARMER = "FarmerIndicationNumberHash"
+FARMER_A = "2dacba93d45b0f46a25b29b985bd90e2"
+FARMER_B = "10aad9b486abee43973bb555cc3362c2"
+
+
+def test_apply_edits_matches_row_by_row_selection(parcels):
+    original = parcels.copy()
+    addresses = original["Address"].iloc[[0, 10, 20]].tolist()
+    edits = parse_edits({"edits": [
+        {"target_address": addresses, "new_farmer_id": "new"},
+        {"farmer_id": FARMER_A, "new_farm_type": "畑"},
+        {"parcel_id": original["polygon_uuid"].iloc[[5, 6]].tolist(), "farmer_id": original[FARMER].iloc[5], "new_farmer_id": "x"},
+        # 条件の一部にしか一致しない農地は対象にしない
+        {"parcel_id": original["polygon_uuid"].iloc[5], "farmer_id": FARMER_B, "new_farmer_id": "y"},
+        {"target_address": "存在しない住所", "new_farmer_id": "z"},
+    ]})
+
+    result = apply_edits(parcels, edits)
+
+    by_address = original["Address"].isin(addresses).to_numpy()
+    by_farmer = (original[FARMER] == FARMER_A).to_numpy()
+    by_both = (
+        original["polygon_uuid"].isin(original["polygon_uuid"].iloc[[5, 6]]) & (original[FARMER] == original[FARMER].iloc[5])
+    ).to_numpy()
+    assert (result.changed == (by_address | by_farmer | by_both)).all()
+    assert result.updated_count == result.changed.sum()
+    assert result.unmatched == edits[3:]
+
+    # 対象は修正を適用する前の農家IDで決まる
+    assert (parcels.loc[by_address, FARMER] == "new").all()
+    assert (parcels.loc[by_farmer, "ClassificationOfLandCodeName"] == "畑").all()
+    assert len(result.land_type_updates) == by_farmer.sum()
+    assert (parcels.loc[~result.changed, FARMER] == original.loc[~result.changed, FARMER]).all()
+
+
+@pytest.mark.parametrize("params", [
+    {"edits": []},
+    {"new_farmer_id": "x"},
+    {"farmer_id": FARMER_A},
+    {"farmer_id": FARMER_A, "new_farm_type": "果樹"},
+])
+def test_parse_edits_rejects_invalid_params(params):
+    with pytest.raises(ValueError):
+        parse_edits(params)
@@ -0,0 +1,85 @@
+import json
+
+import pandas as pd
+import pytest
+
+from conftest import SAMPLE_PATH
+from functions.geojson_stream import GeoJSONReader, GeoJSONWriter
+from functions.parcel_store import read_geojson, read_geojson_chunks, write_geojson
+
+
+@pytest.fixture(scope="module")
+def sample_geojson():
+    with open(SAMPLE_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("read_size", [64, 4096, 1 << 20])
+def test_reader_matches_json_load(sample_geojson, read_size):
+    with GeoJSONReader(SAMPLE_PATH, read_size=read_size) as reader:
+        features = list(reader)
+        header = reader.header
+
+    assert features == sample_geojson["features"]
+    assert header == {key: value for key, value in sample_geojson.items() if key != "features"}
+
+
+def test_reader_handles_brackets_and_escapes_in_strings(tmp_path):
+    data = {
+        "type": "FeatureCollection",
+        "name": "x\"}{]",
+        "bbox": [1, [2, "]"], {"a": "["}],
+        "crs": {"type": "name", "properties": {"name": "EPSG:6668"}},
+        "features": [
+            {"type": "Feature", "properties": {"s": "a\\\"}{b\\\\", "u": "あ", "n": None, "l": [{"x": "}"}]}, "geometry": None},
+            {"type": "Feature", "properties": {"s": "\\"}, "geometry": {"type": "Point", "coordinates": [1.5, -2e-3]}},
+        ],
+    }
+    path = tmp_path / "tricky.geojson"
+    path.write_text(json.dumps(data), encoding='utf-8')
+
+    for read_size in range(1, 64):
+        with GeoJSONReader(str(path), read_size=read_size) as reader:
+            assert list(reader) == data["features"]
+            assert reader.crs == "EPSG:6668"
+
+
+@pytest.mark.parametrize("content", [
+    '{"type": "FeatureCollection"}',
+    '{"type": "FeatureCollection", "features": [{"a": 1}, {"b": ',
+    '{"type": "FeatureCollection", "features": [1, {"a": 1}]}',
+])
+def test_reader_rejects_invalid_files(tmp_path, content):
+    path = tmp_path / "invalid.geojson"
+    path.write_text(content, encoding='utf-8')
+
+    with pytest.raises(ValueError):
+        list(GeoJSONReader(str(path)))
+
+
+@pytest.mark.parametrize("chunk_size", [100, 174, 348, 1000])
+def test_write_and_read_round_trip_across_chunks(tmp_path, parcels, chunk_size):
+    path = str(tmp_path / "out.geojson")
+
+    assert write_geojson(parcels, path, name="map", chunk_size=chunk_size) == len(parcels)
+    chunks = list(read_geojson_chunks(path, chunk_size))
+    loaded = read_geojson(path, chunk_size=chunk_size)
+
+    assert [len(chunk) for chunk in chunks][:-1] == [chunk_size] * (len(chunks) - 1)
+    assert sum(len(chunk) for chunk in chunks) == len(parcels)
+    assert loaded.crs == parcels.crs
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(loaded.drop(columns="geometry")), pd.DataFrame(parcels.drop(columns="geometry"))
+    )
+    assert loaded.geometry.geom_equals_exact(parcels.geometry, tolerance=0).all()
+
+
+def test_writer_leaves_no_file_on_error(tmp_path):
+    path = tmp_path / "out.geojson"
+
+    with pytest.raises(RuntimeError):
+        with GeoJSONWriter(str(path)) as writer:
+            writer.write([{"type": "Feature", "properties": {}, "geometry": None}])
+            raise RuntimeError("失敗")
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,68 @@
+import pytest
+
+from functions.map_history import PARCEL_ID, MapHistory, row_hashes
+from functions.parcel_store import encode_nested
+
+FARMER = "FarmerIndicationNumberHash"
+
+
+@pytest.fixture
+def encoded(parcels):
+    return encode_nested(parcels)
+
+
+def _farmers(gdf):
+    return gdf.set_index(PARCEL_ID)[FARMER].sort_index()
+
+
+def test_row_hashes_are_128_bit_and_follow_content(encoded):
+    ids, hashes = row_hashes(encoded)
+
+    assert ids == encoded[PARCEL_ID].tolist()
+    assert all(len(h) == 32 for h in hashes)
+    assert len(set(hashes)) == len(encoded)
+
+    edited = encoded.copy()
+    edited.loc[edited.index[5], FARMER] = "edited"
+    edited.loc[edited.index[7], "geometry"] = edited.geometry.iloc[7].buffer(1e-6)
+    _, edited_hashes = row_hashes(edited)
+    assert [i for i, (a, b) in enumerate(zip(hashes, edited_hashes)) if a != b] == [5, 7]
+
+    # 列の型が変われば、値が同じでもハッシュは変わる
+    _, cast_hashes = row_hashes(encoded.astype({"land_type": float}))
+    assert not set(cast_hashes) & set(hashes)
+
+
+def test_map_history_checkout_and_undo_across_snapshots(tmp_path, encoded):
+    history = MapHistory(root=str(tmp_path), snapshot_interval=3)
+    states = []
+    gdf = encoded
+    for version in range(1, 8):
+        gdf = gdf.copy()
+        gdf.loc[gdf.index[version], FARMER] = f"v{version}"
+        if version == 5:
+            gdf = gdf.iloc[10:]
+        assert history.commit("map", gdf, message=f"{version}") == version
+        states.append(_farmers(gdf))
+
+    assert sorted(p.name for p in (tmp_path / "map" / "snapshots").iterdir()) == ["000001.json", "000003.json", "000006.json"]
+    # 変更の無い版は作らない
+    assert history.commit("map", gdf) == 7
+    assert history.versions("map")[1]["changed"] == 1
+
+    for version, expected in enumerate(states, start=1):
+        checked_out = _farmers(history.checkout("map", version))
+        assert checked_out.equals(expected), version
+
+    # スナップショットをまたいで取り消す（7 → 6、さらに 6 → 5）
+    assert history.undo("map") == 8
+    assert _farmers(history.checkout("map")).equals(states[5])
+    assert history.undo("map") == 9
+    assert _farmers(history.checkout("map")).equals(states[4])
+
+    # 別のインスタンスからも同じ内容を読める
+    reopened = MapHistory(root=str(tmp_path), snapshot_interval=3)
+    assert reopened.head("map") == 9
+    assert _farmers(reopened.checkout("map", 4)).equals(states[3])
+    with pytest.raises(ValueError):
+        reopened.checkout("map", 10)
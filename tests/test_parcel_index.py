@@ -0,0 +1,69 @@
+import math
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+from functions.parcel_index import ParcelIndex
+
+AREAS = ["1250", " 12.5 ", "abc", None, "nan", "1e3", 7, np.nan, "", "inf", "-5", "1,000"]
+
+
+def _area_reference(values, area_min, area_max):
+    """filiter の行ごとの判定と同じく float() で変換した結果"""
+    positions = []
+    for i, value in enumerate(values):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            continue
+        try:
+            area = float(value)
+        except (ValueError, TypeError):
+            continue
+        if area_min is not None and area < area_min:
+            continue
+        if area_max is not None and area > area_max:
+            continue
+        positions.append(i)
+    return positions
+
+
+def test_lookup_matches_pandas(parcels):
+    index = ParcelIndex(parcels)
+
+    for column in ("FarmerIndicationNumberHash", "ClassificationOfLandCodeName", "land_type"):
+        for value in parcels[column].dropna().unique():
+            expected = np.flatnonzero((parcels[column] == value).to_numpy())
+            assert index.lookup(column, value).tolist() == expected.tolist()
+
+    # 索引の無い列は初めて使われた時に作る
+    expected = np.flatnonzero((parcels["Tiban"] == parcels["Tiban"].iloc[0]).to_numpy())
+    assert index.lookup("Tiban", parcels["Tiban"].iloc[0]).tolist() == expected.tolist()
+
+    assert len(index.lookup("Settlement_name", "存在しない集落")) == 0
+    assert len(index.lookup("Settlement_name", ["筑地"])) == 0
+    assert len(index.lookup("no_such_column", "x")) == 0
+
+
+@pytest.mark.parametrize("area_min, area_max", [
+    (None, None), (10, None), (None, 100), (12.5, 1250), (2000, None), (-10, -1),
+])
+def test_area_range_matches_float_conversion(area_min, area_max):
+    gdf = gpd.GeoDataFrame({"AreaOnRegistry": AREAS}, geometry=[Point(0, 0)] * len(AREAS))
+    index = ParcelIndex(gdf, columns=())
+
+    assert index.area_range(area_min, area_max).tolist() == _area_reference(AREAS, area_min, area_max)
+
+
+def test_area_range_on_sample(parcels):
+    index = ParcelIndex(parcels)
+    values = parcels["AreaOnRegistry"].tolist()
+
+    for area_min, area_max in [(None, None), (500, None), (None, 1000), (800, 1500)]:
+        assert index.area_range(area_min, area_max).tolist() == _area_reference(values, area_min, area_max)
+
+    # 数値の列もそのまま使える
+    numeric_values = pd.to_numeric(parcels["AreaOnRegistry"], errors="coerce")
+    numeric = ParcelIndex(parcels.assign(AreaOnRegistry=numeric_values))
+    assert numeric.area_range(800, 1500).tolist() == _area_reference(numeric_values.tolist(), 800, 1500)
@@ -0,0 +1,85 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from functions.map_history import PARCEL_ID
+from functions.parcel_store import MAP_LAYER, ROW_LAYER, ParcelStore, encode_nested, write_geojson
+
+FARMER = "FarmerIndicationNumberHash"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ParcelStore(ref_dir=str(tmp_path))
+
+
+def _assert_same_parcels(actual, expected):
+    actual = actual.set_index(PARCEL_ID).sort_index()
+    expected = encode_nested(expected).set_index(PARCEL_ID).sort_index()
+    assert list(actual.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(actual.drop(columns="geometry")), pd.DataFrame(expected.drop(columns="geometry")), check_dtype=False
+    )
+    assert actual.geometry.geom_equals_exact(expected.geometry, tolerance=0).all()
+
+
+@pytest.mark.parametrize("layer", ["other", MAP_LAYER, ROW_LAYER])
+def test_save_and_load_round_trip(store, tmp_path, parcels, layer):
+    store.save(layer, parcels)
+
+    _assert_same_parcels(store.load(layer), parcels)
+    # 別のストアからはファイル（履歴・分割）を読み直す
+    _assert_same_parcels(ParcelStore(ref_dir=str(tmp_path)).load(layer), parcels)
+
+
+def test_update_writes_only_changed_parcels(store, tmp_path, parcels):
+    assert store.save(MAP_LAYER, parcels) == 1
+    edited = store.load(MAP_LAYER).copy()
+    changed = (edited.index % 50 == 0)
+    edited.loc[changed, FARMER] = "edited"
+
+    assert store.update(MAP_LAYER, edited, changed, message="修正") == 2
+    assert store.versions(MAP_LAYER)[-1]["changed"] == changed.sum()
+    reloaded = ParcelStore(ref_dir=str(tmp_path)).load(MAP_LAYER)
+    _assert_same_parcels(reloaded, edited)
+
+    # 直前の操作を取り消すと元の状態に戻る
+    assert store.restore(MAP_LAYER) == 3
+    _assert_same_parcels(store.load(MAP_LAYER), parcels)
+
+
+def test_legacy_geojson_is_imported_once(store, tmp_path, parcels):
+    write_geojson(parcels, str(tmp_path / f"{MAP_LAYER}.geojson"))
+
+    _assert_same_parcels(store.load(MAP_LAYER), parcels)
+    assert store.stamp(MAP_LAYER) == 1
+    assert [v["message"] for v in store.versions(MAP_LAYER)] == ["既存のファイルから取り込み"]
+
+
+@pytest.mark.parametrize("layer", [MAP_LAYER, ROW_LAYER])
+def test_concurrent_loads_convert_and_index_once(store, tmp_path, parcels, layer):
+    write_geojson(parcels, str(tmp_path / f"{layer}.geojson"))
+    start = threading.Barrier(8)
+    results, errors = [], []
+
+    def work():
+        try:
+            start.wait()
+            results.append((store.load(layer), store.load_index(layer), store.load_spatial_index(layer)))
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    # 旧形式の変換・読み込み・インデックスの作成はそれぞれ一度だけ
+    for i in range(3):
+        assert len({id(result[i]) for result in results}) == 1
+    if layer == MAP_LAYER:
+        assert len(store.versions(MAP_LAYER)) == 1
+    _assert_same_parcels(results[0][0], parcels)
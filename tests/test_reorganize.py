@@ -0,0 +1,308 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+from functions import reorganize as reorganize_module
+from functions.reorganize import (
+    Scenario, _PartitionHierarchy, _PartitionModel, _classified_pieces, _create_tahata_gdf, _getbasepoints, _partition,
+    _partition_hierarchy, _piece_sides, _put_existing_farmers, _scenario_sides,
+    reorganize, reorganize_incremental, reorganize_many, reorganize_split
+)
+from functions.reorganize_cache import ReorganizeCache, cached_reorganize
+
+FARMER_A = "2dacba93d45b0f46a25b29b985bd90e2"
+FARMER_B = "10aad9b486abee43973bb555cc3362c2"
+FARMER_C = "7db8af145bda49552f855ba395906a2f"
+
+
+@pytest.fixture(autouse=True)
+def partition_cache(monkeypatch, tmp_path):
+    # 区画化の結果・階層（method="clusters" で作られる）はテストごとの一時ディレクトリに保存する
+    cache_dir = tmp_path / "partition"
+    monkeypatch.setattr(reorganize_module, "PARTITION_CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(reorganize_module, "_partitions", reorganize_module.OrderedDict())
+    monkeypatch.setattr(reorganize_module, "_hierarchies", reorganize_module.OrderedDict())
+    return cache_dir
+
+
+def _scenario(method: str = "capacity", ta_farmer_N: int = 5) -> Scenario:
+    return Scenario(
+        ta_farmer_N=ta_farmer_N,
+        hata_farmer_N=2,
+        ta_exfarmer_ids_and_rates={FARMER_A: 3, FARMER_B: 2, FARMER_C: 2},
+        hata_exfarmer_ids_and_rates={FARMER_A: 1},
+        method=method,
+    )
+
+
+def _baseline_merge(farmland: gpd.GeoDataFrame, labels: np.ndarray, target_n: int) -> np.ndarray:
+    """クラスタをdissolveして、最も面積の小さいクラスタを最も近いクラスタに統合する元の処理"""
+    farmland = farmland.assign(cluster=labels)
+    grouped = farmland.dissolve(by="cluster")
+    change_cluster_id = {}
+    while len(grouped) > target_n:
+        smallest_idx = grouped.area.idxmin()
+        smallest_poly = grouped.loc[smallest_idx]
+        remaining = grouped.drop(smallest_idx)
+        nearest_idx = remaining.distance(smallest_poly.geometry).idxmin()
+        grouped.loc[nearest_idx, "geometry"] = remaining.loc[nearest_idx].geometry.union(smallest_poly.geometry)
+        grouped = grouped.drop(smallest_idx)
+        change_cluster_id[smallest_idx] = nearest_idx
+    result = np.asarray(labels).copy()
+    for k, v in change_cluster_id.items():
+        result[result == k] = v
+    return result
+
+
+def _square(x: float, y: float, size: float):
+    return box(x, y, x + size, y + size)
+
+
+def test_merge_clusters_isolated_cluster_matches_baseline():
+    # 0: 孤立した小さいクラスタ（探索範囲を広げると 1 と 3 が見つかり、2 は見つからない）
+    # 1: 0 の統合先。統合後のクラスタからは 3 より 2 の方が近い
+    farmland = gpd.GeoDataFrame(geometry=[
+        _square(0, 0, 0.1),
+        _square(0, -10.5, 1),
+        _square(15, -10.5, 3),
+        _square(0, 16, 3),
+    ], crs="EPSG:6674")
+    labels = np.arange(len(farmland))
+    model = _PartitionModel(farmland, 2)
+
+    merged = model.merge_clusters(farmland, labels, 2, radius=1.0)
+
+    np.testing.assert_array_equal(merged, _baseline_merge(farmland, labels, 2))
+
+
+def test_merge_clusters_scattered_matches_baseline():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 500, size=(60, 2))
+    sizes = rng.uniform(1, 8, size=60)
+    farmland = gpd.GeoDataFrame(
+        geometry=[_square(x, y, s) for (x, y), s in zip(points, sizes)], crs="EPSG:6674")
+    labels = np.arange(len(farmland))
+    model = _PartitionModel(farmland, 1)
+
+    for target_n in (1, 5, 20, 40):
+        merged = model.merge_clusters(farmland, labels, target_n, radius=5.0)
+        np.testing.assert_array_equal(merged, _baseline_merge(farmland, labels, target_n))
+
+
+@pytest.mark.parametrize("method", ["capacity", "clusters"])
+def test_reorganize_plan_index_is_unique(parcels, method):
+    plan, _ = reorganize(parcels, _scenario(method))
+
+    assert len(plan) == len(parcels)
+    assert plan.index.is_unique
+
+
+def test_capacity_plan_index_is_unique_for_many_and_incremental(parcels):
+    scenario = _scenario()
+    ((plan, result), (other_plan, _)), _ = reorganize_many(parcels, [scenario, _scenario(ta_farmer_N=6)])
+    assert plan.index.is_unique
+    assert other_plan.index.is_unique
+
+    changed, _ = reorganize_incremental(parcels, _scenario(ta_farmer_N=6), plan, result, scenario)
+    assert changed.index.is_unique
+
+
+def test_cached_capacity_plan_index_is_unique(parcels, tmp_path):
+    cache = ReorganizeCache(root=str(tmp_path / "reorganize"))
+    plan, _ = cached_reorganize(parcels, _scenario(), cache=cache)
+    cached, _ = cached_reorganize(parcels, _scenario(), cache=cache)
+
+    assert plan.index.is_unique
+    assert cached.index.is_unique
+
+
+def test_parallel_reorganize_matches_sequential(parcels, monkeypatch, tmp_path):
+    # ワーカープロセスには共有の農地データと行位置だけを渡し、割り当ては同じになる
+    monkeypatch.setattr(reorganize_module, "PARALLEL_MIN_PARCELS", 0)
+    monkeypatch.setattr(reorganize_module, "SHARED_DIR", str(tmp_path / "shared"))
+    scenario = Scenario(
+        ta_farmer_N=5,
+        hata_farmer_N=2,
+        ta_exfarmer_ids_and_rates={FARMER_A: 3, FARMER_B: 2, FARMER_C: 2},
+        hata_exfarmer_ids_and_rates={},
+    )
+    columns = ["polygon_uuid", "ClassificationOfLand", "FarmerIndicationNumberHash", "cluster", "reorganized"]
+
+    sequential, _ = reorganize(parcels, scenario, parallel=False)
+    parallel, result = reorganize(parcels, scenario, parallel=True)
+    (many, _), = reorganize_many(parcels, [scenario], parallel=True)[0]
+
+    assert parallel[columns].equals(sequential[columns])
+    assert many[columns].equals(sequential[columns])
+    assert set(result.farmers_worktime_reduced) == {FARMER_A, FARMER_B, FARMER_C}
+    assert list((tmp_path / "shared").iterdir()) == []
+
+
+def _two_settlements(parcels: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    # サンプルの集落を東にずらした複製を別の集落として加える
+    other = parcels.copy()
+    other["geometry"] = other.geometry.translate(0.05, 0)
+    other["Settlement_name"] = "複製"
+    other["polygon_uuid"] = other["polygon_uuid"] + "-copy"
+    return gpd.GeoDataFrame(pd.concat([parcels, other], ignore_index=True), crs=parcels.crs)
+
+
+def test_parallel_split_matches_sequential(parcels, monkeypatch, tmp_path):
+    # 範囲ごとの再編成をプロセスプールで実行しても、範囲ごとに順に実行した場合と同じになる
+    monkeypatch.setattr(reorganize_module, "PARALLEL_MIN_PARCELS", 0)
+    monkeypatch.setattr(reorganize_module, "SHARED_DIR", str(tmp_path / "shared"))
+    scenario = Scenario(
+        ta_farmer_N=5,
+        hata_farmer_N=2,
+        ta_exfarmer_ids_and_rates={FARMER_A: 3, FARMER_B: 2, FARMER_C: 2},
+        hata_exfarmer_ids_and_rates={},
+    )
+    columns = ["polygon_uuid", "ClassificationOfLand", "FarmerIndicationNumberHash", "cluster", "reorganized"]
+    big = _two_settlements(parcels)
+
+    sequential, _ = reorganize_split(big, scenario, parallel=False)
+    parallel, result = reorganize_split(big, scenario, max_workers=2, parallel=True)
+
+    assert list(parallel.columns) == list(sequential.columns)
+    assert parallel[columns].equals(sequential[columns])
+    assert parallel.index.is_unique and len(parallel) == len(big)
+    assert {FARMER_A, FARMER_B, FARMER_C} <= set(result.farmers_worktime_reduced)
+    assert list((tmp_path / "shared").iterdir()) == []
+
+
+@pytest.mark.parametrize("method", ["capacity", "clusters"])
+def test_split_farmers_follow_area_share(parcels, method):
+    # 新規農家の数・現農家の面積は、範囲について合計するとシナリオと同じになる（範囲の数だけ増えない）
+    scenario = Scenario(
+        ta_farmer_N=5,
+        hata_farmer_N=2,
+        ta_exfarmer_ids_and_rates={FARMER_A: 3, FARMER_B: 2, FARMER_C: 2},
+        hata_exfarmer_ids_and_rates={},
+        method=method,
+    )
+    pieces = _classified_pieces(_two_settlements(parcels).set_crs(epsg=4326, allow_override=True), "settlement", 0)
+    piece_sides = _piece_sides(scenario, pieces)
+
+    for number, side in enumerate(_scenario_sides(scenario)):
+        areas = [piece[number + 2].geometry.to_crs(epsg=32654).area.sum() for piece in pieces]
+        split = [sides[number] for sides in piece_sides]
+        assert sum(piece_side.newfarmer_N for piece_side in split) == side.newfarmer_N
+        for farmer, rate in zip(side.exfarmer_ids, side.arearates):
+            allocated = sum(piece_side.arearates[piece_side.exfarmer_ids.index(farmer)] * area
+                            for piece_side, area in zip(split, areas) if farmer in piece_side.exfarmer_ids)
+            assert allocated == pytest.approx(rate * sum(areas))
+
+
+def test_partition_cache_is_bounded(parcels, partition_cache, monkeypatch):
+    _partition(parcels, 2)
+    entry_bytes = sum(path.stat().st_size for path in partition_cache.iterdir())
+    monkeypatch.setattr(reorganize_module, "MAX_PARTITION_CACHE_BYTES", entry_bytes * 3)
+    for k in (3, 4, 5, 6):
+        _partition(parcels, k)
+
+    # 上限を超えた分は使われていない順に削除される
+    files = list(partition_cache.iterdir())
+    assert sum(path.stat().st_size for path in files) <= entry_bytes * 3
+    counts = {path.name.split(".")[0].rsplit("-", 1)[1] for path in files}
+    assert "2" not in counts
+    assert "6" in counts
+
+
+def test_extended_hierarchy_is_saved(parcels, partition_cache):
+    hierarchy = _partition_hierarchy(parcels)
+    count = hierarchy.base_n + 5
+    labels = hierarchy.labels(count, parcels)
+
+    saved = _PartitionHierarchy.load(hierarchy.path)
+    assert len(saved.splits) == len(hierarchy.splits) == 5
+    np.testing.assert_array_equal(saved.labels(count, parcels), labels)
+
+
+@pytest.mark.parametrize("distance", [30, 100])
+def test_create_tahata_gdf_matches_per_parcel_loop(parcels, distance):
+    original = parcels["ClassificationOfLand"].copy()
+    metric = parcels.geometry.to_crs(epsg=32654)
+    expected = original.copy()
+    for i, geom in enumerate(metric):
+        counts = original[(metric.distance(geom) <= distance).to_numpy()].value_counts()
+        ta, hata = counts.get("1", 0), counts.get("2", 0)
+        current = original.iloc[i]
+        if current in ("2", "1, 2", "2, 1") and ta > hata:
+            expected.iloc[i] = "1"
+        elif current == "1" and hata > ta:
+            expected.iloc[i] = "2"
+        elif current in ("1, 2", "2, 1") and hata >= ta:
+            expected.iloc[i] = "2"
+
+    ta_gdf, hata_gdf = _create_tahata_gdf(parcels, distance)
+
+    assert (parcels["ClassificationOfLand"] == expected).all()
+    assert (expected != original).any()
+    assert ta_gdf.index.tolist() == expected.index[expected == "1"].tolist()
+    assert hata_gdf.index.tolist() == expected.index[expected == "2"].tolist()
+
+
+@pytest.mark.parametrize("distance", [100, 1000])
+def test_getbasepoints_matches_per_farmer_loop(parcels, distance):
+    farmers = [FARMER_A, FARMER_B, FARMER_C]
+    expected = {}
+    for farmer in farmers:
+        farms = parcels[parcels["FarmerIndicationNumberHash"] == farmer]
+        metric = farms.geometry.to_crs(epsg=32654)
+        totals = [metric.area[(metric.distance(geom) <= distance).to_numpy()].sum() for geom in metric]
+        # 合計が同じ場合は先に現れる農地
+        expected[farmer] = farms.geometry.iloc[int(np.argmax(totals))].centroid.coords[0]
+
+    basepoints = _getbasepoints(parcels, farmers + ["no_such_farmer"], distance=distance)
+
+    assert list(basepoints) == farmers + ["no_such_farmer"]
+    for farmer in farmers:
+        assert basepoints[farmer] == pytest.approx(expected[farmer])
+    # 農地を持たない農家には、いずれかの農地の重心を経緯度で返す
+    centroids = {geom.centroid.coords[0] for geom in parcels.geometry}
+    assert basepoints["no_such_farmer"] in centroids
+
+
+def test_estimate_eps_matches_distance_matrix(parcels):
+    from scipy.spatial import distance_matrix
+
+    farmland = parcels.to_crs(epsg=6674)
+    model = _PartitionModel(farmland, 5)
+    centroids = np.array([geom.centroid.coords[0] for geom in farmland.geometry])
+    distances = distance_matrix(centroids, centroids)
+    np.fill_diagonal(distances, np.inf)
+
+    np.testing.assert_allclose(model.centroids(farmland), centroids)
+    assert model.estimate_eps(farmland) == pytest.approx(np.percentile(distances.min(axis=1), 75))
+
+
+def test_put_existing_farmers_grows_contiguous_regions():
+    # 50m 四方のクラスターが接する 6×6 の格子と、離れた場所にある 2 つのクラスター
+    squares = [_square(x * 50, y * 50, 50) for y in range(6) for x in range(6)]
+    squares += [_square(5000, 0, 50), _square(5050, 0, 50)]
+    clusters = gpd.GeoDataFrame(geometry=squares, crs="EPSG:6674")
+    parcels = clusters.assign(cluster=clusters.index, FarmerIndicationNumberHash=None, reorganized=False)
+    lonlat = clusters.geometry.centroid.to_crs(epsg=4326)
+
+    def at(i, dx=0.0):
+        return (lonlat.iloc[i].x + dx, lonlat.iloc[i].y)
+
+    # A と B は同じクラスターが最も近い（A の方が近い）。C は離れたクラスターの近くにいる
+    basepoints = {"A": at(0), "B": at(0, 0.0002), "C": at(36)}
+    area_nums = {"A": 5, "B": 4, "C": 4}
+
+    parcels, result = _put_existing_farmers(parcels, clusters.copy(), basepoints, area_nums)
+
+    owners = result["FarmerIndicationNumberHash"]
+    assert owners.value_counts().to_dict() == area_nums
+    assert owners.iloc[0] == "A"
+    assert owners.iloc[36] == owners.iloc[37] == "C"
+    # 離れたクラスターを使い切った C は、最も近い格子の端から広げる
+    assert set(owners.index[owners == "C"]) == {36, 37, 5, 11}
+    for farmer in ("A", "B"):
+        region = clusters.geometry[owners == farmer]
+        assert region.union_all().geom_type == "Polygon"
+    assert (result["reorganized"] == owners.notna()).all()
+    assert parcels["FarmerIndicationNumberHash"].tolist() == owners.tolist()
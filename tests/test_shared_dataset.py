@@ -0,0 +1,53 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from functions.parcel_store import encode_nested
+from functions.shared_dataset import close_shared, open_shared, write_shared
+
+
+def test_write_and_open_round_trip(tmp_path, parcels):
+    path = str(tmp_path / "parcels.arrow")
+    encoded = encode_nested(parcels)
+    write_shared(encoded, path)
+
+    dataset = open_shared(path)
+    gdf = dataset.to_geodataframe()
+
+    assert len(dataset) == len(parcels)
+    assert list(gdf.columns) == list(encoded.columns)
+    assert gdf.crs == parcels.crs
+    pd.testing.assert_frame_equal(pd.DataFrame(gdf.drop(columns="geometry")), pd.DataFrame(encoded.drop(columns="geometry")))
+    assert gdf.geometry.geom_equals_exact(parcels.geometry, tolerance=0).all()
+
+    # 行・列の一部だけを取り出す
+    rows = np.array([5, 0, 100])
+    subset = dataset.to_geodataframe(rows, columns=["polygon_uuid"])
+    assert sorted(subset.columns) == ["geometry", "polygon_uuid"]
+    assert subset["polygon_uuid"].tolist() == parcels["polygon_uuid"].iloc[rows].tolist()
+
+    # 数値列はマップしたバッファを読み取り専用で参照する
+    lng, lat = dataset.points()
+    assert not lng.flags.writeable
+    assert np.array_equal(lat, parcels["point_lat"].to_numpy())
+
+
+def test_open_shared_reuses_mapping_until_replaced(tmp_path, parcels):
+    path = str(tmp_path / "parcels.arrow")
+    write_shared(encode_nested(parcels), path)
+
+    dataset = open_shared(path)
+    assert open_shared(path) is dataset
+    # pickle ではパスだけを渡し、同じマップを使う
+    assert pickle.loads(pickle.dumps(dataset)) is dataset
+
+    write_shared(encode_nested(parcels.iloc[:10]), path)
+    replaced = open_shared(path)
+    assert replaced is not dataset
+    assert len(replaced) == 10
+    # 置き換える前のマップも読み続けられる
+    assert len(dataset.to_geodataframe()) == len(parcels)
+
+    close_shared(path)
+    assert open_shared(path) is not replaced
@@ -0,0 +1,41 @@
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Point, box, mapping
+
+from functions.spatial_index import METRIC_EPSG, SpatialIndex
+
+
+def _reference(parcels, geometry):
+    """すべての農地と投影座標系で比較した結果"""
+    metric = parcels.geometry.to_crs(epsg=METRIC_EPSG)
+    query = gpd.GeoSeries([geometry], crs=4326).segmentize(0.001).to_crs(epsg=METRIC_EPSG).iloc[0]
+    return np.flatnonzero(metric.intersects(query).to_numpy())
+
+
+def test_bbox_and_polygon_match_brute_force(parcels):
+    index = SpatialIndex(parcels)
+    min_lon, min_lat, max_lon, max_lat = parcels.total_bounds
+    mid_lon, mid_lat = (min_lon + max_lon) / 2, (min_lat + max_lat) / 2
+
+    query = box(min_lon, min_lat, mid_lon, mid_lat)
+    expected = _reference(parcels, query)
+    assert 0 < len(expected) < len(parcels)
+    assert index.bbox(min_lon, min_lat, mid_lon, mid_lat).tolist() == expected.tolist()
+
+    triangle = Point(mid_lon, mid_lat).buffer(0.002, resolution=1)
+    expected = _reference(parcels, triangle)
+    assert index.polygon(triangle).tolist() == expected.tolist()
+    # GeoJSONのgeometryでも同じ結果になる
+    assert index.polygon(mapping(triangle)).tolist() == expected.tolist()
+
+    assert len(index.bbox(0, 0, 1, 1)) == 0
+
+
+def test_radius_matches_metric_distance(parcels):
+    index = SpatialIndex(parcels)
+    centroid = parcels.geometry.to_crs(epsg=METRIC_EPSG).union_all().centroid
+    center = gpd.GeoSeries([centroid], crs=METRIC_EPSG).to_crs(epsg=4326).iloc[0]
+    distance = parcels.geometry.to_crs(epsg=METRIC_EPSG).distance(centroid).to_numpy()
+
+    for radius in (0, 100, 200, 1000):
+        assert index.radius(center.x, center.y, radius).tolist() == np.flatnonzero(distance <= radius).tolist()
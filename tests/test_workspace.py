@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from functions.parcel_store import MAP_LAYER, REORG_LAYER, ParcelStore
+from functions.workspace import Workspace, WorkspaceManager
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ParcelStore(ref_dir=str(tmp_path))
+
+
+def test_workspace_starts_empty(store):
+    workspace = Workspace("a", store)
+
+    assert workspace.head(MAP_LAYER) == 0
+    assert len(workspace.load(MAP_LAYER)) == 0
+    assert len(workspace.load(REORG_LAYER)) == 0
+
+
+def test_workspace_keeps_only_head_and_rebuilds_versions(store, parcels):
+    workspace = Workspace("a", store)
+    for size in (300, 250, 200):
+        workspace.save(MAP_LAYER, parcels.iloc[:size], message=f"{size}件")
+
+    assert list(workspace._heads) == [MAP_LAYER]
+    assert len(workspace.load(MAP_LAYER)) == 200
+
+    # 過去の版は履歴から復元する
+    workspace.restore(MAP_LAYER, 1)
+    assert len(workspace.load(MAP_LAYER)) == 300
+    workspace.restore(MAP_LAYER)
+    assert len(workspace.load(MAP_LAYER)) == 200
+    with pytest.raises(ValueError):
+        workspace.restore(MAP_LAYER, 99)
+
+
+def test_workspace_update_records_changed_rows(store, parcels):
+    workspace = Workspace("a", store)
+    workspace.save(REORG_LAYER, parcels)
+    edited = workspace.load(REORG_LAYER).copy()
+    changed = edited.index < 3
+    edited.loc[changed, "FarmerIndicationNumberHash"] = "edited"
+
+    version = workspace.update(REORG_LAYER, edited, changed, message="修正")
+
+    assert workspace.versions(REORG_LAYER)[-1]["changed"] == 3
+    workspace.spill()
+    reloaded = Workspace("a", store).load(REORG_LAYER)
+    assert version == 2
+    assert (reloaded["FarmerIndicationNumberHash"] == "edited").sum() == 3
+
+
+def test_workspace_is_safe_across_threads(store, parcels):
+    workspace = Workspace("a", store)
+    errors = []
+
+    def work(offset):
+        try:
+            for step in range(5):
+                workspace.save(MAP_LAYER, parcels.iloc[:100 + offset * 10 + step], message="検索")
+                workspace.load_index(MAP_LAYER)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert [v["version"] for v in workspace.versions(MAP_LAYER)] == list(range(1, 21))
+
+
+def test_manager_releases_idle_workspaces(store, parcels):
+    manager = WorkspaceManager(store, max_active=1)
+    with manager.use("a") as a:
+        a.save(MAP_LAYER, parcels)
+        manager.get("b")
+        # 使用中の作業領域はメモリから外さない
+        assert "a" in manager._active and a._heads
+
+    manager.get("c")
+    assert "a" not in manager._active
+    assert len(manager.get("a").load(MAP_LAYER)) == len(parcels)